@@ -0,0 +1,115 @@
+# analysis_columnar.py
+"""
+analysis/test.py: построчный analyze_wtb против колоночного columnar.py
+на синтетическом дампе в несколько миллионов WTB-строк.
+
+    python bench/analysis_columnar.py --rows 3000000
+    python bench/analysis_columnar.py --rows 3000000 --stale 0.02   # доля строк старой ревизии
+    python bench/analysis_columnar.py --dsn "$PG_DSN"               # ещё и чтение из БД, как в CLI
+
+Дамп: base строк корпуса (corpus.generate), размеченных tagging.derive_many,
+размножается до --rows со сдвигом id и времени — разметка дорогая, а
+распределения тегов и чатов от повторов не меняются. Обе реализации
+получают строки в том виде, в каком их отдаёт psycopg: analyze_wtb —
+dict'ы, columnar — кортежи пачками. Счётчики сверяются.
+"""
+import os
+import sys
+import gc
+import time
+import argparse
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "update"))
+sys.path.insert(0, os.path.join(ROOT, "analysis"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+import columnar  # noqa: E402
+import test as rows_engine  # noqa: E402  (analysis/test.py)
+from tagging import TAGS_REVISION, derive_many  # noqa: E402
+
+_COUNTERS = ("total_wtb", "cat_counters", "overall_tags", "top_chats", "top_countries", "top_exchanges")
+
+
+def make_base(n: int, seed: int) -> list[dict]:
+    src = list(corpus.generate(n, seed=seed, span_days=30))
+    derived = derive_many(r["text"] for r in src)
+    return [
+        {"id": i + 1, "ts_utc": r["ts_utc"], "chat_id": r["chat_id"], "sender_id": r["sender_id"],
+         "is_wtb": d.is_wtb, "tags": d.tags, "tags_rev": TAGS_REVISION, "text": r["text"]}
+        for i, (r, d) in enumerate(zip(src, derived)) if d.is_wtb
+    ]
+
+
+def dump(base: list[dict], rows: int, stale: float):
+    """rows строк: копии base со сдвигом id и времени; каждая 1/stale-я — старой ревизии."""
+    every = int(1 / stale) if stale > 0 else 0
+    n = len(base)
+    for i in range(rows):
+        b = base[i % n]
+        k = i // n
+        r = dict(b, id=b["id"] + k * n, ts_utc=b["ts_utc"] - timedelta(days=30 * k))
+        if every and i % every == 0:
+            r["tags_rev"], r["tags"], r["is_wtb"] = None, None, None
+        yield r
+
+
+def _timed(fn):
+    gc.collect()
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Row loop vs columnar analysis of WTB messages")
+    ap.add_argument("--rows", type=int, default=3_000_000)
+    ap.add_argument("--base", type=int, default=100_000, help="Corpus rows to tag before replication")
+    ap.add_argument("--stale", type=float, default=0.0, help="Share of rows with an outdated tags_rev")
+    ap.add_argument("--chunk", type=int, default=columnar.ANALYSIS_CHUNK_ROWS)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dsn", type=str, default=None, help="Also time both engines reading this database")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    base = make_base(args.base, args.seed)
+    print(f"base: {len(base):,} WTB rows tagged in {time.perf_counter() - t0:.1f}s; dump: {args.rows:,} rows")
+    texts = {r["id"]: r["text"] for r in base}
+
+    def body(ids):
+        return {i: texts.get((i - 1) % len(base) + 1) for i in ids}
+
+    dicts = list(dump(base, args.rows, args.stale))
+    old, t_rows = _timed(lambda: rows_engine.analyze_wtb(dicts))
+    del dicts
+
+    tuples = [tuple(r[c] for c in columnar.ROW_COLUMNS) for r in dump(base, args.rows, args.stale)]
+    frame, t_build = _timed(lambda: columnar.from_rows(tuples, args.chunk))
+    del tuples
+    new, t_group = _timed(lambda: columnar.analyze(frame, body))
+    _, t_day = _timed(lambda: frame.tags_by_period("day"))
+    _, t_hour = _timed(lambda: frame.tags_by_period("hour"))
+    _, t_chat = _timed(lambda: frame.breakdown("chat_id", "countries"))
+
+    same = all(old[k] == new[k] for k in _COUNTERS)
+    print(f"\nrows engine (analyze_wtb):   {t_rows:7.2f}s  {args.rows / t_rows:>12,.0f} rows/s")
+    print(f"columnar: build Arrow        {t_build:7.2f}s  {args.rows / t_build:>12,.0f} rows/s")
+    print(f"          report group-bys   {t_group:7.2f}s")
+    print(f"          tags per day/hour  {t_day:7.2f}s / {t_hour:.2f}s")
+    print(f"          chat x countries   {t_chat:7.2f}s")
+    total = t_build + t_group
+    print(f"columnar total               {total:7.2f}s  x{t_rows / total:.1f}   counters match: {same}")
+    print(f"frame: {len(frame):,} rows, {frame.table.nbytes / 1e6:.1f} MB in Arrow")
+
+    if args.dsn:
+        rows_engine.PG_DSN = columnar.PG_DSN = args.dsn
+        _, t_db_rows = _timed(lambda: rows_engine.analyze_wtb(rows_engine.fetch_messages()))
+        _, t_db_col = _timed(lambda: columnar.analyze(columnar.load(dsn=args.dsn),
+                                                      lambda ids: columnar.fetch_texts(ids, args.dsn)))
+        print(f"\nfrom DB: rows {t_db_rows:.2f}s, columnar {t_db_col:.2f}s (x{t_db_rows / t_db_col:.1f})")
+
+
+if __name__ == "__main__":
+    main()
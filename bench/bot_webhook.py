@@ -0,0 +1,266 @@
+# bot_webhook.py
+"""
+Polling против webhook: латентность callback-запросов бота.
+
+Поднимает заглушку Bot API (aiohttp), запускает update/bot.py отдельным
+процессом с BOT_API_SERVER на неё и шлёт фейковые callback_query
+(like_/dislike_ по реальным row_id из bench-базы):
+
+  polling — апдейты отдаются боту через getUpdates;
+  webhook — POST на WEBHOOK_PATH бота, как это делает Telegram.
+
+Латентность — от момента «прихода» апдейта до answerCallbackQuery.
+
+    python bench/bot_webhook.py --mode polling,webhook --n 2000 --rate 200
+    python bench/bot_webhook.py --mode webhook --max-handlers 16 --json out.json
+
+Клики пишут реакции в БД, поэтому работает только с *bench*/*test* базой.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import signal
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg  # noqa: E402
+from aiohttp import web, ClientSession  # noqa: E402
+
+from db_load import DEFAULT_DSN, check_bench_target  # noqa: E402
+
+BOT_TOKEN = "123456:BENCH-token"
+OTC_CHAT_ID = -1009999999999
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: ровно то, что бот зовёт на пути callback_query."""
+
+    def __init__(self):
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.answered: Dict[str, float] = {}
+        self.calls: Counter = Counter()
+        self.polling = asyncio.Event()
+
+    async def _get_updates(self, timeout: float, limit: int) -> List[dict]:
+        out = []
+        try:
+            out.append(await asyncio.wait_for(self.updates.get(), timeout))
+        except asyncio.TimeoutError:
+            return out
+        while len(out) < limit and not self.updates.empty():
+            out.append(self.updates.get_nowait())
+        return out
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getMe":
+            result: Any = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            self.polling.set()
+            result = await self._get_updates(float(data.get("timeout") or 0), int(data.get("limit") or 100))
+        elif method == "answerCallbackQuery":
+            self.answered[data["callback_query_id"]] = time.perf_counter()
+            result = True
+        elif method in ("editMessageText", "editMessageReplyMarkup", "sendMessage"):
+            result = {
+                "message_id": int(data.get("message_id") or 1),
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id") or OTC_CHAT_ID), "type": "supergroup"},
+                "text": "ok",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+def make_callback(update_id: int, row_id: int, user_id: int, like: bool) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"},
+            "chat_instance": "1",
+            "data": f"{'like' if like else 'dislike'}_{row_id}",
+            "message": {
+                "message_id": 1000 + row_id % 100000,
+                "date": int(time.time()),
+                "chat": {"id": OTC_CHAT_ID, "type": "supergroup", "title": "otc"},
+                "text": "card",
+            },
+        },
+    }
+
+
+def load_row_ids(dsn: str, limit: int = 5000) -> List[int]:
+    with psycopg.connect(dsn) as conn:
+        rows = conn.execute("SELECT id FROM otc.messages_archive ORDER BY id DESC LIMIT %s", (limit,)).fetchall()
+    if not rows:
+        raise SystemExit("bench database is empty: run bench/db_load.py seed first")
+    return [r[0] for r in rows]
+
+
+async def _wait_port(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"bot did not open port {port}")
+
+
+def _pct(sorted_s: List[float], q: float) -> float:
+    if not sorted_s:
+        return 0.0
+    return round(sorted_s[min(len(sorted_s) - 1, int(q * len(sorted_s)))] * 1000.0, 2)
+
+
+async def run_mode(mode: str, *, dsn: str, n: int, rate: float, warmup: int, max_handlers: int,
+                   seed: int, verbose: bool) -> Dict[str, Any]:
+    api = FakeBotAPI()
+    api_port, hook_port = _free_port(), _free_port()
+    api_runner = await api.start(api_port)
+
+    env = dict(os.environ,
+               BOT_TOKEN=BOT_TOKEN,
+               BOT_API_SERVER=f"http://127.0.0.1:{api_port}",
+               BOT_MODE=mode,
+               WEBHOOK_HOST="127.0.0.1",
+               WEBHOOK_PORT=str(hook_port),
+               WEBHOOK_BASE_URL="",
+               BOT_MAX_HANDLERS=str(max_handlers),
+               BOT_METRICS_PORT="0",
+               BOT_STATE_BACKEND="memory",
+               PG_DSN=dsn)
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "update", "bot.py")],
+                            cwd=ROOT, env=env, stdout=out, stderr=out)
+
+    rnd = random.Random(seed)
+    row_ids = load_row_ids(dsn)
+    sent_at: Dict[str, float] = {}
+    try:
+        if mode == "webhook":
+            await _wait_port(hook_port, 30)
+        else:
+            await asyncio.wait_for(api.polling.wait(), 30)
+
+        hook_url = f"http://127.0.0.1:{hook_port}/tg/webhook"
+        async with ClientSession() as http:
+            async def inject(upd: dict) -> None:
+                sent_at[upd["callback_query"]["id"]] = time.perf_counter()
+                if mode == "webhook":
+                    async with http.post(hook_url, json=upd) as r:
+                        await r.read()
+                else:
+                    api.updates.put_nowait(upd)
+
+            total = warmup + n
+            t0 = time.perf_counter()
+            tasks = []
+            for i in range(total):
+                due = t0 + i / rate if rate > 0 else t0
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                upd = make_callback(i + 1, rnd.choice(row_ids), rnd.randint(1, 5000), rnd.random() < 0.8)
+                tasks.append(asyncio.create_task(inject(upd)))
+            await asyncio.gather(*tasks)
+
+            deadline = time.perf_counter() + 60
+            while len(api.answered) < total and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - t0
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        await api_runner.cleanup()
+
+    measured = [str(i + 1) for i in range(warmup, warmup + n)]
+    lat = sorted(api.answered[k] - sent_at[k] for k in measured if k in api.answered)
+    return {
+        "mode": mode,
+        "updates": n,
+        "answered": len(lat),
+        "seconds": round(elapsed, 2),
+        "answers_per_sec": round(len(api.answered) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": _pct(lat, 0.50),
+            "p95": _pct(lat, 0.95),
+            "p99": _pct(lat, 0.99),
+            "max": round(lat[-1] * 1000.0, 2) if lat else 0.0,
+        },
+        "api_calls": dict(api.calls),
+    }
+
+
+def print_report(rep: Dict[str, Any]) -> None:
+    lat = rep["latency_ms"]
+    print(f"\n=== {rep['mode']} ===")
+    print(f"answered: {rep['answered']:,}/{rep['updates']:,} in {rep['seconds']}s "
+          f"-> {rep['answers_per_sec']:,.1f} answers/s")
+    print(f"callback latency: p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms max={lat['max']}ms")
+    print(f"bot api calls: {rep['api_calls']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Callback-query latency of the bot: polling vs webhook")
+    ap.add_argument("--mode", type=str, default="polling,webhook")
+    ap.add_argument("--n", type=int, default=1000, help="Measured callback queries per mode")
+    ap.add_argument("--warmup", type=int, default=50)
+    ap.add_argument("--rate", type=float, default=100.0, help="Updates per second (0 = all at once)")
+    ap.add_argument("--max-handlers", type=int, default=64, help="BOT_MAX_HANDLERS for the bot process")
+    ap.add_argument("--dsn", type=str, default=DEFAULT_DSN)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", type=str, default=None)
+    ap.add_argument("--verbose", action="store_true", help="Show the bot's own log")
+    args = ap.parse_args()
+
+    check_bench_target(args.dsn, False)
+
+    reports = []
+    for mode in [m.strip() for m in args.mode.split(",") if m.strip()]:
+        rep = asyncio.run(run_mode(mode, dsn=args.dsn, n=args.n, rate=args.rate, warmup=args.warmup,
+                                   max_handlers=args.max_handlers, seed=args.seed, verbose=args.verbose))
+        print_report(rep)
+        reports.append(rep)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"\nSaved -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
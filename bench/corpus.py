@@ -0,0 +1,223 @@
+# corpus.py
+"""
+Генератор синтетического OTC-корпуса для бенчмарков.
+
+Похоже на реальные чаты: WTB/WTS/болтовня, @юзеры, t.me и https ссылки,
+телефоны, страны, биржи, банки, смешанные языки (en/ru/es/tr/zh),
+повторы одного и того же текста продавцом в разных чатах.
+
+    python bench/corpus.py --n 100000 --out data/corpus.jsonl.gz
+"""
+import gzip
+import json
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List
+
+EXCHANGES = [
+    "binance", "bybit", "okx", "bitget", "kucoin", "coinbase", "mexc", "kraken", "gate io",
+    "htx", "bingx", "whitebit", "cryptocom", "paxful", "coinlist", "weex",
+]
+BANKS = [
+    "revolut", "wise", "bunq", "n26", "monzo", "santander", "bbva", "paypal", "stripe",
+    "payoneer", "skrill", "zen", "paysera", "airwallex", "mercury", "cashapp", "wirex",
+]
+KYC = ["kyc", "sumsub", "onfido", "persona", "blockpass", "holonym", "buidlpad", "kaito"]
+SERVICES = ["tiktok", "temu", "airbnb", "esim", "bet365", "fragment", "twitter", "whatsapp", "ozon"]
+COUNTRIES = [
+    "usa", "spain", "germany", "italy", "mexico", "argentina", "brazil", "peru", "chile",
+    "colombia", "philippines", "indonesia", "vietnam", "nigeria", "kenya", "egypt", "india",
+    "pakistan", "turkey", "georgia", "armenia", "uruguay", "paraguay", "bolivia", "el salvador",
+]
+MISC = ["iban", "llc", "vcc", "passport", "old account", "ready acc", "merchant", "selfie", "escrow"]
+
+WTB_TEMPLATES = [
+    "WTB {ex} {kind} {country}",
+    "#wtb {ex} verified account {country}, paying {price}$",
+    "Need {bank} {country} business, DM {handle}",
+    "need {ex} kyc {country} asap {handle}",
+    "Looking for {bank} personal {country} + {misc}. {link}",
+    "Buying {svc} accounts bulk, escrow ok. contact {handle} or {phone}",
+    "WTB {ex} / {ex2} / {bank} any country\nprice {price}$\n{handle}",
+    "Куплю {ex} {country} верификация, пишите {handle}",
+    "Нужен {bank} {country}, оплата сразу. {link}",
+    "Compro cuenta {ex} {country} verificada, escribir {handle}",
+    "{ex} hesabı lazım {country}, wtb {handle}",
+    "收 {ex} 账号 {country} wtb {handle}",
+    "wtb {kyc} link {country} 🔥🔥 {price}$ {handle}",
+    "Need {misc} for {bank} + {ex}, {country} only! {phone}",
+]
+WTS_TEMPLATES = [
+    "WTS {ex} verified {country} {price}$ {handle}",
+    "#wts {bank} business accounts {country}, escrow {handle}",
+    "Selling {svc} aged accounts, {link}",
+    "selling {ex} kyc {country}, bulk discount. {phone}",
+    "Продам {bank} {country}, гарант {handle}",
+    "Vendo cuenta {ex} {country} {handle}",
+    "WTS {kyc} service any country {link}",
+]
+CHATTER_TEMPLATES = [
+    "anyone tried {ex} p2p today?",
+    "scam alert {handle} — don't deal",
+    "{bank} blocked my card again lol",
+    "гарант есть? {handle}",
+    "who has escrow for {ex}",
+    "gm",
+    "price check {svc} accs?",
+    "rules: no spam, use escrow. {link}",
+]
+
+FIRST = ["alex", "max", "crypto", "otc", "john", "dmitry", "kyc", "fast", "trusted", "maria", "ahmed", "li"]
+LAST = ["trade", "seller", "otc", "king", "deals", "shop", "exchange", "pro", "777", "store", "buyer"]
+
+
+def _handle(rng: random.Random) -> str:
+    return "@" + rng.choice(FIRST) + rng.choice(["_", ""]) + rng.choice(LAST) + str(rng.randint(0, 99))
+
+
+def _link(rng: random.Random) -> str:
+    r = rng.random()
+    if r < 0.5:
+        return "t.me/" + rng.choice(FIRST) + rng.choice(LAST)
+    if r < 0.8:
+        return "https://t.me/" + rng.choice(FIRST) + "_" + rng.choice(LAST)
+    return "https://" + rng.choice(LAST) + ".com/p/" + str(rng.randint(1000, 99999))
+
+
+def _phone(rng: random.Random) -> str:
+    cc = rng.choice(["+1", "+7", "+34", "+49", "+63", "+234", "+52"])
+    style = rng.random()
+    if style < 0.4:
+        return f"{cc} ({rng.randint(200, 999)}) {rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+    if style < 0.7:
+        return f"{cc}{rng.randint(10**9, 10**10 - 1)}"
+    return f"{cc} {rng.randint(100, 999)} {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}"
+
+
+def render(template: str, rng: random.Random) -> str:
+    ex, ex2 = rng.sample(EXCHANGES, 2)
+    return template.format(
+        ex=ex, ex2=ex2,
+        bank=rng.choice(BANKS),
+        kyc=rng.choice(KYC),
+        svc=rng.choice(SERVICES),
+        country=rng.choice(COUNTRIES),
+        misc=rng.choice(MISC),
+        kind=rng.choice(["acc", "account", "kyc", "verified", "business"]),
+        price=rng.choice([5, 10, 15, 20, 25, 40, 50, 80, 100, 150, 300]),
+        handle=_handle(rng),
+        link=_link(rng),
+        phone=_phone(rng),
+    )
+
+
+def generate(
+    n: int,
+    *,
+    seed: int = 42,
+    wtb_ratio: float = 0.35,
+    wts_ratio: float = 0.45,
+    chats: int = 300,
+    senders: int = 20000,
+    repeat_ratio: float = 0.3,
+    start: datetime | None = None,
+    span_days: int = 30,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Отдаёт n строк в формате save_message(): message_id, chat_id, sender_id,
+    sender_username, ts_utc, text, reply_to_msg_id (+ label: wtb/wts/chatter).
+
+    repeat_ratio — доля сообщений, где продавец повторяет свой прошлый текст
+    (обычно в другом чате): так выглядит реальный поток дубликатов.
+    """
+    rng = random.Random(seed)
+    start = start or (datetime.now(timezone.utc) - timedelta(days=span_days))
+    step = (span_days * 86400) / max(1, n)
+
+    chat_ids = [-1000000000000 - rng.randint(10**9, 3 * 10**9) for _ in range(chats)]
+    # немного обычных групп (id без -100)
+    chat_ids[: max(1, chats // 20)] = [-rng.randint(10**8, 10**9) for _ in range(max(1, chats // 20))]
+    usernames: Dict[int, str | None] = {}
+    last_text: Dict[int, tuple[str, str]] = {}
+    next_msg_id: Dict[int, int] = {c: rng.randint(1000, 500000) for c in chat_ids}
+
+    for i in range(n):
+        # продавцы распределены по Ципфу: немного очень активных
+        sender_id = 100000 + int(senders * (rng.random() ** 3))
+        if sender_id not in usernames:
+            usernames[sender_id] = _handle(rng)[1:] if rng.random() < 0.8 else None
+
+        chat_id = rng.choice(chat_ids)
+        if sender_id in last_text and rng.random() < repeat_ratio:
+            label, text = last_text[sender_id]
+        else:
+            r = rng.random()
+            if r < wtb_ratio:
+                label, text = "wtb", render(rng.choice(WTB_TEMPLATES), rng)
+            elif r < wtb_ratio + wts_ratio:
+                label, text = "wts", render(rng.choice(WTS_TEMPLATES), rng)
+            else:
+                label, text = "chatter", render(rng.choice(CHATTER_TEMPLATES), rng)
+            last_text[sender_id] = (label, text)
+
+        next_msg_id[chat_id] += rng.randint(1, 5)
+        mid = next_msg_id[chat_id]
+        yield {
+            "message_id": mid,
+            "chat_id": chat_id,
+            "sender_id": sender_id,
+            "sender_username": usernames[sender_id],
+            "ts_utc": start + timedelta(seconds=i * step),
+            "text": text,
+            "reply_to_msg_id": (mid - rng.randint(1, 50)) if rng.random() < 0.1 else None,
+            "label": label,
+        }
+
+
+def texts(n: int, seed: int = 42, **kw) -> List[str]:
+    return [r["text"] for r in generate(n, seed=seed, **kw)]
+
+
+def write_jsonl(rows, path: str) -> int:
+    opener = gzip.open if path.endswith(".gz") else open
+    cnt = 0
+    with opener(path, "wt", encoding="utf-8") as f:
+        for r in rows:
+            r = dict(r)
+            r["ts_utc"] = r["ts_utc"].isoformat()
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            cnt += 1
+    return cnt
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            r = json.loads(line)
+            r["ts_utc"] = datetime.fromisoformat(r["ts_utc"])
+            yield r
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic OTC message corpus")
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--chats", type=int, default=300)
+    ap.add_argument("--senders", type=int, default=20_000)
+    ap.add_argument("--wtb-ratio", type=float, default=0.35)
+    ap.add_argument("--repeat-ratio", type=float, default=0.3)
+    ap.add_argument("--out", type=str, required=True, help="Output .jsonl or .jsonl.gz")
+    args = ap.parse_args()
+
+    n = write_jsonl(
+        generate(args.n, seed=args.seed, chats=args.chats, senders=args.senders,
+                 wtb_ratio=args.wtb_ratio, repeat_ratio=args.repeat_ratio),
+        args.out,
+    )
+    print(f"Saved {n:,} messages -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# micro.py
+"""
+Микробенчмарки горячих текстовых функций на синтетическом корпусе.
+
+    python bench/micro.py                               # все функции, отчёт в консоль
+    python bench/micro.py --save bench/baseline.json    # сохранить базовую линию
+    python bench/micro.py --compare bench/baseline.json --threshold 0.15
+                                                        # exit 1, если ops/sec упал больше чем на 15%
+
+Функции регистрируются в BENCHMARKS: имя -> загрузчик, возвращающий callable(text).
+Если модуль не импортируется (нет зависимостей) — бенч пропускается с причиной.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib.util
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "update"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+
+def _load_file(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _extractor():
+    m = _load_file("deal_items_extractor", "deal_items_extractor/deal_items_extractor.py")
+    return m.DealItemExtractor(m.SEED_KNOWN, m.SEED_ALIASES, m.SEED_STOP).extract
+
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[str], object]]] = {
+    "t.is_buy_message": lambda: __import__("tools.t", fromlist=["x"]).is_buy_message,
+    "t.clean_text": lambda: __import__("tools.t", fromlist=["x"]).clean_text,
+    "t.get_destinations": lambda: __import__("tools.t", fromlist=["x"]).get_destinations,
+    "scrubber.scrub": lambda: __import__("scrubber").scrub,
+    "tagging.extract_tags": lambda: __import__("tagging").extract_tags,
+    "tagging.derive": lambda: __import__("tagging").derive,
+    "classifier.classify": lambda: __import__("classifier").classify,
+    "extractor.extract": _extractor,
+}
+
+
+def _percentile(sorted_ns: List[int], q: float) -> float:
+    if not sorted_ns:
+        return 0.0
+    i = min(len(sorted_ns) - 1, int(q * len(sorted_ns)))
+    return sorted_ns[i] / 1000.0  # мкс
+
+
+def run_one(fn: Callable[[str], object], texts: List[str], *, seconds: float, warmup: int) -> dict:
+    for t in texts[:warmup]:
+        fn(t)
+
+    samples: List[int] = []
+    clock = time.perf_counter_ns
+    deadline = clock() + int(seconds * 1e9)
+    busy = 0
+    n = len(texts)
+    i = 0
+    while True:
+        t = texts[i % n]
+        t0 = clock()
+        fn(t)
+        dt = clock() - t0
+        samples.append(dt)
+        busy += dt
+        i += 1
+        if i % 256 == 0 and clock() >= deadline:
+            break
+
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "ops_per_sec": round(len(samples) / (busy / 1e9), 1),
+        "p50_us": round(_percentile(samples, 0.50), 2),
+        "p99_us": round(_percentile(samples, 0.99), 2),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Список регрессий: ops/sec упал больше чем на threshold относительно baseline."""
+    bad = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("ops_per_sec"):
+            continue
+        change = cur["ops_per_sec"] / base["ops_per_sec"] - 1.0
+        cur["vs_baseline"] = round(change, 3)
+        if change < -threshold:
+            bad.append(f"{name}: {base['ops_per_sec']:.0f} -> {cur['ops_per_sec']:.0f} ops/s ({change:+.1%})")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for hot text functions")
+    ap.add_argument("--n", type=int, default=20_000, help="Corpus size (texts)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--seconds", type=float, default=2.0, help="Time budget per function")
+    ap.add_argument("--warmup", type=int, default=1000)
+    ap.add_argument("--only", type=str, default=None, help="Comma-separated benchmark names")
+    ap.add_argument("--save", type=str, default=None, help="Save results as baseline JSON")
+    ap.add_argument("--compare", type=str, default=None, help="Baseline JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="Allowed ops/sec drop (0.15 = 15%%)")
+    args = ap.parse_args()
+
+    texts = corpus.texts(args.n, seed=args.seed)
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+
+    results: Dict[str, dict] = {}
+    print(f"corpus: {len(texts):,} texts, {args.seconds}s per function\n")
+    print(f"{'function':<24} {'ops/sec':>12} {'p50 µs':>9} {'p99 µs':>9}")
+    for name in names:
+        try:
+            fn = BENCHMARKS[name]()
+        except Exception as e:
+            print(f"{name:<24} skipped: {type(e).__name__}: {e}")
+            continue
+        r = run_one(fn, texts, seconds=args.seconds, warmup=args.warmup)
+        results[name] = r
+        print(f"{name:<24} {r['ops_per_sec']:>12,.0f} {r['p50_us']:>9.2f} {r['p99_us']:>9.2f}")
+
+    failed: List[str] = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        failed = compare(results, baseline, args.threshold)
+        print("\n— vs baseline —")
+        for name, r in results.items():
+            if "vs_baseline" in r:
+                print(f"{name:<24} {r['vs_baseline']:+.1%}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "corpus_n": args.n,
+                    "seed": args.seed,
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                },
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nSaved baseline -> {args.save}")
+
+    if failed:
+        print("\nREGRESSIONS:")
+        for line in failed:
+            print("  " + line)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# replay.py
+"""
+Воспроизведение записанного потока NewMessage через настоящий пайплайн коллектора
+(t_collector.handle_new_message: классификация/роутинг/теги → архив → outbox)
+и воркеры публикации (publisher.Publisher)
+с фейковыми Telegram-клиентами и локальным Postgres.
+
+    # записать живой трафик: RECORD_EVENTS=data/events.jsonl.gz python update/t_collector.py
+    python bench/replay.py data/events.jsonl.gz --speed 10
+    python bench/replay.py data/events.jsonl.gz --speed 0 --concurrency 64 --json out.json --label after
+    python bench/replay.py --from-corpus 20000 --speed 0          # синтетика вместо записи
+
+--speed 1 — реальное время по датам сообщений, 10 — в 10 раз быстрее,
+0 — всё сразу (стресс-тест всплеска). Задержки Telegram эмулируются (--tg-latency).
+--publishers N — сколько воркеров outbox крутить параллельно с ингестом
+(0 — только постановка в очередь); после ингеста очередь дочищается.
+
+Отчёт: сквозная пропускная способность, латентность на сообщение
+(от момента «прихода» события до конца обработки), среднее по стадиям
+из metrics и число публикаций.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import contextlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "update"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+from db_load import check_bench_target, DEFAULT_DSN  # noqa: E402
+
+
+# ------------------------ ФЕЙКОВЫЙ TELEGRAM ------------------------
+
+class FakeReplyTo:
+    def __init__(self, reply_to_msg_id, reply_to_top_id):
+        self.reply_to_msg_id = reply_to_msg_id
+        self.reply_to_top_id = reply_to_top_id
+
+
+class FakeSender:
+    def __init__(self, sender_id: int, username: Optional[str]):
+        self.id = sender_id
+        self.username = username
+
+
+class FakeMessage:
+    def __init__(self, rec: Dict[str, Any]):
+        self.id = rec["message_id"]
+        self.message = rec["text"]
+        self.date = datetime.fromisoformat(rec["date"]) if rec.get("date") else None
+        rt_msg, rt_top = rec.get("reply_to_msg_id"), rec.get("reply_to_top_id")
+        self.reply_to = FakeReplyTo(rt_msg, rt_top) if (rt_msg or rt_top) else None
+
+
+class FakeEvent:
+    def __init__(self, rec: Dict[str, Any], tg: "FakeTelegram"):
+        self.message = FakeMessage(rec)
+        self.chat_id = rec["chat_id"]
+        self.sender_id = rec["sender_id"]
+        self._tg = tg
+        self._username = rec.get("sender_username")
+
+    @property
+    def sender(self):
+        return None  # как у Telethon, пока сущность не подгружена
+
+    async def get_sender(self):
+        await self._tg.rpc("get_sender")
+        return FakeSender(self.sender_id, self._username)
+
+
+class FakePosted:
+    def __init__(self, tg: "FakeTelegram", chat_id: int, msg_id: int):
+        self._tg = tg
+        self.chat_id = chat_id
+        self.id = msg_id
+
+    async def edit(self, **kwargs):
+        await self._tg.rpc("edit")
+        return self
+
+
+class FakeTelegram:
+    """Общая «сеть»: задержка RPC, счётчики вызовов, справочник username."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, seed: int):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self.usernames: Dict[int, Optional[str]] = {}
+        self._next_id = 1
+        self.target_chat_id = -1009999999999
+
+    async def rpc(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        d = self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+        if d > 0:
+            await asyncio.sleep(d)
+
+    def next_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+
+class FakeUserClient:
+    def __init__(self, tg: FakeTelegram):
+        self.tg = tg
+
+    async def get_entity(self, peer):
+        await self.tg.rpc("get_entity")
+        return FakeSender(peer, self.tg.usernames.get(peer))
+
+    async def get_input_entity(self, peer):
+        await self.tg.rpc("get_input_entity")
+        return FakeSender(peer, None)
+
+    async def get_peer_id(self, peer):
+        return peer
+
+    async def __call__(self, request):
+        await self.tg.rpc(type(request).__name__)
+        raise RuntimeError("not available in replay")
+
+
+class FakeBotClient:
+    def __init__(self, tg: FakeTelegram):
+        self.tg = tg
+        self.published = 0
+
+    async def send_message(self, entity=None, message=None, **kwargs):
+        await self.tg.rpc("send_message")
+        self.published += 1
+        return FakePosted(self.tg, self.tg.target_chat_id, self.tg.next_id())
+
+    async def edit_message(self, *args, **kwargs):
+        await self.tg.rpc("edit_message")
+
+    async def delete_messages(self, *args, **kwargs):
+        await self.tg.rpc("delete_messages")
+
+
+# ------------------------ ИСТОЧНИКИ ------------------------
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    from recorder import read_records
+    recs = list(read_records(path))
+    recs.sort(key=lambda r: r.get("date") or "")
+    return recs
+
+
+def synth_recording(n: int, seed: int) -> List[Dict[str, Any]]:
+    out = []
+    for r in corpus.generate(n, seed=seed, span_days=1):
+        out.append({
+            "chat_id": r["chat_id"],
+            "sender_id": r["sender_id"],
+            "sender_username": r["sender_username"],
+            "message_id": r["message_id"],
+            "text": r["text"],
+            "reply_to_msg_id": r["reply_to_msg_id"],
+            "reply_to_top_id": None,
+            "date": r["ts_utc"].isoformat(),
+        })
+    return out
+
+
+# ------------------------ ДРАЙВЕР ------------------------
+
+def _pct(sorted_s: List[float], q: float) -> float:
+    if not sorted_s:
+        return 0.0
+    return sorted_s[min(len(sorted_s) - 1, int(q * len(sorted_s)))] * 1000.0
+
+
+def _skipped() -> Dict[str, int]:
+    from metrics import SKIPPED_POSTS_TOTAL, DUPLICATES_TOTAL
+    out = {reason: int(c.value) for (reason,), c in SKIPPED_POSTS_TOTAL._children.items()}
+    out["duplicates_seen"] = int(sum(c.value for c in DUPLICATES_TOTAL._children.values()))
+    return out
+
+
+def _stage_means() -> Dict[str, float]:
+    from metrics import STAGE_SECONDS
+    out = {}
+    for (handler, stage), child in STAGE_SECONDS._children.items():
+        if child.count:
+            out[f"{handler}.{stage}"] = round(1000.0 * child.sum / child.count, 3)
+    return out
+
+
+async def replay(records: List[Dict[str, Any]], *, speed: float, concurrency: int,
+                 tg: FakeTelegram, quiet: bool, publishers: int = 1,
+                 send_delay: float = 0.0) -> Dict[str, Any]:
+    import t_collector
+    from publisher import Publisher
+
+    user_client, bot_client = FakeUserClient(tg), FakeBotClient(tg)
+    pubs = [Publisher(bot_client, tg.target_chat_id, worker_id=f"replay-{i}",
+                      send_delay=send_delay, poll_interval=0.2)
+            for i in range(publishers)]
+    pub_tasks = [asyncio.create_task(p.run()) for p in pubs]
+    notify = pubs[0] if pubs else None
+    for r in records:
+        tg.usernames.setdefault(r["sender_id"], r.get("sender_username"))
+
+    sem = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    dates = [datetime.fromisoformat(r["date"]).timestamp() if r.get("date") else None for r in records]
+    first = next((d for d in dates if d is not None), 0.0)
+
+    async def _one(rec, due: float):
+        try:
+            if sem:
+                async with sem:
+                    await t_collector.handle_new_message(FakeEvent(rec, tg), user_client, notify)
+            else:
+                await t_collector.handle_new_message(FakeEvent(rec, tg), user_client, notify)
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        latencies.append(time.perf_counter() - due)
+
+    loop_t0 = time.perf_counter()
+    tasks = []
+    out = open(os.devnull, "w") if quiet else sys.stdout
+    with contextlib.redirect_stdout(out):
+        for rec, d in zip(records, dates):
+            offset = ((d - first) / speed) if (speed > 0 and d is not None) else 0.0
+            due = loop_t0 + offset
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            tasks.append(asyncio.create_task(_one(rec, due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - loop_t0
+        # ингест закончился — даём воркерам дочистить очередь
+        for p in pubs:
+            p.stop()
+        await asyncio.gather(*pub_tasks)
+        if pubs:
+            await asyncio.gather(*(p.drain() for p in pubs))
+    publish_elapsed = time.perf_counter() - loop_t0
+    if quiet:
+        out.close()
+
+    latencies.sort()
+    return {
+        "messages": len(records),
+        "seconds": round(elapsed, 2),
+        "msg_per_sec": round(len(records) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_pct(latencies, 0.50), 2),
+            "p95": round(_pct(latencies, 0.95), 2),
+            "p99": round(_pct(latencies, 0.99), 2),
+            "max": round(latencies[-1] * 1000.0, 2) if latencies else 0.0,
+        },
+        "publishers": publishers,
+        "published": bot_client.published,
+        "publish_seconds": round(publish_elapsed, 2),
+        "tg_calls": dict(tg.calls),
+        "stage_mean_ms": _stage_means(),
+        "skipped": _skipped(),
+        "errors": errors,
+    }
+
+
+def print_report(rep: Dict[str, Any]) -> None:
+    print(f"\n=== replay {rep.get('label') or ''} ===")
+    print(f"messages: {rep['messages']:,} in {rep['seconds']}s -> {rep['msg_per_sec']:,.1f} msg/s")
+    lat = rep["latency_ms"]
+    print(f"latency:  p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms max={lat['max']}ms")
+    print(f"published cards: {rep['published']:,} by {rep['publishers']} worker(s), "
+          f"queue drained at {rep['publish_seconds']}s   skipped: {rep['skipped']}")
+    print(f"telegram calls: {rep['tg_calls']}")
+    print("stage means (ms):")
+    for k, v in sorted(rep["stage_mean_ms"].items()):
+        print(f"  {k:<32} {v}")
+    if rep["errors"]:
+        print(f"errors: {rep['errors']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded NewMessage events through the collector pipeline")
+    ap.add_argument("recording", nargs="?", help=".jsonl(.gz) written with RECORD_EVENTS")
+    ap.add_argument("--from-corpus", type=int, default=0, help="Use N synthetic messages instead of a recording")
+    ap.add_argument("--save-recording", type=str, default=None, help="Write the synthetic input to this path")
+    ap.add_argument("--speed", type=float, default=0.0, help="1 = real time, 10 = 10x faster, 0 = as fast as possible")
+    ap.add_argument("--concurrency", type=int, default=0, help="Max in-flight handlers (0 = unbounded, like Telethon)")
+    ap.add_argument("--publishers", type=int, default=1, help="Outbox workers running alongside ingest")
+    ap.add_argument("--send-delay", type=float, default=0.0, help="Publisher pause between cards, s (prod: 0.3)")
+    ap.add_argument("--tg-latency", type=float, default=40.0, help="Simulated Telegram RPC latency, ms")
+    ap.add_argument("--tg-jitter", type=float, default=20.0, help="Extra random latency, ms")
+    ap.add_argument("--dsn", type=str, default=DEFAULT_DSN)
+    ap.add_argument("--seed", type=int, default=7, help="Synthetic input seed (db_load seeds with 42)")
+    ap.add_argument("--label", type=str, default="", help="Name of this run in the report")
+    ap.add_argument("--json", type=str, default=None)
+    ap.add_argument("--verbose", action="store_true", help="Keep the collector's own log lines")
+    args = ap.parse_args()
+
+    if not args.recording and not args.from_corpus:
+        ap.error("pass a recording path or --from-corpus N")
+
+    check_bench_target(args.dsn, False)
+    os.environ["PG_DSN"] = args.dsn
+    # t_collector читает их на импорте; в replay настоящий Telegram не нужен
+    for k, v in (("API_ID", "0"), ("API_HASH", "replay"), ("BOT_TOKEN", "0:replay"), ("TARGET_GROUP", "replay")):
+        os.environ.setdefault(k, v)
+    os.environ.setdefault("AUTO_MIGRATE", "1")
+
+    if args.recording:
+        records = load_recording(args.recording)
+    else:
+        records = synth_recording(args.from_corpus, args.seed)
+        if args.save_recording:
+            from recorder import write_records
+            write_records(args.save_recording, records)
+
+    import db
+    db.init_db()
+
+    if not args.verbose:
+        logging.getLogger("buy_detector").setLevel(logging.ERROR)
+
+    tg = FakeTelegram(args.tg_latency, args.tg_jitter, args.seed)
+    rep = asyncio.run(replay(records, speed=args.speed, concurrency=args.concurrency,
+                             tg=tg, quiet=not args.verbose,
+                             publishers=args.publishers, send_delay=args.send_delay))
+    rep["label"] = args.label
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+        print(f"\nSaved -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
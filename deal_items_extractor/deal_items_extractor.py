@@ -3,12 +3,17 @@ import os
 import re
 import json
 import csv
+import sys
 from collections import Counter, defaultdict
 from typing import List, Dict, Tuple, Iterable, Set
 
 import psycopg
 from psycopg.rows import dict_row
 
+# общий скраббер контактов лежит в update/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "update"))
+from scrubber import scrub  # noqa: E402
+
 try:
     from rapidfuzz import process as rf_process, fuzz as rf_fuzz
     HAVE_RAPIDFUZZ = True
@@ -97,15 +102,13 @@ def save_json(path: str, data):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+_JUNK_RE = re.compile(r"[^a-z0-9а-яё\s/_\-\.]+")
+
 def normalize_text(t: str) -> str:
-    t = (t or "").lower()
-    # простая чистка: убираем юзернеймы/ссылки/телефоны, много пробелов
-    t = re.sub(r"@\w{3,32}", " ", t)
-    t = re.sub(r"https?://\S+|t\.me/\S+", " ", t)
-    t = re.sub(r"\+?\d[\d\-\s()]{7,}", " ", t)
-    t = re.sub(r"[^a-z0-9а-яё\s/_\-\.]", " ", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+    # юзернеймы/ссылки/телефоны — общим скраббером за один проход, потом мусор и пробелы
+    t = scrub(t, " ", strip=False).text.lower()
+    t = _JUNK_RE.sub(" ", t)
+    return " ".join(t.split())
 
 def ngrams(tokens: List[str], n: int) -> Iterable[str]:
     for i in range(len(tokens) - n + 1):
@@ -219,7 +222,7 @@ def mine_new_candidates(texts: Iterable[str],
 # ------------------------ РАБОТА С БД ------------------------
 
 def fetch_messages(limit: int | None = None) -> List[dict]:
-    q = "SELECT id, chat_id, message_id, sender_id, ts_utc, text FROM otc.messages_archive WHERE text IS NOT NULL"
+    q = "SELECT id, chat_id, message_id, sender_id, ts_utc, text FROM otc.messages_archive_v WHERE text IS NOT NULL"
     if limit:
         q += f" ORDER BY ts_utc DESC LIMIT {int(limit)}"
     with psycopg.connect(PG_DSN, row_factory=dict_row) as conn, conn.cursor() as cur:
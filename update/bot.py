@@ -1,25 +1,37 @@
 # bot.py
 import re
 import os
-import json
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram import BaseMiddleware
+from aiohttp import web
+import signal
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 import logging
 from datetime import datetime, timezone
 from aiogram import F
 from aiogram.types import CallbackQuery
-from db import toggle_reaction, count_reactions, get_user_reputation, get_user_stats
+from db import init_db, toggle_reaction, put_reaction_state, count_reactions, get_contact_row
 import asyncio
-from typing import Dict, Tuple, Optional
-
-# ключ = (chat_id, message_id)
-_PENDING_UPDATES: Dict[Tuple[int, int], dict] = {}
+from typing import Tuple, Optional
+from metrics import start_metrics_server, stage, tg_call, FLOODWAIT_TOTAL, FLOODWAIT_SECONDS
+from bot_state import make_state, default_owner
+from tagging import extract_tags, is_current, row_clean_text
+from chats import ChatCache
+from card_cache import ContactCardCache
+from bus import EventBus
+from sender_cache import SENDERS
+from throttle import ReactionThrottle, PASS, SHED
+from reactions import compact_loop
+from demand import trends as demand_trends, CATEGORIES as DEMAND_CATEGORIES
 from db import get_message_by_id  # -> dict: {"id": int, "text": str, "sender_id": int, "sender_username": Optional[str],
-                                  #            "chat_id": int, "message_id": int, "chat_username": Optional[str]}
+                                  #            "chat_id": int, "message_id": int, ...}
 # базовая настройка: и в консоль, и INFO видно
 logging.basicConfig(
     level=logging.INFO,
@@ -31,80 +43,107 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("❌ BOT_TOKEN is missing! Please set environment variable BOT_TOKEN")
 
+METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9102"))
+
+# задержка объединения кликов по карточке и аренда правки воркером
+EDIT_COALESCE_DELAY = float(os.getenv("BOT_EDIT_DELAY", "1.0"))
+EDIT_LEASE_S = float(os.getenv("BOT_EDIT_LEASE", "30"))
+EDIT_POLL_INTERVAL = float(os.getenv("BOT_EDIT_POLL", "0.2"))
+
+# режим приёма апдейтов: polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")   # https://bot.example.com; пусто — setWebhook не зовём
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# сколько апдейтов обрабатывается одновременно; остальные ждут в очереди
+BOT_MAX_HANDLERS = int(os.getenv("BOT_MAX_HANDLERS", "64"))
+# сколько ждать незавершённые обработчики при остановке
+BOT_DRAIN_TIMEOUT = float(os.getenv("BOT_DRAIN_TIMEOUT", "15"))
+# свой Bot API сервер (telegram-bot-api --local) или заглушка из bench/bot_webhook.py
+BOT_API_SERVER = os.getenv("BOT_API_SERVER", "")
+BOT_UVLOOP = os.getenv("BOT_UVLOOP", "1") != "0"
+# как часто подтягивать изменения справочника otc.chats (его пишет коллектор)
+BOT_CHATS_REFRESH = float(os.getenv("BOT_CHATS_REFRESH", "60"))
+# кэш карточек /start: сколько держать и как часто сверять username/удаление с архивом
+BOT_CARD_CACHE_MAX = int(os.getenv("BOT_CARD_CACHE_MAX", "10000"))
+BOT_CARD_REVALIDATE = float(os.getenv("BOT_CARD_REVALIDATE", "30"))
+# пока подключена шина LISTEN/NOTIFY, изменения приходят событиями, а
+# периодические сверки — только страховка, и их можно делать редко
+BOT_BUS_RESYNC = float(os.getenv("BOT_BUS_RESYNC", "900"))
+# троттлинг кликов like/dislike до БД: ведро на пользователя, окно на карточку,
+# и за сколько секунд тишины серия кликов сворачивается в одну запись
+BOT_REACT_USER_RATE = float(os.getenv("BOT_REACT_USER_RATE", "1"))
+BOT_REACT_USER_BURST = float(os.getenv("BOT_REACT_USER_BURST", "5"))
+BOT_REACT_ROW_LIMIT = int(os.getenv("BOT_REACT_ROW_LIMIT", "60"))
+BOT_REACT_ROW_WINDOW = float(os.getenv("BOT_REACT_ROW_WINDOW", "10"))
+BOT_REACT_COLLAPSE = float(os.getenv("BOT_REACT_COLLAPSE", "1.5"))
+# /trends: сколько тегов показывать и сколько секунд держать ответ (rollup обновляется раз в минуту)
+BOT_TRENDS_TOP = int(os.getenv("BOT_TRENDS_TOP", "10"))
+BOT_TRENDS_TTL = float(os.getenv("BOT_TRENDS_TTL", "60"))
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательное ускорение
+    orjson = None
+
 OTC_GROUP_USERNAME = "otc_wtb_only"  
-CHAT_INDEX_FILE = os.path.abspath("otc_chats_index.json")
-_chat_index: dict[str, dict] = {}
-
-KNOWN_ITEMS = {
-    "exchanges": [
-        "binance", "bybit", "okx", "huobi", "htx",
-        "gate io", "bitget", "mexc", "kucoin", "bingx",
-        "coinlist", "paxful", "cryptocom", "crypto com",
-        "bc game", "bcgame", "fragment", "weex", "arkham"
-    ],
-    "payments_banks": [
-        # классические банки
-        "bunq", "n26", "monzo", "santander", "bbva",
-        "ing", "finom", "vivid", "chase", "c24",
-        "trade republic", "billions", "bank of america",
-
-        # финтех / нео банки
-        "revolut", "revolut business", "revolut personal",
-        "wise", "wise business", "wise personal",
-        "paysera", "icard", "zen", "zen business",
-        "airwallex", "mercury", "bitsa", "wirex",
-        "genome", "sumup", "persona", "trustee", "trustee plus",
-
-        # платежки
-        "stripe", "stripe business", "paypal", "paypal business",
-        "cashapp", "alipay", "nexo", "ozon", "twitter"
-    ],
-    "kyc_verification": [
-        "kyc", "wts kyc", "kyc service", "kyc or ready",
-        "kyc bybit", "kyc service or", "kyc accepted",
-        "kyc / acc", "kyc / ready", "kyc or",
-        "kyc by", "wts kyc service", "wts kyc or",
-        "other kyc", "other kyc accepted", "kyc 8",
-        "blockpass", "persona", "sumsub", "onfido",
-        "holonym", "buildpad", "buidlpad", "solayer",
-        "kaito", "arkham", "legion", "civic",
-        "sandbox", "echo"
-    ],
-    "marketplaces_services": [
-        "fragment", "tiktok", "temu", "ozon", "airbnb",
-        "telegram", "twitter", "whatsapp", "esim",
-        "game", "bc game", "bcgame", "bet365"
-    ],
-    "crypto_wallets": [
-        "metamask", "trustwallet", "phantom", "coinbase wallet",
-        "ledger", "trezor", "tronlink"
-    ],
-    "countries": [
-        "usa", "indonesia", "spain", "egypt", "philippines",
-        "uganda", "georgia", "america", "germany", "armenia",
-        "africa", "russia", "costa rica", "italy", "zambia",
-        "vietnam", "rwanda", "angola", "uruguay", "paraguay",
-        "argentina", "bolivia", "peru", "brazil", "chile",
-        "colombia", "el salvador", "mexico"
-    ],
-    "misc": [
-        "iban", "llc", "emulator", "passport",
-        "vcc", "accs", "accounts", "ready account",
-        "ready acc", "old account", "merchant", "premium",
-        "crypto", "wallet", "stake", "escrow", "reviews",
-        "selfie", "verification"
-    ]
-}
+CHATS = ChatCache(refresh_interval=BOT_CHATS_REFRESH)
+
+
+def _make_session() -> AiohttpSession:
+    kwargs = {}
+    if BOT_API_SERVER:
+        kwargs["api"] = TelegramAPIServer.from_base(BOT_API_SERVER)
+    if orjson is not None:
+        # тем же json_loads aiogram читает тело webhook-запроса
+        kwargs["json_loads"] = orjson.loads
+        kwargs["json_dumps"] = lambda obj: orjson.dumps(obj).decode()
+    return AiohttpSession(**kwargs)
+
+
+class InFlightLimit(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов и даёт дождаться их при остановке."""
+
+    def __init__(self, limit: int):
+        self._sem = asyncio.Semaphore(limit)
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        try:
+            async with self._sem:
+                return await handler(event, data)
+        finally:
+            self.active -= 1
+            if not self.active:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
 
 bot = Bot(
     token=BOT_TOKEN,
+    session=_make_session(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
 dp = Dispatcher()
+IN_FLIGHT = InFlightLimit(BOT_MAX_HANDLERS)
+dp.update.outer_middleware(IN_FLIGHT)
 
-# Память “в одном процессе”: какой message_id бота последний для конкретного user_id
-LAST_REPLY_ID: dict[int, int] = {}
+# последний ответ бота в личке и отложенные правки карточек (memory | postgres, см. bot_state.py)
+STATE = make_state()
+WORKER_ID = default_owner()
 
 
 
@@ -143,25 +182,14 @@ def build_reaction_kb(row_id: int, likes: int, dislikes: int, start_payload: str
     ])
     return kb
 
-def load_chat_index(path: str = CHAT_INDEX_FILE) -> None:
-    global _chat_index
-    if _chat_index:
-        return
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            _chat_index = json.load(f)
-    except Exception:
-        _chat_index = {}
-
 def get_chat_meta(chat_id: int | None):
-    """Возвращает (username, title) по chat_id из JSON."""
+    """Возвращает (username, title) по chat_id из кэша otc.chats."""
     if not chat_id:
         return None, None
-    load_chat_index()
-    data = _chat_index.get(str(chat_id))
+    data = CHATS.get(chat_id)
     if not data:
         return None, None
-    return data.get("username"), data.get("title")
+    return data["username"], data["title"]
 
 
 def buyer_link(sender_id: int, username: Optional[str]) -> Tuple[str, bool]:
@@ -201,50 +229,20 @@ def original_post_link(chat_username: str | None, chat_id: int | None, msg_id: i
     return None
 
 
-@dp.message(CommandStart())
-async def start_handler(message: types.Message) -> None:
-    # ждём формат:
-    #   /start <row_id>
-    #   /start <row_id>_<otc_msg_id>
-    user = message.from_user
-    log.info(
-        "START clicked by user_id=%s, username=%s, full_name=%s, text=%r, at=%s",
-        user.id,
-        user.username,
-        user.full_name,
-        message.text,
-        datetime.now(timezone.utc).isoformat(),
-    )
-
-    parts = (message.text or "").split(maxsplit=1)
-    if len(parts) < 2:
-        await message.answer("Open me from the button under the buyer’s post.")
-        return
-
-    m = re.fullmatch(r"\s*(\d+)(?:_(\d+))?\s*", parts[1])
-    if not m:
-        await message.answer("Bad link format.")
-        return
-
-    row_id = int(m.group(1))
-    otc_msg_id = int(m.group(2)) if m.group(2) else None
-
-    row = get_message_by_id(row_id)
-    if not row:
-        await message.answer("❌ Buyer request not found.")
-        return
-
+def render_contact_card(row: dict, chat_meta: tuple) -> tuple[str, tuple[list, list]]:
+    """
+    Карточка «как связаться» по узкой проекции строки (get_contact_row)
+    и (username, title) чата. Результат кэширует CARDS по row_id.
+    """
     sender_id = int(row.get("sender_id") or 0)
     username = row.get("sender_username")
 
     # Для кнопки перехода к оригиналу
     orig_chat_id = int(row.get("chat_id") or 0)
     orig_msg_id = int(row.get("message_id") or 0)
-    orig_chat_username = row.get("chat_username")
 
-    idx_username, idx_title = get_chat_meta(orig_chat_id)
-    group_username = orig_chat_username or idx_username
-    group_title = idx_title
+    group_username, group_title = chat_meta
+    deleted = bool(row.get("deleted"))
 
     url, is_https = buyer_link(sender_id, username)
 
@@ -268,8 +266,8 @@ async def start_handler(message: types.Message) -> None:
         # tg:// может не кликается у части клиентов, но всё равно показываем
         lines.append(f"2) Profile link: <a href=\"{url}\">{url}</a>")
 
-    # Оригинальный пост — если его можно открыть
-    orig_url = original_post_link(group_username, orig_chat_id, orig_msg_id)
+    # Оригинальный пост — если его можно открыть (удалённый уже не откроется)
+    orig_url = None if deleted else original_post_link(group_username, orig_chat_id, orig_msg_id)
     if orig_url:
         if group_username:
             lines.append(
@@ -284,6 +282,9 @@ async def start_handler(message: types.Message) -> None:
         g_label = f"@{group_username}" if group_username else (group_title or "source group")
         lines.append(f"\n👥 Group: <a href=\"https://t.me/{group_username}\">{g_label}</a>")
 
+    if deleted:
+        lines.append("\n⚠️ <i>The buyer deleted the original message — the request may be outdated.</i>")
+
     # Fallback к админу
     lines.append("")
     lines.append("If none of the above works, please contact admin: <a href=\"https://t.me/studios_by_darwin\">@studios_by_darwin</a>")
@@ -292,27 +293,96 @@ async def start_handler(message: types.Message) -> None:
 
     text = "\n".join(lines)
 
-    # Кнопки:
-    buttons: list[list[InlineKeyboardButton]] = []
+    # Кнопки: до и после “Back to group post” (её start_handler вставляет сам)
+    head: list[list[InlineKeyboardButton]] = []
+    tail: list[list[InlineKeyboardButton]] = []
 
     # Кнопка “Message buyer” — только если есть username (иначе смысла нет)
     if username:
         u = username.lstrip("@")
-        buttons.append([InlineKeyboardButton(text="💬 Message buyer", url=f"https://t.me/{u}")])
-
-    if otc_msg_id:
-        buttons.append([InlineKeyboardButton(text="🔙 Back to group post", url=otc_post_link(otc_msg_id))])
+        head.append([InlineKeyboardButton(text="💬 Message buyer", url=f"https://t.me/{u}")])
 
     if orig_url:
-        buttons.append([InlineKeyboardButton(text="📩 View original post", url=orig_url)])
+        tail.append([InlineKeyboardButton(text="📩 View original post", url=orig_url)])
 
     if group_username:
-        buttons.append([InlineKeyboardButton(text="🔗 Open group", url=f"https://t.me/{group_username}")])
+        tail.append([InlineKeyboardButton(text="🔗 Open group", url=f"https://t.me/{group_username}")])
+
+    return text, (head, tail)
+
+
+CARDS = ContactCardCache(render_contact_card, get_chat_meta,
+                         max_size=BOT_CARD_CACHE_MAX, revalidate_interval=BOT_CARD_REVALIDATE)
+
+BUS = EventBus()
+SENDERS.attach(BUS)
+BUS.subscribe("row", CARDS.invalidate_many)
+BUS.subscribe("chat", lambda ids: CHATS.refresh())
+
+
+def _on_bus_state(connected: bool):
+    if connected:
+        CARDS.revalidate_interval = CHATS.refresh_interval = BOT_BUS_RESYNC
+        log.info("event bus connected: cache resync every %.0fs", BOT_BUS_RESYNC)
+        # пока шины не было, события терялись — разово сверяемся
+        return asyncio.gather(CARDS.revalidate(), CHATS.refresh(), return_exceptions=True)
+    CARDS.revalidate_interval, CHATS.refresh_interval = BOT_CARD_REVALIDATE, BOT_CHATS_REFRESH
+    log.warning("event bus disconnected: polling every %.0fs", BOT_CARD_REVALIDATE)
+
+
+BUS.on_state(_on_bus_state)
+
+
+@dp.message(CommandStart())
+async def start_handler(message: types.Message) -> None:
+    # ждём формат:
+    #   /start <row_id>
+    #   /start <row_id>_<otc_msg_id>
+    user = message.from_user
+    log.info(
+        "START clicked by user_id=%s, username=%s, full_name=%s, text=%r, at=%s",
+        user.id,
+        user.username,
+        user.full_name,
+        message.text,
+        datetime.now(timezone.utc).isoformat(),
+    )
+
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Open me from the button under the buyer’s post.")
+        return
+
+    m = re.fullmatch(r"\s*(\d+)(?:_(\d+))?\s*", parts[1])
+    if not m:
+        await message.answer("Bad link format.")
+        return
+
+    row_id = int(m.group(1))
+    otc_msg_id = int(m.group(2)) if m.group(2) else None
+
+    # повторные клики по популярной карточке — из памяти, без БД
+    card = CARDS.get(row_id)
+    if card is None:
+        with stage("start_handler", "lookup"):
+            row = await asyncio.to_thread(get_contact_row, row_id)
+        if not row:
+            await message.answer("❌ Buyer request not found.")
+            return
+        card = CARDS.put(row_id, row)
+
+    text = card.text
+    head_buttons, tail_buttons = card.rendered
+    buttons = list(head_buttons)
+    # otc_msg_id у разных карточек одной строки разный — эту кнопку добавляем на клик
+    if otc_msg_id:
+        buttons.append([InlineKeyboardButton(text="🔙 Back to group post", url=otc_post_link(otc_msg_id))])
+    buttons.extend(tail_buttons)
 
     kb: InlineKeyboardMarkup | None = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
 
     chat_id = message.chat.id
-    old_msg_id = LAST_REPLY_ID.get(chat_id)
+    old_msg_id = await STATE.get_last_reply(chat_id)
 
     # Пытаемся красиво обновить прошлый ответ бота
     if old_msg_id:
@@ -332,7 +402,7 @@ async def start_handler(message: types.Message) -> None:
                 reply_markup=kb,
                 disable_web_page_preview=True,
             )
-            LAST_REPLY_ID[chat_id] = new_msg.message_id
+            await STATE.set_last_reply(chat_id, new_msg.message_id)
             try:
                 await bot.delete_message(chat_id=chat_id, message_id=old_msg_id)
             except TelegramBadRequest:
@@ -344,7 +414,7 @@ async def start_handler(message: types.Message) -> None:
             reply_markup=kb,
             disable_web_page_preview=True,
         )
-        LAST_REPLY_ID[chat_id] = new_msg.message_id
+        await STATE.set_last_reply(chat_id, new_msg.message_id)
 
     # Чистим команду пользователя
     try:
@@ -352,28 +422,86 @@ async def start_handler(message: types.Message) -> None:
     except TelegramBadRequest:
         pass
 
-def extract_tags(text: str) -> list[str]:
-    """Возвращает список хэштегов из словаря по тексту."""
-    tags = []
-    lowered = text.lower()
-    for category, words in KNOWN_ITEMS.items():
-        for w in words:
-            if w in lowered:
-                tags.append("#" + w.replace(" ", "_"))  # пробелы → "_"
-    return list(set(tags))  # убираем дубликаты
-
-def render_post_body(row_id: int, likes: int, dislikes: int) -> str:
+_TRENDS_WINDOW_RE = re.compile(r"(\d+)([hd]?)")
+_TRENDS_MAX_HOURS = 24 * 90
+_trends_cache: dict[tuple, tuple[float, str]] = {}
+
+
+def _pct(now: int, prev: int) -> str:
+    if not prev:
+        return "new" if now else "–"
+    return f"{(now - prev) / prev:+.0%}"
+
+
+def render_trends(rep: dict, hours: int, category: Optional[str]) -> str:
+    window = f"{hours // 24}d" if hours % 24 == 0 else f"{hours}h"
+    tot = rep["totals"]
+    lines = [
+        f"📈 <b>Buyer demand, last {window}</b>" + (f" · {category}" if category else ""),
+        f"WTB requests: <b>{tot['wtb']:,}</b> ({_pct(tot['wtb'], tot['wtb_prev'])} vs previous {window}), "
+        f"~{tot['senders']:,} buyers",
+        "",
+    ]
+    # тег из нескольких категорий приходит несколько раз — показываем один
+    seen = set()
+    for r in rep["tags"]:
+        if r["tag"] in seen:
+            continue
+        seen.add(r["tag"])
+        lines.append(f"{len(seen)}. {r['tag']} — {r['wtb']:,} ({_pct(r['wtb'], r['wtb_prev'])}), "
+                     f"~{r['senders']:,} buyers")
+        if len(seen) >= BOT_TRENDS_TOP:
+            break
+    if not seen:
+        lines.append("<i>No tagged requests in this window yet.</i>")
+    return "\n".join(lines)
+
+
+@dp.message(Command("trends"))
+async def trends_handler(message: types.Message, command: CommandObject) -> None:
+    # /trends [24h|7d|N] [category] — только из otc.demand_rollup (demand.py), архив не читаем
+    hours, category = 24 * 7, None
+    for arg in (command.args or "").lower().split():
+        m = _TRENDS_WINDOW_RE.fullmatch(arg)
+        if m:
+            hours = int(m.group(1)) * (24 if m.group(2) == "d" else 1)
+        elif arg in DEMAND_CATEGORIES:
+            category = arg
+        else:
+            await message.answer("Usage: /trends [24h|7d|30d] [" + "|".join(DEMAND_CATEGORIES) + "]")
+            return
+    hours = max(1, min(hours, _TRENDS_MAX_HOURS))
+
+    key = (hours, category)
+    cached = _trends_cache.get(key)
+    loop = asyncio.get_running_loop()
+    if cached and loop.time() - cached[0] < BOT_TRENDS_TTL:
+        text = cached[1]
+    else:
+        with stage("trends_handler", "rollup"):
+            # тегов с запасом: дубли по категориям отсеет render_trends
+            rep = await asyncio.to_thread(demand_trends, hours, category=category, limit=BOT_TRENDS_TOP * 2)
+        text = render_trends(rep, hours, category)
+        _trends_cache[key] = (loop.time(), text)
+    await message.answer(text, disable_web_page_preview=True)
+
+
+def render_post_body(row_id: int, likes: int, dislikes: int) -> Optional[str]:
+    """None — исходник удалён: карточку помечает коллектор (DELETED_CARDS_MODE), не трогаем."""
     row = get_message_by_id(row_id)
-    cleaned_text = (row.get("text") or "").strip()
-    c_text = clean_text(cleaned_text)
+    if row is None or row.get("deleted"):
+        return None
+    # текст без контактов чистится один раз при вставке (text_clean)
+    c_text = row_clean_text(row)
     rating_pct = compute_rating_percent(likes, dislikes)
     stars = stars_from_percent(rating_pct)
     sender_id = row.get("sender_id")
-    tags = extract_tags(c_text)
+    # теги пишет коллектор при вставке; строки старой ревизии — считаем на лету
+    tags = row.get("tags") if is_current(row) else extract_tags(c_text)
     tags_line = ", ".join(tags) if tags else ""
 
     
-    user_total_messages, user_reviews_count = get_user_stats(sender_id)
+    user_total_messages, user_reviews_count = SENDERS.stats(sender_id)
 
 
     parts = []
@@ -396,113 +524,149 @@ def render_post_body(row_id: int, likes: int, dislikes: int) -> str:
 
     return "\n".join(parts)
 
-async def _flush_one_update(chat_id: int, message_id: int):
-    key = (chat_id, message_id)
-    data = _PENDING_UPDATES.get(key)
-    if not data:
-        return
-
-    row_id: int = data["row_id"]
-    likes: int = data["likes"]
-    dislikes: int = data["dislikes"]
-    start_payload: str = data["start_payload"]
-    msg_obj: types.Message = data["message"]
+async def _flush_one_update(item: dict):
+    """Отправляет одну правку, взятую в аренду. Закрыть/вернуть её — дело вызывающего."""
+    chat_id, message_id = item["chat_id"], item["message_id"]
+    row_id: int = item["row_id"]
+    likes: int = item["likes"]
+    dislikes: int = item["dislikes"]
 
     # тело поста (рейтинг + звёзды) и клавиатура
-    body = render_post_body(row_id, likes, dislikes)
-    kb = build_reaction_kb(row_id, likes, dislikes, start_payload)
+    with stage("flush_update", "render"):
+        body = await asyncio.to_thread(render_post_body, row_id, likes, dislikes)
+    if body is None:
+        # правка, поставленная до удаления, не должна вернуть кнопки поверх отметки
+        return
+    kb = build_reaction_kb(row_id, likes, dislikes, item["start_payload"])
 
     try:
-        await msg_obj.edit_text(
-            body,
-            reply_markup=kb,
-            disable_web_page_preview=True,
-            parse_mode=ParseMode.HTML,
-        )
+        with stage("flush_update", "edit"), tg_call("edit_message_text"):
+            await bot.edit_message_text(
+                body,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=kb,
+                disable_web_page_preview=True,
+                parse_mode=ParseMode.HTML,
+            )
     except TelegramBadRequest as e:
         log.warning("edit_text failed chat=%s msg=%s: %s", chat_id, message_id, e)
         # fallback — хотя бы кнопки
         try:
-            await msg_obj.edit_reply_markup(reply_markup=kb)
+            await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=kb)
         except Exception as e2:
             log.warning("edit_reply_markup fallback failed: %s", e2)
-    finally:
-        data["scheduled"] = False
-        data["last_sent"] = (likes, dislikes)
-
-def _schedule_coalesced_update(message: types.Message, *, row_id: int, likes: int, dislikes: int, start_payload: str, delay: float = 1.0):
-    key = (message.chat.id, message.message_id)
-    entry = _PENDING_UPDATES.get(key)
-    if not entry:
-        entry = {
-            "row_id": row_id,
-            "likes": likes,
-            "dislikes": dislikes,
-            "start_payload": start_payload,
-            "message": message,
-            "scheduled": False,
-            "task": None,
-            "last_sent": None,
-        }
-        _PENDING_UPDATES[key] = entry
-    else:
-        entry["row_id"] = row_id
-        entry["likes"] = likes
-        entry["dislikes"] = dislikes
-        entry["start_payload"] = start_payload
-        entry["message"] = message
-
-    if not entry["scheduled"]:
-        entry["scheduled"] = True
-
-        async def _job():
-            await asyncio.sleep(delay)
-            await _flush_one_update(message.chat.id, message.message_id)
-
-        entry["task"] = asyncio.create_task(_job())
-
-
-def _schedule_coalesced_update(message: types.Message, *, row_id: int, likes: int, dislikes: int, start_payload: str, delay: float = 1.0):
-    """Кладёт (или обновляет) состояние и ставит отправку через delay сек, если ещё не запланирована."""
-    key = (message.chat.id, message.message_id)
-    entry = _PENDING_UPDATES.get(key)
-    if not entry:
-        entry = {
-            "row_id": row_id,
-            "likes": likes,
-            "dislikes": dislikes,
-            "start_payload": start_payload,
-            "message": message,
-            "scheduled": False,
-            "task": None,
-            "last_sent": None,  # (likes, dislikes)
-        }
-        _PENDING_UPDATES[key] = entry
-    else:
-        # обновляем только изменяемые поля
-        entry["row_id"] = row_id
-        entry["likes"] = likes
-        entry["dislikes"] = dislikes
-        entry["start_payload"] = start_payload
-        entry["message"] = message  # на случай, если объект поменялся
-
-    if not entry["scheduled"]:
-        entry["scheduled"] = True
-
-        async def _job():
-            # копим клики в течение delay
-            await asyncio.sleep(delay)
-            await _flush_one_update(message.chat.id, message.message_id)
-
-        entry["task"] = asyncio.create_task(_job())
-
-def clean_text(text: str) -> str:
-    """Убираем контакты: @юзеры, ссылки, телефоны."""
-    t = text or ""
-    t = re.sub(r"@\w{3,32}", "[hidden]", t)               # @username
-    t = re.sub(r"https?://\S+|t\.me/\S+", "[hidden]", t)  # URL + t.me
-    t = re.sub(r"\+?\d[\d\-\s()]{7,}", "[hidden]", t)     # телефоны
-    return t.strip()
+
+
+async def _flush_item(item: dict):
+    try:
+        await _flush_one_update(item)
+    except TelegramRetryAfter as e:
+        FLOODWAIT_TOTAL.labels("flush_update").inc()
+        FLOODWAIT_SECONDS.labels("flush_update").inc(e.retry_after)
+        log.warning("flood wait %ss on edit chat=%s msg=%s", e.retry_after, item["chat_id"], item["message_id"])
+        await STATE.release(item, WORKER_ID, e.retry_after)
+        return
+    except Exception:
+        log.exception("flush failed chat=%s msg=%s", item["chat_id"], item["message_id"])
+        await STATE.release(item, WORKER_ID, EDIT_COALESCE_DELAY * 5)
+        return
+    # новые клики за время отправки — строка останется и созреет ещё раз
+    await STATE.complete(item, WORKER_ID, EDIT_COALESCE_DELAY)
+
+
+async def flush_pending(force: bool = False) -> int:
+    """Забирает созревшие правки (force — все свободные) и отправляет их. Возвращает число правок."""
+    items = await STATE.claim_due(WORKER_ID, limit=20, lease_s=EDIT_LEASE_S, force=force)
+    if items:
+        await asyncio.gather(*(_flush_item(it) for it in items))
+    return len(items)
+
+
+async def pending_edits_loop():
+    """
+    Фоновый цикл воркера. На старте досылает правки, брошенные прошлым
+    процессом (их аренда истекла), дальше — забирает созревшие.
+    """
+    last_prune = 0.0
+    while True:
+        try:
+            n = await flush_pending()
+            now = asyncio.get_running_loop().time()
+            if now - last_prune > 3600:
+                last_prune = now
+                await STATE.prune()
+        except Exception:
+            log.exception("pending edits loop error")
+            n = 0
+        if not n:
+            await asyncio.sleep(EDIT_POLL_INTERVAL)
+
+
+async def _schedule_coalesced_update(message: types.Message, *, row_id: int, likes: int, dislikes: int,
+                                     start_payload: str, delay: float = EDIT_COALESCE_DELAY):
+    """Кладёт (или обновляет) желаемое состояние карточки; отправит любой воркер не раньше чем через delay."""
+    await STATE.put_pending(
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        row_id=row_id,
+        likes=likes,
+        dislikes=dislikes,
+        start_payload=start_payload,
+        delay_s=delay,
+    )
+
+_REACTION_ANSWERS = {"added": "Saved ✅", "removed": "Removed ↩️", "switched": "Switched 🔁"}
+
+
+async def _refresh_card(message: types.Message, row_id: int) -> None:
+    # пересчитать свежие значения по пользователю, а не по посту
+    with stage("reaction_handler", "reputation"):
+        # sender_id строки не меняется — из памяти; свою же запись не ждём
+        # из шины, а сбрасываем кэш отправителя сразу
+        sender_id = await asyncio.to_thread(SENDERS.row_sender, row_id)
+        SENDERS.forget((sender_id,))
+        likes, dislikes = await asyncio.to_thread(SENDERS.reputation, sender_id)
+
+    # запланировать объединённое обновление (текст + кнопки)
+    await _schedule_coalesced_update(
+        message,
+        row_id=row_id,
+        likes=likes,
+        dislikes=dislikes,
+        start_payload=f"{row_id}_{message.message_id}",
+    )
+
+
+async def _apply_collapsed(row_id: int, user_id: int, reaction: Optional[int], message: types.Message) -> None:
+    """Итог свёрнутой серии быстрых кликов — одна запись вместо toggle на каждый клик."""
+    with stage("reaction_handler", "collapsed_write"):
+        await asyncio.to_thread(put_reaction_state, row_id, user_id, reaction)
+    await _refresh_card(message, row_id)
+
+
+async def _refresh_dropped(row_id: int, user_id: int, message: types.Message) -> None:
+    """Отвеченные клики записать не удалось — карточка должна показать то, что в БД."""
+    await _refresh_card(message, row_id)
+
+
+THROTTLE = ReactionThrottle(
+    _apply_collapsed,
+    refresh=_refresh_dropped,
+    user_rate=BOT_REACT_USER_RATE,
+    user_burst=BOT_REACT_USER_BURST,
+    row_limit=BOT_REACT_ROW_LIMIT,
+    row_window=BOT_REACT_ROW_WINDOW,
+    collapse_window=BOT_REACT_COLLAPSE,
+)
+
+
+@dp.callback_query(F.data == "deleted")
+async def deleted_card_handler(cq: CallbackQuery):
+    # кнопка-отметка на карточке удалённого сообщения (deletions.py, режим mark)
+    with stage("reaction_handler", "answer"), tg_call("answer_callback_query"):
+        await cq.answer("The author deleted this message", show_alert=False)
+
 
 @dp.callback_query(F.data.regexp(r"^(like|dislike)_(\d+)$"))
 async def reaction_handler(cq: CallbackQuery):
@@ -512,43 +676,131 @@ async def reaction_handler(cq: CallbackQuery):
         user_id = cq.from_user.id
         new_reaction = 1 if action == "like" else -1
 
+        # 0) слишком частые клики отвечаем сразу, без БД
+        admission = THROTTLE.admit(row_id, user_id, new_reaction, cq.message)
+        if admission.action == SHED:
+            with stage("reaction_handler", "answer"), tg_call("answer_callback_query"):
+                await cq.answer("Too many clicks, try again in a moment ⏳", show_alert=False)
+            return
+        if admission.action != PASS:
+            # повтор в серии: ответ по известному состоянию, запись — одна, после паузы;
+            # пока первый toggle не вернулся, итог клика неизвестен (result=None)
+            with stage("reaction_handler", "answer"), tg_call("answer_callback_query"):
+                await cq.answer(_REACTION_ANSWERS.get(admission.result, "Updating… ⏳"), show_alert=False)
+            return
+
         # 1) изменить реакцию в БД
-        result = toggle_reaction(row_id=row_id, user_id=user_id, new_reaction=new_reaction)
-
-        # 2) пересчитать свежие значения по пользователю, а не по посту
-        msg = get_message_by_id(row_id)  # берём сообщение, чтобы узнать sender_id
-        sender_id = msg["sender_id"]
-        likes, dislikes = get_user_reputation(sender_id)
-
-        # 3) запланировать объединённое обновление (текст + кнопки)
-        otc_msg_id = cq.message.message_id
-        start_payload = f"{row_id}_{otc_msg_id}"
-
-        _schedule_coalesced_update(
-            cq.message,
-            row_id=row_id,
-            likes=likes,
-            dislikes=dislikes,
-            start_payload=start_payload,
-            delay=1.0,  # можно 1.5–2.0 при высоком трафике
-        )
+        result = None
+        try:
+            with stage("reaction_handler", "toggle"):
+                result = await asyncio.to_thread(toggle_reaction, row_id=row_id, user_id=user_id, new_reaction=new_reaction)
+        finally:
+            THROTTLE.settle(row_id, user_id, new_reaction, result, cq.message)
+
+        # 2) пересчитать репутацию и 3) запланировать правку карточки
+        await _refresh_card(cq.message, row_id)
 
         # мгновенный ответ пользователю
-        if result == "added":
-            await cq.answer("Saved ✅", show_alert=False)
-        elif result == "removed":
-            await cq.answer("Removed ↩️", show_alert=False)
-        else:
-            await cq.answer("Switched 🔁", show_alert=False)
+        with stage("reaction_handler", "answer"), tg_call("answer_callback_query"):
+            await cq.answer(_REACTION_ANSWERS[result], show_alert=False)
 
     except Exception:
         log.exception("reaction handler error")
         await cq.answer("Error", show_alert=False)
 
 
+async def _drain(flusher: asyncio.Task) -> None:
+    """Дожидаемся обработчиков, затем досылаем накопленные правки карточек."""
+    if not await IN_FLIGHT.wait_idle(BOT_DRAIN_TIMEOUT):
+        log.warning("drain timeout: %s update(s) still in flight", IN_FLIGHT.active)
+    # свёрнутые серии кликов пишем сразу — их правки карточек досылаются ниже
+    try:
+        await THROTTLE.drain()
+    except Exception:
+        log.exception("reaction throttle drain failed")
+    flusher.cancel()
+    # не теряем накопленные клики при остановке
+    try:
+        for _ in range(5):
+            if not await flush_pending(force=True):
+                break
+    except Exception:
+        log.exception("final flush failed")
+
+
+async def run_webhook(flusher: asyncio.Task) -> None:
+    app = web.Application()
+    handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,   # Telegram получает 200 сразу, обработка — в задаче
+        secret_token=WEBHOOK_SECRET or None,
+    )
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    log.info("webhook listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        log.info("stopping webhook: no new updates, draining %s in flight", IN_FLIGHT.active)
+        await site.stop()
+        await _drain(flusher)
+        await runner.cleanup()   # закрывает и сессию бота
+
+
 async def main() -> None:
-    await dp.start_polling(bot)
+    init_db()
+    await start_metrics_server(METRICS_PORT)
+    try:
+        await CHATS.refresh()
+        log.info("chats registry: %d chats", len(CHATS))
+    except Exception as e:
+        log.warning("chats registry not loaded, will retry: %s", e)
+    asyncio.create_task(CHATS.run())
+    asyncio.create_task(CARDS.run())
+    asyncio.create_task(BUS.run())
+    asyncio.create_task(compact_loop())
+    flusher = asyncio.create_task(pending_edits_loop())
+    if BOT_MODE == "webhook":
+        await run_webhook(flusher)
+        return
+    try:
+        await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await _drain(flusher)
+        await bot.session.close()
 
 
-if __name__ == "__main__":
+def run() -> None:
+    if BOT_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            uvloop = None
+        if uvloop is not None:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main())
+            return
     asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run()
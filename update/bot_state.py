@@ -0,0 +1,155 @@
+# bot_state.py
+"""
+Состояние бота, которое раньше жило в словарях модуля bot.py:
+
+  - last reply: какой ответ бота на /start последний в личке (чтобы
+    редактировать его, а не слать новый);
+  - pending edits: объединение кликов по карточке в одну правку через delay.
+
+Два бэкенда с одним интерфейсом (BOT_STATE_BACKEND):
+
+  memory   — как раньше, один процесс; last reply ограничен LRU.
+  postgres — otc.bot_last_reply / otc.bot_pending_edits: правки забираются
+             в аренду (owner + lease_until), поэтому несколько воркеров
+             делят нагрузку, а незавершённые правки после рестарта
+             досылает любой живой воркер.
+"""
+import os
+import time
+import socket
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+from db import (
+    get_last_reply_id,
+    set_last_reply_id,
+    prune_last_reply_ids,
+    upsert_pending_edit,
+    claim_pending_edits,
+    complete_pending_edit,
+    release_pending_edit,
+)
+
+LAST_REPLY_MAX = int(os.getenv("BOT_LAST_REPLY_MAX", "50000"))
+# в личке старые ответы всё равно не редактируем — через неделю просто шлём новый
+LAST_REPLY_TTL_S = float(os.getenv("BOT_LAST_REPLY_TTL", str(7 * 24 * 3600)))
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MemoryState:
+    """Один процесс. Аренда тоже есть — чтобы flush-цикл работал одинаково."""
+
+    def __init__(self, max_replies: int = LAST_REPLY_MAX):
+        self.max_replies = max_replies
+        self._last: "OrderedDict[int, int]" = OrderedDict()
+        self._pending: dict[tuple[int, int], dict] = {}
+
+    async def get_last_reply(self, chat_id: int) -> Optional[int]:
+        msg_id = self._last.get(chat_id)
+        if msg_id is not None:
+            self._last.move_to_end(chat_id)
+        return msg_id
+
+    async def set_last_reply(self, chat_id: int, message_id: int) -> None:
+        self._last[chat_id] = message_id
+        self._last.move_to_end(chat_id)
+        while len(self._last) > self.max_replies:
+            self._last.popitem(last=False)
+
+    async def put_pending(self, *, chat_id: int, message_id: int, row_id: int, likes: int,
+                          dislikes: int, start_payload: str, delay_s: float) -> None:
+        key = (chat_id, message_id)
+        due = time.monotonic() + delay_s
+        e = self._pending.get(key)
+        if e is None:
+            self._pending[key] = {
+                "chat_id": chat_id, "message_id": message_id, "row_id": row_id,
+                "likes": likes, "dislikes": dislikes, "start_payload": start_payload,
+                "due_at": due, "version": 1, "owner": None, "lease_until": None,
+            }
+            return
+        e.update(row_id=row_id, likes=likes, dislikes=dislikes, start_payload=start_payload,
+                 due_at=min(e["due_at"], due), version=e["version"] + 1)
+
+    async def claim_due(self, owner: str, limit: int = 20, lease_s: float = 30.0,
+                        force: bool = False) -> list[dict]:
+        now = time.monotonic()
+        out = []
+        for e in sorted(self._pending.values(), key=lambda e: e["due_at"]):
+            if len(out) >= limit:
+                break
+            if not force and e["due_at"] > now:
+                break
+            if e["lease_until"] is not None and e["lease_until"] >= now:
+                continue
+            e["owner"], e["lease_until"] = owner, now + lease_s
+            out.append(dict(e))
+        return out
+
+    async def complete(self, item: dict, owner: str, cooldown_s: float) -> bool:
+        key = (item["chat_id"], item["message_id"])
+        e = self._pending.get(key)
+        if e is None or e["owner"] != owner:
+            return False
+        if e["version"] == item["version"]:
+            del self._pending[key]
+            return True
+        e.update(owner=None, lease_until=None, due_at=time.monotonic() + cooldown_s)
+        return False
+
+    async def release(self, item: dict, owner: str, delay_s: float) -> None:
+        e = self._pending.get((item["chat_id"], item["message_id"]))
+        if e is not None and e["owner"] == owner:
+            e.update(owner=None, lease_until=None, due_at=time.monotonic() + delay_s)
+
+    async def prune(self) -> int:
+        return 0
+
+
+class PostgresState:
+    """Общее состояние в Postgres; синхронные вызовы db.py уводим в поток."""
+
+    async def get_last_reply(self, chat_id: int) -> Optional[int]:
+        return await asyncio.to_thread(get_last_reply_id, chat_id)
+
+    async def set_last_reply(self, chat_id: int, message_id: int) -> None:
+        await asyncio.to_thread(set_last_reply_id, chat_id, message_id)
+
+    async def put_pending(self, *, chat_id: int, message_id: int, row_id: int, likes: int,
+                          dislikes: int, start_payload: str, delay_s: float) -> None:
+        await asyncio.to_thread(
+            upsert_pending_edit, chat_id=chat_id, message_id=message_id, row_id=row_id,
+            likes=likes, dislikes=dislikes, start_payload=start_payload, delay_s=delay_s,
+        )
+
+    async def claim_due(self, owner: str, limit: int = 20, lease_s: float = 30.0,
+                        force: bool = False) -> list[dict]:
+        return await asyncio.to_thread(claim_pending_edits, owner, limit, lease_s, force)
+
+    async def complete(self, item: dict, owner: str, cooldown_s: float) -> bool:
+        return await asyncio.to_thread(
+            complete_pending_edit, chat_id=item["chat_id"], message_id=item["message_id"],
+            owner=owner, version=item["version"], cooldown_s=cooldown_s,
+        )
+
+    async def release(self, item: dict, owner: str, delay_s: float) -> None:
+        await asyncio.to_thread(
+            release_pending_edit, chat_id=item["chat_id"], message_id=item["message_id"],
+            owner=owner, delay_s=delay_s,
+        )
+
+    async def prune(self) -> int:
+        return await asyncio.to_thread(prune_last_reply_ids, LAST_REPLY_TTL_S)
+
+
+def make_state(kind: Optional[str] = None):
+    kind = (kind or os.getenv("BOT_STATE_BACKEND", "memory")).lower()
+    if kind == "memory":
+        return MemoryState()
+    if kind == "postgres":
+        return PostgresState()
+    raise ValueError(f"unknown BOT_STATE_BACKEND: {kind!r} (memory | postgres)")
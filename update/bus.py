@@ -0,0 +1,158 @@
+# bus.py
+"""
+Шина инвалидации кэшей между процессами на Postgres LISTEN/NOTIFY.
+
+Писатели в db.py шлют в канал otc_events короткие события
+{"k": kind, "ids": [...]} в той же транзакции, что и запись (см. db._notify).
+Коллектор и бот держат по одному выделенному async-соединению с LISTEN
+и раздают события подписчикам:
+
+    bus = EventBus()
+    bus.subscribe("row", CARDS.invalidate_many)
+    bus.on_state(lambda connected: ...)   # True — (пере)подключились, False — потеряли связь
+    asyncio.create_task(bus.run())
+
+Пока шина отключена, события теряются, поэтому подписчики на on_state(False)
+должны перестать доверять кэшу, а на on_state(True) — сбросить/сверить его.
+"""
+import json
+import time
+import asyncio
+import logging
+import inspect
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+import psycopg
+
+from db import PG_DSN, EVENTS_CHANNEL
+from metrics import Counter, Gauge
+
+log = logging.getLogger("bus")
+
+BUS_EVENTS_TOTAL = Counter("otc_bus_events_total", "Invalidation events received", ("kind",))
+BUS_CONNECTED = Gauge("otc_bus_connected", "1 if the LISTEN connection is up")
+
+
+class EventBus:
+    def __init__(self, dsn: str = PG_DSN, channel: str = EVENTS_CHANNEL, *,
+                 reconnect_delay: float = 1.0, reconnect_max_delay: float = 30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.connected = False
+        self._handlers: dict[str, list[Callable[[list[int]], Any]]] = {}
+        self._state_handlers: list[Callable[[bool], Any]] = []
+
+    def subscribe(self, kind: str, handler: Callable[[list[int]], Any]) -> None:
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def on_state(self, handler: Callable[[bool], Any]) -> None:
+        self._state_handlers.append(handler)
+
+    @staticmethod
+    def _call(handler, arg) -> None:
+        try:
+            res = handler(arg)
+            if inspect.isawaitable(res):
+                asyncio.ensure_future(res)
+        except Exception:
+            log.exception("bus handler failed")
+
+    def _set_state(self, connected: bool) -> None:
+        if connected == self.connected:
+            return
+        self.connected = connected
+        BUS_CONNECTED.set(1 if connected else 0)
+        for h in self._state_handlers:
+            self._call(h, connected)
+
+    def dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+            kind, ids = event["k"], event["ids"]
+        except Exception:
+            log.warning("bad bus payload: %r", payload[:200])
+            return
+        BUS_EVENTS_TOTAL.labels(kind).inc()
+        for h in self._handlers.get(kind, ()):
+            self._call(h, ids)
+
+    async def run(self) -> None:
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self.channel}")
+                    self._set_state(True)
+                    delay = self.reconnect_delay
+                    async for n in conn.notifies():
+                        self.dispatch(n.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("bus connection lost: %s; retry in %.0fs", e, delay)
+            self._set_state(False)
+            await asyncio.sleep(delay)
+            delay = min(self.reconnect_max_delay, delay * 2)
+
+
+_MISSING = object()
+
+
+class InvalidatedCache:
+    """
+    LRU с TTL для значений, которые инвалидирует шина. Пока шина не
+    подключена (enabled=False), кэш пропускает всё мимо — поведение
+    как без кэша. TTL — страховка на случай потерянного события.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 50000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = False
+        # растёт на каждой инвалидации: значение, загруженное в потоке, пока
+        # пришло событие, в кэш не кладём — оно могло быть прочитано до записи
+        self._epoch = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, loader: Callable[[Hashable], Any], now: Optional[float] = None) -> Any:
+        """Синхронно: зовут и из потоков (asyncio.to_thread), операции с dict атомарны под GIL."""
+        if not self.enabled:
+            return loader(key)
+        now = now if now is not None else time.monotonic()
+        hit = self._data.get(key, _MISSING)
+        if hit is not _MISSING and hit[0] > now:
+            return hit[1]
+        epoch = self._epoch
+        value = loader(key)
+        if self.enabled and epoch == self._epoch:
+            self._data[key] = (now + self.ttl, value)
+            while len(self._data) > self.max_size:
+                try:
+                    self._data.popitem(last=False)
+                except KeyError:
+                    break
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.enabled:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, keys: Iterable[Hashable]) -> None:
+        self._epoch += 1
+        for k in keys:
+            self._data.pop(k, None)
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._data.clear()
+
+    def set_enabled(self, enabled: bool) -> None:
+        # и при обрыве, и при переподключении события могли потеряться
+        self.clear()
+        self.enabled = enabled
+
+    def __len__(self) -> int:
+        return len(self._data)
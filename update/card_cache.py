@@ -0,0 +1,119 @@
+# card_cache.py
+"""
+Кэш карточек «как связаться с покупателем» для /start <row_id>_<otc_msg_id>.
+
+Популярную карточку кликают сотни раз, а собирается она из одной и той же
+строки архива. Храним по row_id узкую проекцию строки (sender_id,
+sender_username, chat_id, message_id, deleted) и уже отрендеренные текст и
+кнопки — повторный клик обходится без БД.
+
+Инвалидация:
+  - username отправителя / удаление — событие "row" шины (bus.py) сразу
+    сбрасывает карточку; страховка — фоновая сверка всех закэшированных
+    row_id одним запросом по первичному ключу раз в revalidate_interval;
+  - метаданные чата (otc.chats) — сравниваются на каждом попадании с
+    ChatCache в памяти; поменялись — перерисовываем из закэшированной строки.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple, Optional
+
+from db import get_contact_rows_state
+from metrics import Counter, Gauge
+
+log = logging.getLogger("card_cache")
+
+CONTACT_CARDS_TOTAL = Counter(
+    "otc_bot_contact_cards_total", "Contact card lookups in start_handler", ("result",),
+)
+CONTACT_CARDS_CACHED = Gauge("otc_bot_contact_cards_cached", "Contact cards held in memory")
+
+
+class ContactCard(NamedTuple):
+    row: dict        # узкая проекция строки архива
+    chat_meta: tuple  # (username, title) чата на момент рендера
+    text: str
+    rendered: Any    # что вернул render(row, chat_meta): кнопки и т.п.
+
+
+class ContactCardCache:
+    def __init__(
+        self,
+        render: Callable[[dict, tuple], tuple[str, Any]],
+        chat_meta: Callable[[int], tuple],
+        *,
+        max_size: int = 10000,
+        revalidate_interval: float = 30.0,
+    ):
+        self.render = render
+        self.chat_meta = chat_meta
+        self.max_size = max_size
+        self.revalidate_interval = revalidate_interval
+        self._cards: "OrderedDict[int, ContactCard]" = OrderedDict()
+
+    def _build(self, row: dict) -> ContactCard:
+        meta = self.chat_meta(row["chat_id"])
+        text, rendered = self.render(row, meta)
+        return ContactCard(row, meta, text, rendered)
+
+    def get(self, row_id: int) -> Optional[ContactCard]:
+        card = self._cards.get(row_id)
+        if card is None:
+            CONTACT_CARDS_TOTAL.labels("miss").inc()
+            return None
+        self._cards.move_to_end(row_id)
+        if self.chat_meta(card.row["chat_id"]) != card.chat_meta:
+            CONTACT_CARDS_TOTAL.labels("rerender").inc()
+            card = self._cards[row_id] = self._build(card.row)
+        else:
+            CONTACT_CARDS_TOTAL.labels("hit").inc()
+        return card
+
+    def put(self, row_id: int, row: dict) -> ContactCard:
+        card = self._cards[row_id] = self._build(row)
+        self._cards.move_to_end(row_id)
+        while len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+        CONTACT_CARDS_CACHED.set(len(self._cards))
+        return card
+
+    def invalidate(self, row_id: int) -> bool:
+        dropped = self._cards.pop(row_id, None) is not None
+        CONTACT_CARDS_CACHED.set(len(self._cards))
+        return dropped
+
+    def invalidate_many(self, row_ids) -> int:
+        dropped = sum(self._cards.pop(i, None) is not None for i in row_ids)
+        CONTACT_CARDS_CACHED.set(len(self._cards))
+        if dropped:
+            CONTACT_CARDS_TOTAL.labels("invalidated").inc(dropped)
+        return dropped
+
+    async def revalidate(self) -> int:
+        """Сбрасывает карточки, у строк которых сменился username или deleted (или строки нет)."""
+        if not self._cards:
+            return 0
+        ids = list(self._cards)
+        fresh = {r["id"]: r for r in await asyncio.to_thread(get_contact_rows_state, ids)}
+        dropped = 0
+        for row_id in ids:
+            card = self._cards.get(row_id)
+            if card is None:
+                continue
+            cur = fresh.get(row_id)
+            if (cur is None
+                    or cur["sender_username"] != card.row["sender_username"]
+                    or cur["deleted"] != card.row["deleted"]):
+                dropped += self.invalidate(row_id)
+        if dropped:
+            CONTACT_CARDS_TOTAL.labels("invalidated").inc(dropped)
+        return dropped
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.revalidate_interval)
+            try:
+                await self.revalidate()
+            except Exception as e:
+                log.warning("contact cards revalidate failed: %s", e)
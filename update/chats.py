@@ -0,0 +1,174 @@
+# chats.py
+"""
+Справочник чатов otc.chats (chat_id, username, title, is_forum) вместо
+ручного otc_chats_index.json.
+
+  ChatRegistry — коллектор: смотрит на сущности Telethon, которые и так
+                 приходят с апдейтами (event.chat) и из списка диалогов,
+                 и пачкой пишет в БД только то, что поменялось.
+  ChatCache    — бот: весь справочник в памяти, инкрементальный refresh
+                 по updated_at; диплинки отвечают без запросов в БД/Telegram.
+
+Разовый перенос старого индекса:
+    python update/chats.py import otc_chats_index.json
+    python update/chats.py list
+"""
+import json
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from telethon import utils
+from telethon.tl.types import Channel, Chat
+
+from db import upsert_chats, get_chats_since
+
+log = logging.getLogger("chats")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# updated_at ставит now() транзакции: строка, закоммиченная чуть позже
+# чужого refresh, может иметь метку раньше его водяного знака — перекрываемся
+_REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+def chat_meta(entity) -> Optional[dict]:
+    """Сущность Telethon -> строка otc.chats; None для пользователей и прочего."""
+    if not isinstance(entity, (Channel, Chat)):
+        return None
+    username = getattr(entity, "username", None)
+    if not username:
+        # у чатов с несколькими (коллекционными) username основной — первый активный
+        for u in getattr(entity, "usernames", None) or ():
+            if getattr(u, "active", False):
+                username = u.username
+                break
+    return {
+        "chat_id": utils.get_peer_id(entity),
+        "username": username,
+        "title": getattr(entity, "title", None),
+        "is_forum": bool(getattr(entity, "forum", False)),
+    }
+
+
+class ChatRegistry:
+    """Коллектор: копит изменения метаданных чатов и сбрасывает их пачкой."""
+
+    def __init__(self, *, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._known: dict[int, tuple] = {}
+        self._pending: dict[int, dict] = {}
+
+    async def load(self) -> int:
+        """То, что уже лежит в БД, — чтобы не переписывать неизменившееся."""
+        rows = await asyncio.to_thread(get_chats_since, _EPOCH)
+        for r in rows:
+            self._known[r["chat_id"]] = (r["username"], r["title"], r["is_forum"])
+        return len(rows)
+
+    def observe(self, entity) -> bool:
+        """Дёшево, без сети: сравнить с известным и, если поменялось, поставить в очередь."""
+        meta = chat_meta(entity)
+        if meta is None:
+            return False
+        key = (meta["username"], meta["title"], meta["is_forum"])
+        if self._known.get(meta["chat_id"]) == key:
+            return False
+        self._known[meta["chat_id"]] = key
+        self._pending[meta["chat_id"]] = meta
+        return True
+
+    async def sync_dialogs(self, client, only: Optional[Iterable[int]] = None) -> int:
+        """Полный проход по диалогам аккаунта (пачками по 100 в одном запросе)."""
+        only = set(only) if only is not None else None
+        n = 0
+        async for d in client.iter_dialogs():
+            if only is not None and d.id not in only:
+                continue
+            n += self.observe(d.entity)
+        await self.flush()
+        return n
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = list(self._pending.values()), {}
+        try:
+            n = await asyncio.to_thread(upsert_chats, batch)
+        except Exception as e:
+            # вернём в очередь, не затирая более свежие наблюдения
+            for m in batch:
+                self._pending.setdefault(m["chat_id"], m)
+            log.warning("chats flush failed (%d pending): %s", len(self._pending), e)
+            return 0
+        if n:
+            print(f"[chats] обновлено {n} чатов")
+        return n
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+class ChatCache:
+    """Бот: otc.chats в памяти; refresh тянет только строки новее водяного знака."""
+
+    def __init__(self, *, refresh_interval: float = 60.0):
+        self.refresh_interval = refresh_interval
+        self._chats: dict[int, dict] = {}
+        self._since = _EPOCH
+
+    def get(self, chat_id: int) -> Optional[dict]:
+        return self._chats.get(chat_id)
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    async def refresh(self) -> int:
+        rows = await asyncio.to_thread(get_chats_since, self._since - _REFRESH_OVERLAP)
+        for r in rows:
+            self._chats[r["chat_id"]] = r
+            if r["updated_at"] > self._since:
+                self._since = r["updated_at"]
+        return len(rows)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                # старый справочник остаётся в силе — лучше устаревший, чем пустой
+                log.warning("chats refresh failed, keeping %d chats: %s", len(self._chats), e)
+
+
+def import_index(path: str) -> int:
+    """otc_chats_index.json: {"<chat_id>": {"username", "title", ...}}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rows = [
+        {"chat_id": int(k), "username": v.get("username") or None,
+         "title": v.get("title") or None, "is_forum": bool(v.get("is_forum", False))}
+        for k, v in data.items()
+    ]
+    return upsert_chats(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="otc.chats registry")
+    ap.add_argument("command", choices=("import", "list"))
+    ap.add_argument("path", nargs="?", default="otc_chats_index.json")
+    args = ap.parse_args()
+
+    if args.command == "import":
+        print(f"imported {import_index(args.path)} chats from {args.path}")
+        return
+    for r in get_chats_since(_EPOCH):
+        forum = " forum" if r["is_forum"] else ""
+        print(f"{r['chat_id']:>16}  @{r['username'] or '-':<32} {r['title'] or ''}{forum}")
+
+
+if __name__ == "__main__":
+    main()
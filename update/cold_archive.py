@@ -0,0 +1,248 @@
+# cold_archive.py
+"""
+Холодный ярус otc.messages_archive.
+
+Строки старше ARCHIVE_RETENTION_DAYS, под которыми нет карточек (published_post,
+publish_outbox) и реакций, пачками переезжают в parquet-сегменты (zstd,
+колонки как в таблице) в ARCHIVE_COLD_DIR и удаляются из горячей таблицы;
+сегменты учитываются в otc.archive_segments (диапазон id и время).
+Горячая таблица и её индексы остаются размером с рабочий набор.
+
+db.get_message_by_id, не найдя строку в таблице, прозрачно ищет её здесь:
+по каталогу — сегменты, чей диапазон id её покрывает, в сегменте —
+только row group, где она может быть (статистика parquet по id).
+
+Что не видит холодные строки: проверка дубликатов при вставке и отчёты
+аналитики — они работают по горячей таблице. «Total messages» отправителя
+(db.get_user_stats) их учитывает: экспорт копит число его неудалённых
+строк в otc.sender_cold_counts, restore вычитает. Почасовой спрос (demand.py)
+часы, задетые сегментами, больше не пересчитывает.
+
+    python update/cold_archive.py export [--days 180] [--batch 50000]
+    python update/cold_archive.py status
+    python update/cold_archive.py get <row_id>
+    python update/cold_archive.py restore <segment_id>
+    python update/cold_archive.py recount     # otc.sender_cold_counts заново по всем сегментам
+"""
+import os
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # без pyarrow холодный ярус недоступен, горячий работает как раньше
+    pa = pq = None
+
+from db import (export_cold_batch, find_cold_segments, list_cold_segments, restore_cold_segment,
+                recount_sender_cold_counts)
+from metrics import Counter
+
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))  # 0 — ярус выключен
+ARCHIVE_COLD_DIR = os.getenv("ARCHIVE_COLD_DIR", "data/cold")
+ARCHIVE_COLD_BATCH = int(os.getenv("ARCHIVE_COLD_BATCH", "50000"))
+ARCHIVE_COLD_INTERVAL = float(os.getenv("ARCHIVE_COLD_INTERVAL", "86400"))
+
+COLD_ROWS_TOTAL = Counter("otc_archive_cold_rows_total", "Archive rows moved to cold parquet segments")
+COLD_LOOKUPS_TOTAL = Counter("otc_archive_cold_lookups_total", "get_message_by_id fallbacks to cold storage", ("result",))
+
+# схема сегмента фиксирована, чтобы сегменты разных лет читались одинаково
+# (колонка, целиком из NULL, иначе получила бы тип null)
+if pa is not None:
+    _TS = pa.timestamp("us", tz="UTC")
+    ARCHIVE_SCHEMA = pa.schema([
+        ("id", pa.int64()),
+        ("message_id", pa.int64()),
+        ("chat_id", pa.int64()),
+        ("sender_id", pa.int64()),
+        ("sender_username", pa.string()),
+        ("ts_utc", _TS),
+        ("text", pa.string()),
+        ("processed", pa.bool_()),
+        ("text_hash", pa.string()),
+        ("duplicates_count", pa.int32()),
+        ("deleted", pa.bool_()),
+        ("deleted_at", _TS),
+        ("reply_to_msg_id", pa.int64()),
+        ("is_wtb", pa.bool_()),
+        ("topic_ids", pa.list_(pa.int64())),
+        ("tags", pa.list_(pa.string())),
+        ("tags_rev", pa.string()),
+        ("text_clean", pa.string()),
+        ("last_seen_at", _TS),
+    ])
+
+
+def _require_pyarrow() -> None:
+    if pq is None:
+        raise RuntimeError("cold archive needs pyarrow (pip install pyarrow)")
+
+
+def write_segment(rows: list[dict], cold_dir: str = ARCHIVE_COLD_DIR) -> dict:
+    """rows (по возрастанию id) -> parquet; пишем во временный файл и переименовываем."""
+    _require_pyarrow()
+    os.makedirs(cold_dir, exist_ok=True)
+    path = os.path.join(os.path.abspath(cold_dir), f"archive_{rows[0]['id']:012d}_{rows[-1]['id']:012d}.parquet")
+    table = pa.Table.from_pylist(
+        [{name: r.get(name) for name in ARCHIVE_SCHEMA.names} for r in rows], schema=ARCHIVE_SCHEMA,
+    )
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression="zstd", row_group_size=8192, write_statistics=True)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"path": path, "bytes": os.path.getsize(path)}
+
+
+def export(days: float = ARCHIVE_RETENTION_DAYS, batch: int = ARCHIVE_COLD_BATCH,
+           cold_dir: str = ARCHIVE_COLD_DIR, progress=None) -> tuple[int, int]:
+    """Вынести всё, что старше days. Возвращает (строк, байт на диске)."""
+    _require_pyarrow()
+    before = datetime.now(timezone.utc) - timedelta(days=days)
+    after_id, rows, size = 0, 0, 0
+    while True:
+        seg = export_cold_batch(before, after_id, batch, lambda r: write_segment(r, cold_dir))
+        if seg is None:
+            break
+        after_id = seg["max_id"]
+        rows += seg["rows"]
+        size += seg["bytes"]
+        COLD_ROWS_TOTAL.inc(seg["rows"])
+        if progress:
+            progress(seg)
+    return rows, size
+
+
+@lru_cache(maxsize=64)
+def _segment(path: str):
+    return pq.ParquetFile(path)
+
+
+def _read_row(path: str, row_id: int) -> Optional[dict]:
+    pf = _segment(path)
+    id_col = pf.schema_arrow.get_field_index("id")
+    for rg in range(pf.num_row_groups):
+        stats = pf.metadata.row_group(rg).column(id_col).statistics
+        if stats is not None and stats.has_min_max and not (stats.min <= row_id <= stats.max):
+            continue
+        table = pf.read_row_group(rg)
+        ids = table.column("id").to_pylist()
+        if row_id in ids:
+            return table.slice(ids.index(row_id), 1).to_pylist()[0]
+    return None
+
+
+def get_cold_message(row_id: int) -> Optional[dict]:
+    """Строка архива из холодного яруса (те же ключи, что у SELECT *), None — нет нигде."""
+    if pq is None:
+        return None
+    segments = find_cold_segments(row_id)
+    if not segments:
+        return None
+    for seg in segments:
+        try:
+            row = _read_row(seg["path"], row_id)
+        except OSError:
+            COLD_LOOKUPS_TOTAL.labels("error").inc()
+            continue
+        if row is not None:
+            COLD_LOOKUPS_TOTAL.labels("hit").inc()
+            return row
+    COLD_LOOKUPS_TOTAL.labels("miss").inc()
+    return None
+
+
+def restore(segment_id: int) -> dict:
+    """
+    Вернуть сегмент в горячую таблицу. Файл удаляется только после коммита и только
+    если каждая строка вернулась или слилась с более поздним повтором (см.
+    db.restore_cold_segment); иначе сегмент и файл остаются как были.
+    """
+    _require_pyarrow()
+    seg = next((s for s in list_cold_segments() if s["id"] == segment_id), None)
+    if seg is None:
+        raise SystemExit(f"segment {segment_id} not found")
+    rows = pq.read_table(seg["path"]).to_pylist()
+    if len(rows) != seg["rows"]:
+        raise SystemExit(f"segment {segment_id}: file has {len(rows)} rows, catalog says {seg['rows']}")
+    res = restore_cold_segment(segment_id, rows)
+    _segment.cache_clear()
+    if sum(res.values()) == len(rows):
+        os.remove(seg["path"])
+    return res
+
+
+def _count_senders(segments: list[dict]) -> dict[int, int]:
+    counts: dict[int, int] = {}
+    for seg in segments:
+        t = pq.read_table(seg["path"], columns=["sender_id", "deleted"])
+        for sender_id, deleted in zip(t.column("sender_id").to_pylist(), t.column("deleted").to_pylist()):
+            if not deleted:
+                counts[sender_id] = counts.get(sender_id, 0) + 1
+    return counts
+
+
+def recount() -> int:
+    """otc.sender_cold_counts с нуля по файлам сегментов (сегменты до миграции 13). Возвращает отправителей."""
+    _require_pyarrow()
+    return recount_sender_cold_counts(_count_senders)
+
+
+async def retention_loop(days: float = ARCHIVE_RETENTION_DAYS, interval: float = ARCHIVE_COLD_INTERVAL) -> None:
+    """Фоновый перенос в коллекторе (если задан ARCHIVE_RETENTION_DAYS)."""
+    while True:
+        try:
+            rows, size = await asyncio.to_thread(export, days)
+            if rows:
+                print(f"[cold] вынесено {rows} строк старше {days:g} дн. ({size / 1e6:.1f} МБ)")
+        except Exception as e:
+            print(f"[cold] ошибка переноса: {e}")
+        await asyncio.sleep(interval)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Move old archive rows to compressed parquet segments")
+    ap.add_argument("command", choices=("export", "status", "get", "restore", "recount"))
+    ap.add_argument("id", nargs="?", type=int, help="row_id for get, segment id for restore")
+    ap.add_argument("--days", type=float, default=ARCHIVE_RETENTION_DAYS or 180)
+    ap.add_argument("--batch", type=int, default=ARCHIVE_COLD_BATCH)
+    ap.add_argument("--dir", default=ARCHIVE_COLD_DIR)
+    args = ap.parse_args()
+
+    if args.command == "status":
+        total_rows = total_bytes = 0
+        for s in list_cold_segments():
+            total_rows += s["rows"]
+            total_bytes += s["bytes"]
+            print(f"{s['id']:>5}  ids {s['min_id']}..{s['max_id']}  {s['min_ts']:%Y-%m-%d}..{s['max_ts']:%Y-%m-%d}"
+                  f"  {s['rows']:>7,} rows  {s['bytes'] / 1e6:7.1f} MB  {s['path']}")
+        print(f"cold: {total_rows:,} rows, {total_bytes / 1e6:.1f} MB")
+        return
+    if args.command in ("get", "restore") and args.id is None:
+        ap.error(f"{args.command} needs an id")
+    if args.command == "get":
+        print(get_cold_message(args.id))
+        return
+    if args.command == "restore":
+        res = restore(args.id)
+        print(f"restored {res['restored']:,} rows, merged {res['merged']:,} into later repeats"
+              + (f", {res['present']:,} already in the table" if res["present"] else ""))
+        return
+    if args.command == "recount":
+        print(f"cold counts for {recount():,} senders")
+        return
+
+    t0 = time.perf_counter()
+    rows, size = export(args.days, args.batch, args.dir,
+                        progress=lambda s: print(f"  ids {s['min_id']}..{s['max_id']}: {s['rows']:,} rows, "
+                                                 f"{s['bytes'] / 1e6:.1f} MB -> {s['path']}"))
+    print(f"moved {rows:,} rows older than {args.days:g} days to {args.dir} "
+          f"({size / 1e6:.1f} MB) in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# deletions.py
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, Optional
+
+from db import mark_deleted_batch, get_published_posts, delete_published_posts, drop_pending_edits
+
+log = logging.getLogger("deletions")
+
+# id супергрупп/каналов в формате Telethon начинаются с -100…
+_CHANNEL_ID_FLOOR = -1_000_000_000_000
+
+
+def is_channel_id(chat_id: int) -> bool:
+    return chat_id <= _CHANNEL_ID_FLOOR
+
+
+class DeletionTracker:
+    """
+    Копит удаления из events.MessageDeleted и сбрасывает их пачками.
+
+    Telethon присылает удаления очередями (иногда тысячи id за раз), а для
+    личек и обычных групп — без chat_id: там message_id сквозной для аккаунта.
+    Такие id разворачиваем на все отслеживаемые «не-канальные» чаты.
+    Вся пачка уходит в БД одним UPDATE через mark_deleted_batch.
+    """
+
+    def __init__(
+        self,
+        watch_chats: set[int],
+        *,
+        flush_interval: float = 2.0,
+        max_batch: int = 5000,
+        on_deleted: Optional[Callable[[list[int]], Awaitable[None]]] = None,
+    ):
+        self.watch_chats = watch_chats
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_deleted = on_deleted
+
+        self._pending: set[tuple[int, int]] = set()
+        self._first_seen: dict[tuple[int, int], datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def add(self, chat_id: int | None, message_ids: Iterable[int], scope: Optional[set[int]] = None) -> int:
+        """
+        Кладёт id в буфер, возвращает сколько пар (chat_id, message_id) добавлено.
+        scope — чаты аккаунта, с которого пришло удаление: сквозные id личек/групп
+        у каждого аккаунта свои, разворачиваем только на его чаты.
+        """
+        if chat_id is not None:
+            if chat_id not in self.watch_chats:
+                return 0
+            chats = (chat_id,)
+        else:
+            pool = self.watch_chats if scope is None else scope
+            chats = tuple(c for c in pool if not is_channel_id(c))
+            if not chats:
+                return 0
+
+        now = datetime.now(timezone.utc)
+        added = 0
+        for mid in message_ids:
+            for c in chats:
+                key = (c, int(mid))
+                if key not in self._pending:
+                    self._pending.add(key)
+                    self._first_seen[key] = now
+                    added += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return added
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Сбрасывает буфер в БД пачками по max_batch. Возвращает число помеченных строк."""
+        async with self._lock:
+            total = 0
+            while self._pending:
+                batch = []
+                for key in self._pending:
+                    batch.append(key)
+                    if len(batch) >= self.max_batch:
+                        break
+                for key in batch:
+                    self._pending.discard(key)
+
+                # время удаления — когда мы впервые увидели событие, а не время flush
+                deleted_at = min(self._first_seen.pop(k) for k in batch)
+                try:
+                    row_ids = await asyncio.to_thread(mark_deleted_batch, batch, deleted_at)
+                except Exception:
+                    log.exception("mark_deleted_batch failed, %d ids returned to buffer", len(batch))
+                    for key in batch:
+                        self._pending.add(key)
+                        self._first_seen.setdefault(key, deleted_at)
+                    break
+
+                total += len(row_ids)
+                if row_ids and self.on_deleted:
+                    try:
+                        await self.on_deleted(row_ids)
+                    except Exception:
+                        log.exception("on_deleted hook failed")
+            return total
+
+    async def run(self) -> None:
+        """Фоновый цикл: flush раз в flush_interval или сразу при переполнении буфера."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                n = await self.flush()
+                if n:
+                    print(f"[deleted] помечено удалёнными: {n}")
+
+
+def make_card_cleaner(bot_client, mode: str) -> Optional[Callable[[list[int]], Awaitable[None]]]:
+    """
+    Хук для опубликованных карточек удалённых сообщений:
+      - "delete": удаляет карточку из OTC группы и запись в published_post
+      - "mark":   убирает кнопки реакций и ставит отметку об удалении
+    Любое другое значение — карточки не трогаем.
+    """
+    from telethon import Button
+
+    mode = (mode or "").strip().lower()
+    if mode not in ("delete", "mark"):
+        return None
+
+    async def _clean(row_ids: list[int]) -> None:
+        posts = await asyncio.to_thread(get_published_posts, row_ids)
+        if not posts:
+            return
+
+        by_chat: dict[int, list[int]] = {}
+        for p in posts:
+            by_chat.setdefault(p["chat_id"], []).append(p["message_id"])
+        if mode == "mark":
+            # отложенная правка бота (клики до удаления) вернула бы кнопки реакций;
+            # бот и сам не правит карточки удалённых строк (render_post_body)
+            await asyncio.to_thread(drop_pending_edits, [(p["chat_id"], p["message_id"]) for p in posts])
+
+        for chat_id, msg_ids in by_chat.items():
+            if mode == "delete":
+                # Telegram принимает до 100 id за один запрос; ошибка по одному чату
+                # (нет прав, карточку уже удалили руками) не мешает остальным и
+                # не оставляет записи published_post
+                for i in range(0, len(msg_ids), 100):
+                    try:
+                        await bot_client.delete_messages(chat_id, msg_ids[i:i + 100])
+                    except Exception as e:
+                        log.warning("delete cards in %s failed: %s", chat_id, e)
+            else:
+                for mid in msg_ids:
+                    try:
+                        await bot_client.edit_message(
+                            chat_id, mid,
+                            buttons=[Button.inline("🗑 Deleted by author", data=b"deleted")],
+                        )
+                    except Exception as e:
+                        log.debug("mark card %s/%s failed: %s", chat_id, mid, e)
+
+        if mode == "delete":
+            await asyncio.to_thread(delete_published_posts, [p["row_id"] for p in posts])
+        print(f"[deleted] карточек обработано ({mode}): {len(posts)}")
+
+    return _clean
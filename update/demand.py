@@ -0,0 +1,195 @@
+# demand.py
+"""
+Почасовой спрос: otc.demand_rollup (миграция 12).
+
+На (час, chat_id, категория, тег) — число WTB-сообщений и скетч
+отправителей (KMV: 256 наименьших хэшей sender_id). Скетчи складываются
+агрегатом otc.sketch_union, так что «разных покупателей за неделю по
+всем чатам» считается из почасовых строк без архива; до 256 отправителей
+оценка точная, дальше — с ошибкой порядка 6%. category = tag = '' —
+все WTB часа, включая сообщения без тегов.
+
+Таблицу ведёт фоновый проход от водяного знака (otc.demand_rollup_state.last_id):
+часы строк архива после знака пересчитываются целиком, пересчёт
+идемпотентен (см. db.DEMAND_DIRTY_HOURS_SQL). Теги берутся из колонок
+архива; после смены tagging.TAGS_REVISION (retag.py перетегировал архив)
+таблица пересчитывается заново по дням. Часы, ушедшие в холодный ярус
+(cold_archive.py), не пересчитываются — их строки остаются как были.
+
+Коллектор крутит rollup_loop после retag (DEMAND_ROLLUP_INTERVAL), бот
+отвечает на /trends только из таблицы. Вручную:
+    python update/demand.py run
+    python update/demand.py rebuild
+    python update/demand.py status
+    python update/demand.py trends [--hours 168] [--category countries] [--chat <id>]
+    python update/demand.py series --tag '#revolut' --category payments_banks [--bucket day]
+"""
+import os
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from db import (get_demand_state, roll_demand, get_demand_rebuild_bounds, rebuild_demand_hours,
+                set_demand_state, get_demand_trends, get_demand_series)
+from tagging import TAGS_REVISION, TAG_CATEGORIES, KNOWN_ITEMS
+from metrics import Counter
+
+DEMAND_ROWS_TOTAL = Counter("otc_demand_rollup_rows_total", "Archive rows passed by the demand rollup watermark")
+DEMAND_HOURS_TOTAL = Counter("otc_demand_rollup_hours_total", "Hours recomputed in otc.demand_rollup")
+
+DEMAND_ROLLUP_INTERVAL = float(os.getenv("DEMAND_ROLLUP_INTERVAL", "60"))  # 0 — не вести
+DEMAND_ROLLUP_BATCH = int(os.getenv("DEMAND_ROLLUP_BATCH", "20000"))
+
+CATEGORIES = tuple(KNOWN_ITEMS)
+# пары тег/категория для SQL (unnest двух массивов)
+TAG_MAP = {
+    "tag_names": [t for t, cats in TAG_CATEGORIES.items() for _ in cats],
+    "tag_cats": [c for cats in TAG_CATEGORIES.values() for c in cats],
+}
+
+_HOUR = timedelta(hours=1)
+
+
+def _floor_hour(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def catch_up(batch: int = DEMAND_ROLLUP_BATCH) -> int:
+    """Догнать водяной знак до конца архива; возвращает строк архива (0 — занято другим процессом)."""
+    total = 0
+    while True:
+        res = roll_demand(TAG_MAP, batch)
+        if not res or not res["rows"]:
+            break
+        total += res["rows"]
+        DEMAND_ROWS_TOTAL.inc(res["rows"])
+        DEMAND_HOURS_TOTAL.inc(len(res["hours"]))
+        if res["rows"] < batch:
+            break
+    return total
+
+
+def rebuild(step: timedelta = timedelta(days=1), progress=None) -> int:
+    """
+    Пересчитать всю таблицу текущими тегами архива: окнами по step, каждое —
+    своя транзакция. Водяной знак ставится на max(id), взятый до начала,
+    строки новее догоняет catch_up. Возвращает число часов.
+    """
+    bounds = get_demand_rebuild_bounds()
+    if bounds["last_id"] is None:
+        set_demand_state(0, TAGS_REVISION)
+        return 0
+    start = bounds["min_hour"]
+    if bounds["frozen_hour"] is not None:
+        start = max(start, bounds["frozen_hour"] + _HOUR)
+    end = _floor_hour(datetime.now(timezone.utc)) + _HOUR
+    hours = 0
+    while start < end:
+        window = [start + _HOUR * i for i in range(int(min(step, end - start) / _HOUR))]
+        keys = rebuild_demand_hours(window, TAG_MAP)
+        hours += len(window)
+        DEMAND_HOURS_TOTAL.inc(len(window))
+        if progress:
+            progress(window[0], window[-1], keys)
+        start = window[-1] + _HOUR
+    set_demand_state(bounds["last_id"], TAGS_REVISION)
+    return hours
+
+
+def rollup_once(batch: int = DEMAND_ROLLUP_BATCH) -> int:
+    if get_demand_state()["tags_rev"] != TAGS_REVISION:
+        rebuild()
+    return catch_up(batch)
+
+
+async def rollup_loop(interval: float = DEMAND_ROLLUP_INTERVAL, batch: int = DEMAND_ROLLUP_BATCH,
+                      wait_for: Optional[asyncio.Task] = None) -> None:
+    """Фоновый проход в коллекторе; wait_for — дождаться retag, чтобы не считать старые теги."""
+    if wait_for is not None:
+        await asyncio.gather(wait_for, return_exceptions=True)
+    while True:
+        try:
+            await asyncio.to_thread(rollup_once, batch)
+        except Exception as e:
+            print(f"[demand] ошибка пересчёта спроса: {e}")
+        await asyncio.sleep(interval)
+
+
+def trends(hours: int = 168, *, category: Optional[str] = None, chat_id: Optional[int] = None,
+           limit: int = 10, now: Optional[datetime] = None) -> dict:
+    """
+    Спрос за последние hours часов (текущий час включительно) против такого же
+    окна перед ним: {"since", "until", "totals": {wtb, wtb_prev, senders}, "tags": [...]}.
+    """
+    until = _floor_hour(now or datetime.now(timezone.utc)) + _HOUR
+    since = until - _HOUR * hours
+    totals = get_demand_trends(since, until, category="", chat_id=chat_id, limit=1)
+    return {
+        "since": since,
+        "until": until,
+        "totals": totals[0] if totals else {"wtb": 0, "wtb_prev": 0, "senders": 0},
+        "tags": get_demand_trends(since, until, category=category, chat_id=chat_id, limit=limit),
+    }
+
+
+def series(tag: str = "", category: str = "", hours: int = 168, *, bucket: str = "hour",
+           chat_id: Optional[int] = None, now: Optional[datetime] = None) -> list[dict]:
+    until = _floor_hour(now or datetime.now(timezone.utc)) + _HOUR
+    return get_demand_series(category, tag, until - _HOUR * hours, until, bucket=bucket, chat_id=chat_id)
+
+
+def _change(now: int, prev: int) -> str:
+    if not prev:
+        return "new" if now else "-"
+    return f"{(now - prev) / prev:+.0%}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Maintain and query hourly WTB demand rollups")
+    ap.add_argument("command", choices=("run", "rebuild", "status", "trends", "series"))
+    ap.add_argument("--batch", type=int, default=DEMAND_ROLLUP_BATCH)
+    ap.add_argument("--hours", type=int, default=168, help="Window for trends/series")
+    ap.add_argument("--category", choices=CATEGORIES, default=None)
+    ap.add_argument("--tag", default="", help="Tag for series, e.g. '#revolut' (empty — all WTB)")
+    ap.add_argument("--chat", type=int, default=None, help="Only this chat_id")
+    ap.add_argument("--bucket", choices=("hour", "day"), default="hour")
+    ap.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.command == "status":
+        st = get_demand_state()
+        mark = "" if st["tags_rev"] == TAGS_REVISION else f" (current {TAGS_REVISION}: needs rebuild)"
+        print(f"watermark id={st['last_id']:,}  tags_rev={st['tags_rev'] or '-'}{mark}  "
+              f"updated {st['updated_at']:%Y-%m-%d %H:%M:%S}")
+        return
+    if args.command == "rebuild":
+        hours = rebuild(progress=lambda a, b, n: print(f"  {a:%Y-%m-%d %H:00}..{b:%H:00}: {n:,} keys"))
+        rows = catch_up(args.batch)
+        print(f"rebuilt {hours:,} hours, +{rows:,} new rows in {time.perf_counter() - t0:.1f}s")
+        return
+    if args.command == "run":
+        rows = rollup_once(args.batch)
+        print(f"rolled up {rows:,} archive rows in {time.perf_counter() - t0:.2f}s")
+        return
+    if args.command == "series":
+        for r in series(args.tag, args.category or "", args.hours, bucket=args.bucket, chat_id=args.chat):
+            fmt = "%Y-%m-%d" if args.bucket == "day" else "%Y-%m-%d %H:00"
+            print(f"{r['bucket']:{fmt}}  {r['wtb']:>7,}  ~{r['senders']:,} senders")
+        print(f"({time.perf_counter() - t0:.3f}s)")
+        return
+
+    rep = trends(args.hours, category=args.category, chat_id=args.chat, limit=args.limit)
+    tot = rep["totals"]
+    print(f"{rep['since']:%Y-%m-%d %H:00} .. {rep['until']:%Y-%m-%d %H:00} UTC: {tot['wtb']:,} WTB "
+          f"({_change(tot['wtb'], tot['wtb_prev'])}), ~{tot['senders']:,} buyers")
+    for r in rep["tags"]:
+        print(f"{r['category']:>22}  {r['tag']:<24} {r['wtb']:>7,}  {_change(r['wtb'], r['wtb_prev']):>6}"
+              f"  ~{r['senders']:,} buyers")
+    print(f"({time.perf_counter() - t0:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# message_state.py
+"""
+Перенос старых колонок состояния архива в otc.message_state (миграции 11 и 14).
+
+До миграции 11 повторы и удаления писались в широкую строку архива
+(duplicates_count, processed, deleted, deleted_at). Миграция 11 только
+создаёт otc.message_state: новые процессы пишут туда, а правки старых
+колонок от процессов прошлой версии триггер переносит приращениями, так
+что сами колонки больше не меняются. Накопленные в них значения переносит
+этот проход от водяного знака (otc.message_state_backfill.last_id) до
+target_id — последней строки на момент миграции: пачка строк по id
+складывается с otc.message_state, знак двигается в той же транзакции.
+Пока перенос идёт, view otc.messages_archive_v прибавляет старые колонки
+для строк выше знака.
+
+Когда проход дошёл до target_id и процессов прошлой версии не осталось,
+колонки убирает сжимающая миграция 14:
+    python update/migrations.py migrate --contract
+
+Коллектор крутит backfill_loop (MESSAGE_STATE_BACKFILL_INTERVAL), вручную:
+    python update/message_state.py run [--batch 10000]
+    python update/message_state.py status
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from db import backfill_message_state_batch, get_message_state_backfill_status
+from metrics import Counter
+
+MESSAGE_STATE_BACKFILL_ROWS_TOTAL = Counter(
+    "otc_message_state_backfill_rows_total", "Archive rows passed by the message_state backfill watermark",
+)
+
+MESSAGE_STATE_BACKFILL_INTERVAL = float(os.getenv("MESSAGE_STATE_BACKFILL_INTERVAL", "60"))  # 0 — не вести
+MESSAGE_STATE_BACKFILL_BATCH = int(os.getenv("MESSAGE_STATE_BACKFILL_BATCH", "10000"))
+MESSAGE_STATE_BACKFILL_PAUSE = float(os.getenv("MESSAGE_STATE_BACKFILL_PAUSE", "0.2"))
+
+
+def _done(res: dict) -> bool:
+    return res["last_id"] >= res["target_id"]
+
+
+def catch_up(batch: int = MESSAGE_STATE_BACKFILL_BATCH, pause: float = 0.0, progress=None) -> bool:
+    """Перенести до конца; True — перенос закончен, False — шаг делает другой процесс."""
+    while True:
+        res = backfill_message_state_batch(batch)
+        if res is None:
+            return False
+        MESSAGE_STATE_BACKFILL_ROWS_TOTAL.inc(res["rows"])
+        if progress and res["rows"]:
+            progress(res)
+        if _done(res):
+            return True
+        if pause:
+            time.sleep(pause)
+
+
+async def backfill_loop(interval: float = MESSAGE_STATE_BACKFILL_INTERVAL, batch: int = MESSAGE_STATE_BACKFILL_BATCH,
+                        pause: float = MESSAGE_STATE_BACKFILL_PAUSE) -> None:
+    """Фоновый проход в коллекторе; заканчивается вместе с переносом."""
+    while True:
+        try:
+            if await asyncio.to_thread(catch_up, batch, pause):
+                print("[message_state] перенос старых колонок закончен")
+                return
+        except Exception as e:
+            print(f"[message_state] ошибка прохода: {e}")
+        await asyncio.sleep(interval)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Move legacy state columns of otc.messages_archive to otc.message_state")
+    ap.add_argument("command", nargs="?", default="run", choices=("run", "status"))
+    ap.add_argument("--batch", type=int, default=MESSAGE_STATE_BACKFILL_BATCH)
+    ap.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = ap.parse_args()
+
+    if args.command == "status":
+        st = get_message_state_backfill_status()
+        if st is None:
+            print("legacy columns are gone (migration 14 applied)")
+            return
+        left = max(st["target_id"] - st["last_id"], 0)
+        state = "done, apply: python update/migrations.py migrate --contract" if not left else f"{left:,} ids left"
+        print(f"watermark id={st['last_id']:,} of {st['target_id']:,} ({state})")
+        return
+
+    t0 = time.perf_counter()
+    done = catch_up(args.batch, args.pause,
+                    progress=lambda r: print(f"  id<={r['last_id']}: {r['folded']:,} of {r['rows']:,} rows folded"))
+    verdict = "done" if done else "busy: another process holds the backfill lock"
+    print(f"{verdict} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# metrics.py
+"""
+Минимальные метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Counter / Gauge / Histogram с метками, дочерние серии кешируются в dict,
+observe() — это bisect по границам бакетов и пара сложений под замком, так что
+инструментирование можно держать включённым в проде.
+
+Эндпоинт /metrics поднимается на aiohttp внутри того же event loop:
+    await start_metrics_server(port)
+"""
+import os
+import time
+import asyncio
+import functools
+import threading
+from bisect import bisect_left
+from typing import Iterable
+
+# секунды: от 1 мс до 1 мин — покрывает и SQL, и отправки в Telegram
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# лаг инжеста: от секунды до часа
+LAG_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0, 3600.0)
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values, **kw):
+        if kw:
+            values = tuple(str(kw[n]) for n in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+# значения меняются и из потоков (DB-вызовы под asyncio.to_thread), а += не атомарен
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_num(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, v: float) -> None:
+        self._default().set(v)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_num(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float) -> None:
+        i = bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    """Контекстный менеджер: with hist.labels("x").time(): ... — работает и внутри async def."""
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.t0)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self._default().observe(v)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def _render_child(self, values, child):
+        with child._lock:  # бакеты, sum и count — из одного снимка
+            counts, total, count = list(child.counts), child.sum, child.count
+        out = []
+        acc = 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            acc += c
+            le = f'le="{_fmt_num(bound)}"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {acc}")
+        lbl = _fmt_labels(self.labelnames, values)
+        out.append(f"{self.name}_sum{lbl} {_fmt_num(total)}")
+        out.append(f"{self.name}_count{lbl} {count}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, m: _Metric) -> None:
+        self._metrics.append(m)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in self._metrics:
+            lines.extend(m.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ------------------------ ОБЩИЕ МЕТРИКИ ------------------------
+
+STAGE_SECONDS = Histogram(
+    "otc_stage_seconds", "Latency of handler stages", ("handler", "stage"),
+)
+DB_QUERY_SECONDS = Histogram(
+    "otc_db_query_seconds", "Latency of db.py calls", ("query",),
+)
+TG_CALL_SECONDS = Histogram(
+    "otc_telegram_call_seconds", "Latency of Telegram API calls", ("method",),
+)
+FLOODWAIT_TOTAL = Counter(
+    "otc_floodwait_total", "FloodWait errors received", ("where",),
+)
+FLOODWAIT_SECONDS = Counter(
+    # сколько Telegram просил подождать; бот при этом не спит, а переносит правку
+    "otc_floodwait_requested_seconds_total", "Retry-after seconds requested by FloodWait errors", ("where",),
+)
+DUPLICATES_TOTAL = Counter(
+    "otc_duplicates_total", "Messages whose text was already archived for the sender",
+)
+SKIPPED_POSTS_TOTAL = Counter(
+    "otc_skipped_posts_total", "WTB messages not published", ("reason",),
+)
+INGEST_LAG_SECONDS = Histogram(
+    "otc_ingest_lag_seconds", "Processing time minus Telegram message date", buckets=LAG_BUCKETS,
+)
+INGEST_LAG_LAST = Gauge(
+    "otc_ingest_lag_last_seconds", "Ingest lag of the most recent message",
+)
+
+
+def stage(handler: str, name: str) -> _Timer:
+    """with stage("on_new", "save_message"): ..."""
+    return STAGE_SECONDS.labels(handler, name).time()
+
+
+def tg_call(method: str) -> _Timer:
+    return TG_CALL_SECONDS.labels(method).time()
+
+
+def observe_lag(msg_date) -> None:
+    """msg_date — aware datetime из Telegram (UTC)."""
+    if msg_date is None:
+        return
+    lag = max(0.0, time.time() - msg_date.timestamp())
+    INGEST_LAG_SECONDS.observe(lag)
+    INGEST_LAG_LAST.set(lag)
+
+
+def timed_query(fn):
+    """Декоратор для функций db.py: пишет время вызова в otc_db_query_seconds{query=<имя>}."""
+    child = DB_QUERY_SECONDS.labels(fn.__name__)
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def _async(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - t0)
+        return _async
+
+    @functools.wraps(fn)
+    def _sync(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - t0)
+    return _sync
+
+
+# ------------------------ HTTP ------------------------
+
+async def start_metrics_server(port: int | None = None, host: str | None = None):
+    """
+    Поднимает /metrics в текущем event loop. port=0 — выключено.
+    Возвращает aiohttp AppRunner (или None).
+    """
+    from aiohttp import web
+
+    if port is None:
+        port = int(os.getenv("METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+
+    async def _handle(request):
+        return web.Response(
+            text=REGISTRY.render(),
+            content_type="text/plain",
+            charset="utf-8",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"[metrics] http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,521 @@
+# migrations.py
+"""
+Версионные миграции схемы otc.
+
+Каждая миграция — пронумерованный набор идемпотентных SQL-шагов.
+Применённые версии пишутся в otc.schema_version, так что на старте
+сервисов достаточно одного дешёвого SELECT max(version).
+
+Индексы на живых таблицах строим CONCURRENTLY: такие шаги идут вне
+транзакции, а недостроенный (INVALID) индекс от упавшей попытки
+удаляется и строится заново.
+
+Миграции применяются, пока работают сервисы прошлой версии, поэтому
+убирать колонки и таблицы, которые те читают, можно только отдельной
+сжимающей (contract) миграцией: migrate пропускает её, пока не передан
+--contract, а сервисам для старта она не нужна (REQUIRED_VERSION). Поэтому
+обычные миграции не должны зависеть от сжимающих.
+
+CLI:
+    python update/migrations.py status
+    python update/migrations.py migrate [--to N] [--contract]
+"""
+import os
+import re
+import argparse
+from typing import NamedTuple
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db import PG_DSN, CREATE_SQL, MIGRATE_SQL
+
+# ключ pg_advisory_lock, чтобы коллектор и бот не мигрировали одновременно
+MIGRATION_LOCK_KEY = 0x07C_5C4E
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: list[str]
+    concurrent: bool = False  # True — шаги выполняются вне транзакции (CREATE INDEX CONCURRENTLY)
+    contract: bool = False    # True — убирает то, что читают процессы прошлой версии: только migrate --contract
+
+
+SCHEMA_VERSION_SQL = """
+CREATE SCHEMA IF NOT EXISTS otc;
+CREATE TABLE IF NOT EXISTS otc.schema_version (
+    version    INT         PRIMARY KEY,
+    name       TEXT        NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Порядок важен: новые миграции только дописываются в конец.
+MIGRATIONS: list[Migration] = [
+    # исходная схема + переход со старых версий (то, что раньше init_db гонял на каждом старте)
+    Migration(1, "baseline", [CREATE_SQL, MIGRATE_SQL]),
+    Migration(2, "archive_chat_msg_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_archive_chat_msg "
+        "ON otc.messages_archive (chat_id, message_id)",
+    ], concurrent=True),
+    # очередь публикаций: ингест только кладёт задания, паблишеры забирают их через SKIP LOCKED
+    Migration(3, "publish_outbox", ["""
+        CREATE TABLE IF NOT EXISTS otc.publish_outbox (
+            id                BIGSERIAL   PRIMARY KEY,
+            row_id            BIGINT      NOT NULL,
+            topic_id          BIGINT      NOT NULL,
+            status            TEXT        NOT NULL DEFAULT 'pending',  -- pending | sending | done | failed
+            attempts          INT         NOT NULL DEFAULT 0,
+            available_at      TIMESTAMPTZ NOT NULL DEFAULT now(),      -- для sending — конец аренды
+            locked_by         TEXT        NULL,
+            posted_chat_id    BIGINT      NULL,
+            posted_message_id BIGINT      NULL,
+            last_error        TEXT        NULL,
+            created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+            CONSTRAINT uniq_outbox_row_topic UNIQUE (row_id, topic_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_publish_outbox_ready
+            ON otc.publish_outbox (available_at) WHERE status IN ('pending', 'sending');
+    """]),
+    # общее состояние бота: несколько воркеров + переживает рестарт
+    Migration(4, "bot_shared_state", ["""
+        CREATE TABLE IF NOT EXISTS otc.bot_last_reply (
+            chat_id    BIGINT      PRIMARY KEY,
+            message_id BIGINT      NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS otc.bot_pending_edits (
+            chat_id       BIGINT      NOT NULL,
+            message_id    BIGINT      NOT NULL,
+            row_id        BIGINT      NOT NULL,
+            likes         INT         NOT NULL,
+            dislikes      INT         NOT NULL,
+            start_payload TEXT        NOT NULL,
+            due_at        TIMESTAMPTZ NOT NULL,
+            version       INT         NOT NULL DEFAULT 1,
+            owner         TEXT        NULL,
+            lease_until   TIMESTAMPTZ NULL,
+            PRIMARY KEY (chat_id, message_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_bot_pending_edits_due ON otc.bot_pending_edits (due_at);
+    """]),
+    # производные поля (tagging.py): nullable-колонки без DEFAULT добавляются мгновенно,
+    # старые строки заполняет retag.py
+    Migration(5, "archive_derived_fields", ["""
+        ALTER TABLE otc.messages_archive
+            ADD COLUMN IF NOT EXISTS is_wtb    BOOLEAN  NULL,
+            ADD COLUMN IF NOT EXISTS topic_ids BIGINT[] NULL,
+            ADD COLUMN IF NOT EXISTS tags      TEXT[]   NULL,
+            ADD COLUMN IF NOT EXISTS tags_rev  TEXT     NULL;
+    """]),
+    # текст без контактов (scrubber.py), считается при вставке вместе с тегами
+    Migration(6, "archive_text_clean", ["""
+        ALTER TABLE otc.messages_archive ADD COLUMN IF NOT EXISTS text_clean TEXT NULL;
+    """]),
+    # справочник чатов (chats.py): коллектор пишет из сущностей Telethon, бот читает в кэш
+    Migration(7, "chats_registry", ["""
+        CREATE TABLE IF NOT EXISTS otc.chats (
+            chat_id    BIGINT      PRIMARY KEY,
+            username   TEXT        NULL,
+            title      TEXT        NULL,
+            is_forum   BOOLEAN     NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON otc.chats (updated_at);
+    """]),
+    # журнал реакций (reactions.py): клики только дописываются, компактор сворачивает
+    # их в listing_reaction/user_reputation; свёрнутые остаются как история
+    Migration(8, "reaction_events", ["""
+        CREATE TABLE IF NOT EXISTS otc.reaction_events (
+            id           BIGSERIAL   PRIMARY KEY,
+            row_id       BIGINT      NOT NULL,
+            user_id      BIGINT      NOT NULL,
+            action       SMALLINT    NOT NULL CHECK (action IN (-1, 0, 1)),  -- реакция после клика, 0 — снята
+            ts           TIMESTAMPTZ NOT NULL DEFAULT now(),
+            compacted_at TIMESTAMPTZ NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_reaction_events_pending
+            ON otc.reaction_events (id) WHERE compacted_at IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_reaction_events_pending_pair
+            ON otc.reaction_events (row_id, user_id, id) WHERE compacted_at IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_reaction_events_row ON otc.reaction_events (row_id);
+    """]),
+    # холодный ярус архива (cold_archive.py): каталог parquet-сегментов со строками,
+    # вынесенными из messages_archive
+    Migration(9, "archive_cold_segments", ["""
+        CREATE TABLE IF NOT EXISTS otc.archive_segments (
+            id         SERIAL      PRIMARY KEY,
+            path       TEXT        NOT NULL UNIQUE,
+            min_id     BIGINT      NOT NULL,
+            max_id     BIGINT      NOT NULL,
+            min_ts     TIMESTAMPTZ NOT NULL,
+            max_ts     TIMESTAMPTZ NOT NULL,
+            rows       INT         NOT NULL,
+            bytes      BIGINT      NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_archive_segments_ids ON otc.archive_segments (min_id, max_id);
+    """]),
+    # повторяющиеся тела сообщений — один раз в otc.texts под 8-байтным ключом
+    # (первые 8 байт sha256 = text_hash); в архиве у такой строки text = NULL.
+    # Только DDL: снятие NOT NULL не переписывает таблицу, а тела переносит
+    # фоновый проход по id (texts.py, водяной знак в otc.texts_state)
+    Migration(10, "archive_texts", ["""
+        CREATE TABLE IF NOT EXISTS otc.texts (
+            key  BIGINT PRIMARY KEY,
+            text TEXT   NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS otc.texts_state (
+            id         BOOLEAN     PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_id    BIGINT      NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        INSERT INTO otc.texts_state DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION otc.text_key(h TEXT) RETURNS BIGINT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT ('x' || left(h, 16))::bit(64)::bigint
+        $$;
+
+        ALTER TABLE otc.messages_archive ALTER COLUMN text DROP NOT NULL;
+
+        -- архив с текстом, как раньше: те же колонки в том же порядке
+        CREATE OR REPLACE VIEW otc.messages_archive_v AS
+        SELECT ma.id, ma.message_id, ma.chat_id, ma.sender_id, ma.sender_username, ma.ts_utc,
+               COALESCE(ma.text, t.text) AS text,
+               ma.processed, ma.text_hash, ma.duplicates_count, ma.deleted, ma.deleted_at,
+               ma.reply_to_msg_id, ma.is_wtb, ma.topic_ids, ma.tags, ma.tags_rev, ma.text_clean
+        FROM otc.messages_archive ma
+        LEFT JOIN otc.texts t ON t.key = otc.text_key(ma.text_hash) AND ma.text IS NULL;
+    """]),
+    # изменяемое состояние строки — в узкой таблице: повтор поста обновляет
+    # маленький кортеж (без индексов, кроме PK, и с запасом места на странице —
+    # обновления HOT), а не широкую строку архива с её индексами. Строки нет —
+    # значения по умолчанию (0 повторов, не удалена).
+    # Только DDL, процессы прошлой версии продолжают работать: старые колонки
+    # архива остаются, а их правки триггер переносит приращениями в
+    # otc.message_state (сами колонки больше не меняются). Значения, накопленные
+    # до миграции, переносит фоновый проход по id (message_state.py, водяной
+    # знак в otc.message_state_backfill); view складывает их со
+    # otc.message_state для строк выше водяного знака. Колонки убирает
+    # миграция 14
+    Migration(11, "archive_message_state", ["""
+        CREATE TABLE IF NOT EXISTS otc.message_state (
+            row_id           BIGINT      PRIMARY KEY,
+            duplicates_count INTEGER     NOT NULL DEFAULT 0,
+            last_seen_at     TIMESTAMPTZ NULL,
+            processed        BOOLEAN     NOT NULL DEFAULT FALSE,
+            deleted          BOOLEAN     NOT NULL DEFAULT FALSE,
+            deleted_at       TIMESTAMPTZ NULL
+        ) WITH (fillfactor = 70);
+
+        CREATE OR REPLACE FUNCTION otc.message_state_divert() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.duplicates_count > OLD.duplicates_count
+               OR (NEW.processed AND NOT OLD.processed)
+               OR (NEW.deleted AND NOT OLD.deleted) THEN
+                INSERT INTO otc.message_state AS s (row_id, duplicates_count, last_seen_at, processed, deleted, deleted_at)
+                VALUES (NEW.id,
+                        GREATEST(NEW.duplicates_count - OLD.duplicates_count, 0),
+                        CASE WHEN NEW.duplicates_count > OLD.duplicates_count THEN now() END,
+                        NEW.processed AND NOT OLD.processed,
+                        NEW.deleted AND NOT OLD.deleted,
+                        CASE WHEN NEW.deleted AND NOT OLD.deleted THEN COALESCE(NEW.deleted_at, now()) END)
+                ON CONFLICT (row_id) DO UPDATE
+                SET duplicates_count = s.duplicates_count + EXCLUDED.duplicates_count,
+                    last_seen_at = GREATEST(s.last_seen_at, EXCLUDED.last_seen_at),
+                    processed = s.processed OR EXCLUDED.processed,
+                    deleted = s.deleted OR EXCLUDED.deleted,
+                    deleted_at = COALESCE(s.deleted_at, EXCLUDED.deleted_at);
+            END IF;
+            NEW.duplicates_count := OLD.duplicates_count;
+            NEW.processed := OLD.processed;
+            NEW.deleted := OLD.deleted;
+            NEW.deleted_at := OLD.deleted_at;
+            RETURN NEW;
+        END $$;
+        DROP TRIGGER IF EXISTS message_state_divert ON otc.messages_archive;
+        CREATE TRIGGER message_state_divert
+            BEFORE UPDATE OF duplicates_count, processed, deleted, deleted_at ON otc.messages_archive
+            FOR EACH ROW EXECUTE FUNCTION otc.message_state_divert();
+
+        -- после триггера (он ждёт пишущие транзакции): строки выше target_id
+        -- вставлены уже при триггере, их старые колонки — по умолчанию
+        CREATE TABLE IF NOT EXISTS otc.message_state_backfill (
+            id         BOOLEAN     PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_id    BIGINT      NOT NULL DEFAULT 0,
+            target_id  BIGINT      NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        INSERT INTO otc.message_state_backfill (target_id)
+        SELECT COALESCE(max(id), 0) FROM otc.messages_archive
+        ON CONFLICT DO NOTHING;
+
+        CREATE OR REPLACE VIEW otc.messages_archive_v AS
+        SELECT ma.id, ma.message_id, ma.chat_id, ma.sender_id, ma.sender_username, ma.ts_utc,
+               COALESCE(ma.text, t.text) AS text,
+               COALESCE(s.processed, FALSE) OR (ma.id > b.last_id AND ma.processed) AS processed,
+               ma.text_hash,
+               COALESCE(s.duplicates_count, 0)
+                   + CASE WHEN ma.id > b.last_id THEN ma.duplicates_count ELSE 0 END AS duplicates_count,
+               COALESCE(s.deleted, FALSE) OR (ma.id > b.last_id AND ma.deleted) AS deleted,
+               COALESCE(s.deleted_at, CASE WHEN ma.id > b.last_id THEN ma.deleted_at END) AS deleted_at,
+               ma.reply_to_msg_id, ma.is_wtb, ma.topic_ids, ma.tags, ma.tags_rev, ma.text_clean,
+               COALESCE(s.last_seen_at, ma.ts_utc) AS last_seen_at
+        FROM otc.messages_archive ma
+        CROSS JOIN otc.message_state_backfill b
+        LEFT JOIN otc.texts t ON t.key = otc.text_key(ma.text_hash) AND ma.text IS NULL
+        LEFT JOIN otc.message_state s ON s.row_id = ma.id;
+    """]),
+    # почасовой спрос (demand.py): WTB и скетч отправителей на (час, чат, категория, тег);
+    # category = tag = '' — все WTB часа в чате. Скетч — KMV: 256 наименьших
+    # хэшей sender_id, объединение — 256 наименьших из объединения, поэтому складывается
+    # по часам и чатам. Заполняет фоновый проход по архиву от водяного знака
+    Migration(12, "demand_rollup", ["""
+        CREATE TABLE IF NOT EXISTS otc.demand_rollup (
+            hour     TIMESTAMPTZ NOT NULL,
+            chat_id  BIGINT      NOT NULL,
+            category TEXT        NOT NULL,
+            tag      TEXT        NOT NULL,
+            wtb      INTEGER     NOT NULL,
+            senders  BIGINT[]    NOT NULL,
+            PRIMARY KEY (hour, chat_id, category, tag)
+        );
+        CREATE TABLE IF NOT EXISTS otc.demand_rollup_state (
+            id         BOOLEAN     PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_id    BIGINT      NOT NULL DEFAULT 0,
+            tags_rev   TEXT        NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        INSERT INTO otc.demand_rollup_state DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION otc.sketch_merge(a BIGINT[], b BIGINT[]) RETURNS BIGINT[]
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT COALESCE(array_agg(h ORDER BY h), '{}')
+            FROM (SELECT DISTINCT h FROM unnest(a || b) h ORDER BY h LIMIT 256) s
+        $$;
+        -- шаг агрегата копит хэши как есть и обрезает до 256 только при переполнении
+        -- буфера: сортировка на каждую строку стоила бы в разы дороже
+        CREATE OR REPLACE FUNCTION otc.sketch_add(a BIGINT[], b BIGINT[]) RETURNS BIGINT[]
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE WHEN cardinality(a) + cardinality(b) <= 2048 THEN a || b
+                        ELSE otc.sketch_merge(a, b) END
+        $$;
+        CREATE OR REPLACE FUNCTION otc.sketch_trim(a BIGINT[]) RETURNS BIGINT[]
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT otc.sketch_merge(a, '{}')
+        $$;
+        CREATE OR REPLACE AGGREGATE otc.sketch_union(BIGINT[]) (
+            SFUNC = otc.sketch_add, STYPE = BIGINT[], INITCOND = '{}',
+            FINALFUNC = otc.sketch_trim, COMBINEFUNC = otc.sketch_add, PARALLEL = SAFE
+        );
+        -- меньше 256 хэшей — точное число, иначе (k - 1) / доля диапазона под k-м хэшем
+        CREATE OR REPLACE FUNCTION otc.sketch_estimate(s BIGINT[]) RETURNS BIGINT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE WHEN cardinality(s) < 256 THEN cardinality(s)
+                        ELSE round(255 / ((s[256]::numeric + 9223372036854775808) / 18446744073709551616))::bigint
+                   END
+        $$;
+    """]),
+    # сколько неудалённых сообщений отправителя лежит в холодном ярусе: «Total messages»
+    # на карточках = горячие строки + это число. Сегменты, вынесенные до миграции,
+    # досчитывает python update/cold_archive.py recount
+    Migration(13, "sender_cold_counts", ["""
+        CREATE TABLE IF NOT EXISTS otc.sender_cold_counts (
+            sender_id BIGINT  PRIMARY KEY,
+            messages  INTEGER NOT NULL
+        );
+    """]),
+    # старые колонки состояния в архиве больше не нужны: их значения перенёс
+    # message_state.py, а процессов, читающих их, не осталось. Сжимающая —
+    # только migrate --contract; если перенос не закончен, миграция падает
+    Migration(14, "archive_drop_state_columns", ["""
+        DO $$
+        BEGIN
+            IF to_regclass('otc.message_state_backfill') IS NOT NULL THEN
+                IF EXISTS (SELECT 1 FROM otc.message_state_backfill WHERE last_id < target_id) THEN
+                    RAISE EXCEPTION 'otc.message_state backfill is not finished: run python update/message_state.py run';
+                END IF;
+            END IF;
+        END $$;
+
+        DROP VIEW IF EXISTS otc.messages_archive_v;
+        DROP TRIGGER IF EXISTS message_state_divert ON otc.messages_archive;
+        DROP FUNCTION IF EXISTS otc.message_state_divert();
+        ALTER TABLE otc.messages_archive
+            DROP COLUMN IF EXISTS duplicates_count,
+            DROP COLUMN IF EXISTS processed,
+            DROP COLUMN IF EXISTS deleted,
+            DROP COLUMN IF EXISTS deleted_at;
+        DROP TABLE IF EXISTS otc.message_state_backfill;
+
+        CREATE VIEW otc.messages_archive_v AS
+        SELECT ma.id, ma.message_id, ma.chat_id, ma.sender_id, ma.sender_username, ma.ts_utc,
+               COALESCE(ma.text, t.text) AS text,
+               COALESCE(s.processed, FALSE) AS processed, ma.text_hash,
+               COALESCE(s.duplicates_count, 0) AS duplicates_count,
+               COALESCE(s.deleted, FALSE) AS deleted, s.deleted_at,
+               ma.reply_to_msg_id, ma.is_wtb, ma.topic_ids, ma.tags, ma.tags_rev, ma.text_clean,
+               COALESCE(s.last_seen_at, ma.ts_utc) AS last_seen_at
+        FROM otc.messages_archive ma
+        LEFT JOIN otc.texts t ON t.key = otc.text_key(ma.text_hash) AND ma.text IS NULL
+        LEFT JOIN otc.message_state s ON s.row_id = ma.id;
+    """], contract=True),
+    # все копии одного тела по 8-байтному ключу: проход texts.py находит повтор
+    # тела из любой части архива, а не только из своей пачки; проверка дубля
+    # отправителя — одним поиском вместо поиска в каждом чате
+    Migration(15, "archive_text_key_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_archive_text_key "
+        "ON otc.messages_archive (otc.text_key(text_hash))",
+    ], concurrent=True),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+# с какой версии схемы стартуют сервисы: сжимающие миграции им не нужны
+REQUIRED_VERSION = max(m.version for m in MIGRATIONS if not m.contract)
+
+_INDEX_NAME_RE = re.compile(r"INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+def current_version(conn) -> int:
+    """Текущая версия схемы (0 — схема ещё не версионирована)."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(max(version), 0) AS v FROM otc.schema_version")
+            return int(cur.fetchone()["v"])
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return 0
+
+
+def applied_versions(conn) -> dict[int, dict]:
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, name, applied_at FROM otc.schema_version ORDER BY version")
+            return {r["version"]: r for r in cur.fetchall()}
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return {}
+
+
+def _drop_invalid_index(cur, stmt: str) -> None:
+    """Если прошлый CREATE INDEX CONCURRENTLY упал, индекс остаётся INVALID — сносим его."""
+    m = _INDEX_NAME_RE.search(stmt)
+    if not m:
+        return
+    name = m.group(1)
+    cur.execute(
+        """
+        SELECT i.indisvalid
+        FROM pg_index i
+        WHERE i.indexrelid = to_regclass(%s)
+        """,
+        (f"otc.{name}",),
+    )
+    row = cur.fetchone()
+    if row and not row["indisvalid"]:
+        print(f"[migrate] drop invalid index otc.{name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS otc.{name}")
+
+
+def _apply(conn, m: Migration) -> None:
+    print(f"[migrate] → {m.version:04d} {m.name}")
+    if m.concurrent:
+        # autocommit: CONCURRENTLY нельзя внутри транзакции
+        with conn.cursor() as cur:
+            for stmt in m.statements:
+                _drop_invalid_index(cur, stmt)
+                cur.execute(stmt)
+            cur.execute(
+                "INSERT INTO otc.schema_version (version, name) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (m.version, m.name),
+            )
+    else:
+        with conn.transaction(), conn.cursor() as cur:
+            for stmt in m.statements:
+                cur.execute(stmt)
+            cur.execute(
+                "INSERT INTO otc.schema_version (version, name) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (m.version, m.name),
+            )
+
+
+def migrate(dsn: str = PG_DSN, target: int | None = None, contract: bool = False) -> int:
+    """
+    Применяет все недостающие миграции до target (по умолчанию — до последней).
+    Без contract сжимающие миграции пропускаются (остаются неприменёнными).
+    """
+    target = LATEST_VERSION if target is None else target
+    with psycopg.connect(dsn, row_factory=dict_row, autocommit=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            with conn.cursor() as cur:
+                cur.execute(SCHEMA_VERSION_SQL)
+            done = applied_versions(conn)
+            for m in MIGRATIONS:
+                if m.version > target or m.version in done:
+                    continue
+                if m.contract and not contract:
+                    print(f"[migrate] skip {m.version:04d} {m.name}: contract migration, "
+                          f"apply with --contract once no old processes run")
+                    continue
+                _apply(conn, m)
+            return current_version(conn)
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+
+
+def ensure_schema(dsn: str = PG_DSN) -> int:
+    """
+    Быстрый путь для старта сервисов: одна проверка версии.
+    Если схема отстаёт — падаем с подсказкой запустить CLI (по умолчанию):
+    рестарт сервиса не должен гонять DDL и бэкфиллы на живых таблицах.
+    AUTO_MIGRATE=1 — мигрировать прямо на старте (локальная разработка, replay).
+    """
+    with psycopg.connect(dsn, row_factory=dict_row) as conn:
+        version = current_version(conn)
+    if version >= REQUIRED_VERSION:
+        return version
+
+    if os.getenv("AUTO_MIGRATE", "0") != "1":
+        raise RuntimeError(
+            f"schema version {version} < {REQUIRED_VERSION}; run: python update/migrations.py migrate"
+        )
+    return migrate(dsn, REQUIRED_VERSION)
+
+
+def print_status(dsn: str = PG_DSN) -> None:
+    with psycopg.connect(dsn, row_factory=dict_row) as conn:
+        done = applied_versions(conn)
+    for m in MIGRATIONS:
+        row = done.get(m.version)
+        mark = f"applied {row['applied_at']:%Y-%m-%d %H:%M}" if row else "pending"
+        kind = " (concurrent)" if m.concurrent else " (contract)" if m.contract else ""
+        print(f"{m.version:04d}  {m.name:<32} {mark}{kind}")
+    current = max(done) if done else 0
+    print(f"\ncurrent={current} required={REQUIRED_VERSION} latest={LATEST_VERSION}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Apply or inspect otc schema migrations")
+    ap.add_argument("command", choices=["status", "migrate"])
+    ap.add_argument("--to", type=int, default=None, help="Migrate up to this version (default: latest)")
+    ap.add_argument("--contract", action="store_true",
+                    help="Also apply contract migrations (drop what old processes still read)")
+    ap.add_argument("--dsn", type=str, default=PG_DSN)
+    args = ap.parse_args()
+
+    if args.command == "status":
+        print_status(args.dsn)
+    else:
+        v = migrate(args.dsn, args.to, args.contract)
+        print(f"[migrate] schema version: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# publisher.py
+"""
+Паблишер карточек из очереди otc.publish_outbox.
+
+Ингест (t_collector.handle_new_message) только кладёт задания (row_id, topic_id).
+Воркеры забирают их пачками через FOR UPDATE SKIP LOCKED с арендой, рендерят
+карточку на свежей статистике и публикуют ботом.
+
+Гарантии:
+  - постановка идемпотентна: UNIQUE (row_id, topic_id);
+  - id отправленного сообщения пишется сразу после send, поэтому при повторной
+    доставке (воркер упал, аренда истекла) карточка не дублируется — только edit;
+  - ошибки — экспоненциальный backoff, после max_attempts — failed;
+    FloodWait попыткой не считается: вся необработанная часть пачки
+    возвращается в очередь до сна, чтобы аренда не истекла у спящего воркера;
+  - MessageNotModified на edit — карточка уже отредактирована прошлой доставкой.
+
+Запуск отдельным процессом (можно несколько — горизонтально):
+    python update/publisher.py --workers 2
+"""
+import os
+import asyncio
+import socket
+import argparse
+from html import escape
+from typing import Optional
+
+from telethon import Button
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+from db import (
+    get_message_by_id,
+    save_published_post,
+    claim_publish_jobs,
+    mark_publish_posted,
+    complete_publish_job,
+    retry_publish_job,
+    outbox_depth,
+)
+from sender_cache import SENDERS
+from tools.t import compute_rating_percent, stars_from_percent
+from tagging import row_clean_text
+from metrics import (stage, tg_call, Counter, Gauge,
+                     FLOODWAIT_TOTAL, FLOODWAIT_SECONDS, start_metrics_server)
+
+OUTBOX_JOBS_TOTAL = Counter("otc_outbox_jobs_total", "Outbox jobs processed", ("result",))
+OUTBOX_DEPTH = Gauge("otc_outbox_depth", "Outbox jobs waiting", ("status",))
+
+CONTACT_BOT_URL = "https://t.me/otc_darwin_bot?start="
+
+
+def build_card_body(cleaned: str, *, likes: int, dislikes: int, total_messages: int, reviews: int) -> str:
+    """cleaned — текст уже без контактов (text_clean строки архива)."""
+    rating_pct = compute_rating_percent(likes, dislikes)
+    stars_str = stars_from_percent(rating_pct)
+    cleaned_safe = escape(cleaned)
+
+    # формируем красивый пост
+    parts = []
+    parts.append("<b>💸 New WTB message</b>\n")
+    parts.append(f"<b>About user ({stars_str}):</b>")
+    parts.append(
+        "<blockquote>"
+        f"~ <i>User rating:</i> {rating_pct}%\n"
+        f"~ <i>Total messages:</i> {total_messages}\n"
+        f"~ <i>Number of reviews:</i> {reviews}"
+        "</blockquote>"
+    )
+    parts.append("<b>Text:</b>")
+    parts.append(f"<blockquote>{cleaned_safe}</blockquote>")
+    return "\n".join(parts)
+
+
+def build_card_buttons(row_id: int, otc_msg_id: int, likes: int, dislikes: int):
+    start_payload = f"{row_id}_{otc_msg_id}"
+    return [
+        [
+            Button.inline(f"✅ {likes}", data=f"like_{row_id}"),
+            Button.inline(f"❌ {dislikes}", data=f"dislike_{row_id}"),
+        ],
+        [
+            Button.url("💬 Contact buyer", f"{CONTACT_BOT_URL}{start_payload}"),
+        ],
+    ]
+
+
+def backoff_delay(attempts: int, base: float = 5.0, cap: float = 900.0) -> float:
+    return min(cap, base * (2 ** max(0, attempts - 1)))
+
+
+class Publisher:
+    def __init__(
+        self,
+        bot_client,
+        target_group,
+        *,
+        worker_id: Optional[str] = None,
+        batch: int = 5,
+        lease_s: float = 60.0,
+        send_delay: float = 0.3,
+        poll_interval: float = 1.0,
+        max_attempts: int = 8,
+    ):
+        self.bot_client = bot_client
+        self.target_group = target_group
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.batch = batch
+        self.lease_s = lease_s
+        self.send_delay = send_delay
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def notify(self) -> None:
+        """Разбудить воркер сразу после постановки задания (тот же процесс)."""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    async def _render(self, row_id: int) -> Optional[dict]:
+        row = await asyncio.to_thread(get_message_by_id, row_id)
+        if not row or row.get("deleted"):
+            return None
+        sender_id = row["sender_id"]
+        with stage("publisher", "user_stats"):
+            total_messages, reviews = await asyncio.to_thread(SENDERS.stats, sender_id)
+        with stage("publisher", "reputation"):
+            likes, dislikes = await asyncio.to_thread(SENDERS.reputation, sender_id)
+        body = build_card_body(row_clean_text(row), likes=likes, dislikes=dislikes,
+                               total_messages=total_messages, reviews=reviews)
+        return {"body": body, "likes": likes, "dislikes": dislikes}
+
+    async def _publish(self, job: dict, cards: dict) -> None:
+        row_id, topic_id = job["row_id"], job["topic_id"]
+        if row_id not in cards:
+            cards[row_id] = await self._render(row_id)
+        card = cards[row_id]
+        if card is None:
+            # исходник удалён до публикации — публиковать нечего
+            await asyncio.to_thread(complete_publish_job, job["id"], self.worker_id)
+            OUTBOX_JOBS_TOTAL.labels("dropped").inc()
+            return
+
+        chat_id, msg_id = job.get("posted_chat_id"), job.get("posted_message_id")
+        if msg_id is None:
+            with stage("publisher", "send"), tg_call("bot.send_message"):
+                posted = await self.bot_client.send_message(
+                    entity=self.target_group,
+                    message=card["body"],
+                    link_preview=False,
+                    parse_mode="HTML",
+                    reply_to=topic_id,
+                )
+            chat_id, msg_id = posted.chat_id, posted.id
+            await asyncio.to_thread(mark_publish_posted, job["id"], self.worker_id,
+                                    chat_id=chat_id, message_id=msg_id)
+        else:
+            OUTBOX_JOBS_TOTAL.labels("redelivered").inc()
+
+        try:
+            await asyncio.to_thread(save_published_post, row_id=row_id, chat_id=chat_id, message_id=msg_id)
+        except Exception:
+            pass
+
+        try:
+            with stage("publisher", "edit"), tg_call("bot.edit_message"):
+                await self.bot_client.edit_message(
+                    chat_id, msg_id,
+                    text=card["body"],
+                    buttons=build_card_buttons(row_id, msg_id, card["likes"], card["dislikes"]),
+                    link_preview=False,
+                    parse_mode="HTML",
+                )
+        except MessageNotModifiedError:
+            pass  # повторная доставка после успешного edit
+        await asyncio.to_thread(complete_publish_job, job["id"], self.worker_id)
+        OUTBOX_JOBS_TOTAL.labels("done").inc()
+
+    async def run_once(self) -> int:
+        """Забрать и обработать одну пачку. Возвращает число заданий."""
+        jobs = await asyncio.to_thread(claim_publish_jobs, self.worker_id, self.batch, self.lease_s)
+        cards: dict = {}
+        for i, job in enumerate(jobs):
+            try:
+                await self._publish(job, cards)
+            except FloodWaitError as e:
+                FLOODWAIT_TOTAL.labels("publisher").inc()
+                FLOODWAIT_SECONDS.labels("publisher").inc(e.seconds)
+                # отпускаем и текущее, и ещё не тронутые задания: пока спим, аренда
+                # истечёт, и другой воркер отправил бы их параллельно с нами
+                for rest in jobs[i:]:
+                    OUTBOX_JOBS_TOTAL.labels("flood_wait").inc()
+                    await asyncio.to_thread(retry_publish_job, rest["id"], self.worker_id,
+                                            error=f"FloodWait {e.seconds}s", delay_s=e.seconds,
+                                            refund_attempt=True)
+                await asyncio.sleep(e.seconds)
+                break
+            except Exception as e:
+                final = job["attempts"] >= self.max_attempts
+                OUTBOX_JOBS_TOTAL.labels("failed" if final else "retry").inc()
+                print(f"[publisher] job={job['id']} row={job['row_id']} attempt={job['attempts']} error: {e}")
+                await asyncio.to_thread(retry_publish_job, job["id"], self.worker_id,
+                                        error=repr(e), delay_s=backoff_delay(job["attempts"]), final=final)
+            if self.send_delay:
+                await asyncio.sleep(self.send_delay)
+        return len(jobs)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            try:
+                n = await self.run_once()
+            except Exception as e:
+                print(f"[publisher ERROR] {e}")
+                n = 0
+            if n:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """Обработать всё, что уже лежит в очереди (для replay/тестов)."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while await self.run_once():
+            if deadline and loop.time() > deadline:
+                break
+
+
+async def report_depth(interval: float = 15.0) -> None:
+    while True:
+        try:
+            pending, sending = await asyncio.to_thread(outbox_depth)
+            OUTBOX_DEPTH.labels("pending").set(pending)
+            OUTBOX_DEPTH.labels("sending").set(sending)
+        except Exception as e:
+            print(f"[publisher] depth check failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _main(workers: int, session_path: str) -> None:
+    from telethon import TelegramClient
+    from dotenv import load_dotenv
+    from db import init_db
+    load_dotenv()
+
+    init_db()
+    await start_metrics_server(int(os.getenv("PUBLISHER_METRICS_PORT", "0") or 0))
+
+    bot_client = TelegramClient(session_path, int(os.getenv("API_ID")), os.getenv("API_HASH"))
+    await bot_client.start(bot_token=os.getenv("BOT_TOKEN"))
+    target = os.getenv("TARGET_GROUP")
+
+    pubs = [Publisher(bot_client, target) for _ in range(workers)]
+    asyncio.create_task(report_depth())
+    print(f"publisher running: {workers} worker(s)")
+    await asyncio.gather(*(p.run() for p in pubs))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Publish queued WTB cards from otc.publish_outbox")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--session", type=str, default="sessions/otc_publisher.session",
+                    help="Telethon bot session file; give each extra process its own")
+    args = ap.parse_args()
+    asyncio.run(_main(args.workers, args.session))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# reactions.py
+"""
+Компактор журнала реакций otc.reaction_events.
+
+Клик бота — одна вставка в журнал (db.toggle_reaction): без UPDATE
+горячих строк listing_reaction/user_reputation популярных продавцов.
+Компактор пачками сворачивает журнал: на пару (row_id, user_id) берётся
+последнее событие пачки, listing_reaction приводится к нему, а
+user_reputation получает приращения по отправителям. Чтения (get_reaction,
+count_reactions, get_user_reputation, get_user_stats) добавляют к
+свёрнутому ещё не свёрнутые события, так что результат точный в любой
+момент. Свёрнутые события остаются в журнале — это история кликов.
+
+Бот запускает compact_loop в фоне; несколько процессов не мешают друг
+другу (advisory-замок, лишние просто пропускают круг). Вручную:
+    python update/reactions.py compact
+    python update/reactions.py status
+    python update/reactions.py history <row_id>
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+
+from db import compact_reactions, pending_reaction_events, get_reaction_history
+from metrics import Counter, Gauge
+
+log = logging.getLogger("reactions")
+
+REACTIONS_COMPACTED_TOTAL = Counter("otc_reaction_events_compacted_total", "Reaction events folded into listing_reaction")
+REACTIONS_PENDING = Gauge("otc_reaction_events_pending", "Reaction events not yet compacted")
+
+REACTIONS_COMPACT_INTERVAL = float(os.getenv("REACTIONS_COMPACT_INTERVAL", "5"))
+REACTIONS_COMPACT_BATCH = int(os.getenv("REACTIONS_COMPACT_BATCH", "5000"))
+
+_ACTIONS = {1: "like", -1: "dislike", 0: "removed"}
+
+
+def compact_all(batch: int = REACTIONS_COMPACT_BATCH) -> int:
+    """Свернуть всё, что накопилось; возвращает число событий (0 — занято другим процессом)."""
+    total = 0
+    while True:
+        res = compact_reactions(batch)
+        if not res or not res["events"]:
+            break
+        total += res["events"]
+        REACTIONS_COMPACTED_TOTAL.inc(res["events"])
+        if res["events"] < batch:
+            break
+    return total
+
+
+async def compact_loop(interval: float = REACTIONS_COMPACT_INTERVAL, batch: int = REACTIONS_COMPACT_BATCH) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(compact_all, batch)
+            REACTIONS_PENDING.set((await asyncio.to_thread(pending_reaction_events))["n"])
+        except Exception as e:
+            log.warning("reaction compaction failed: %s", e)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compact otc.reaction_events into listing_reaction/user_reputation")
+    ap.add_argument("command", choices=("compact", "status", "history"))
+    ap.add_argument("row_id", nargs="?", type=int)
+    ap.add_argument("--batch", type=int, default=REACTIONS_COMPACT_BATCH)
+    args = ap.parse_args()
+
+    if args.command == "status":
+        p = pending_reaction_events()
+        print(f"pending events: {p['n']:,}" + (f" (oldest {p['oldest']:%Y-%m-%d %H:%M:%S})" if p["oldest"] else ""))
+        return
+    if args.command == "history":
+        if args.row_id is None:
+            ap.error("history needs row_id")
+        for e in get_reaction_history(args.row_id):
+            mark = " " if e["compacted_at"] else "*"
+            print(f"{mark} {e['ts']:%Y-%m-%d %H:%M:%S}  user {e['user_id']:>12}  {_ACTIONS[e['action']]}")
+        return
+
+    t0 = time.perf_counter()
+    n = compact_all(args.batch)
+    print(f"compacted {n:,} events in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
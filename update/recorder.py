@@ -0,0 +1,87 @@
+# recorder.py
+"""
+Запись входящих NewMessage в сжатый JSONL для офлайн-воспроизведения (bench/replay.py).
+
+Одна строка — одно событие:
+    {"chat_id", "sender_id", "sender_username", "message_id", "text",
+     "reply_to_msg_id", "reply_to_top_id", "date"}
+
+Username берём только из уже закешированного event.sender — запись
+не делает лишних запросов к Telegram.
+"""
+import gzip
+import json
+import time
+import logging
+from typing import Any, Dict, Iterator
+
+log = logging.getLogger("recorder")
+
+
+def event_to_record(event) -> Dict[str, Any]:
+    msg = event.message
+    rt = getattr(msg, "reply_to", None)
+    sender = getattr(event, "sender", None)
+    return {
+        "chat_id": event.chat_id,
+        "sender_id": event.sender_id,
+        "sender_username": getattr(sender, "username", None),
+        "message_id": msg.id,
+        "text": msg.message or "",
+        "reply_to_msg_id": getattr(rt, "reply_to_msg_id", None) if rt else None,
+        "reply_to_top_id": getattr(rt, "reply_to_top_id", None) if rt else None,
+        "date": msg.date.isoformat() if msg.date else None,
+    }
+
+
+class EventRecorder:
+    """Дописывает события в .jsonl.gz (gzip допускает дозапись новыми членами)."""
+
+    def __init__(self, path: str, flush_every: float = 5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self._f = gzip.open(path, "at", encoding="utf-8")
+        self._last_flush = time.monotonic()
+        self.count = 0
+        print(f"[record] пишу события в {path}")
+
+    def record(self, event) -> None:
+        try:
+            self._f.write(json.dumps(event_to_record(event), ensure_ascii=False) + "\n")
+            self.count += 1
+        except Exception:
+            log.exception("record failed")
+            return
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_every:
+            self._f.flush()
+            self._last_flush = now
+
+    def close(self) -> None:
+        try:
+            self._f.close()
+        except Exception:
+            pass
+
+
+def write_records(path: str, records) -> int:
+    opener = gzip.open if path.endswith(".gz") else open
+    n = 0
+    with opener(path, "wt", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            # коллектор упал посреди записи — хвост обрезан, берём что успели
+            log.warning("truncated recording: %s", path)
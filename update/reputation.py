@@ -0,0 +1,186 @@
+# reputation.py
+"""
+Полный пересчёт otc.user_reputation (свёрнутой части: события журнала
+reaction_events, которые компактор ещё не свернул, читатели добавляют сами).
+
+update_user_reputation(user_id) пересчитывает одного отправителя — годится
+для клика, но не для ремонта всей таблицы после дрейфа или смены правил
+реакций. Здесь всё считается набором:
+
+  1. otc.user_reputation_shadow заполняется одним INSERT ... SELECT ... GROUP BY
+     (или пачками по диапазонам sender_id, --chunk N отправителей в пачке);
+     живая таблица в это время читается и пишется как обычно;
+  2. без блокировок в тени пересчитываются отправители, которых успели
+     поменять реакции за время заполнения, и считается дрейф;
+  3. подмена — одна короткая транзакция под ACCESS EXCLUSIVE на живой
+     таблице: пересчёт отправителей, затронутых после шага 2 (обычно
+     единицы), и переименование тени на место живой таблицы.
+
+Шаг 3 блокирует и чтение, и запись user_reputation — это неизбежно для
+RENAME. Окно держится коротким: блокировка ждёт не дольше
+REPUTATION_SWAP_LOCK_TIMEOUT (иначе её очередь задержала бы всех читателей
+за долгим запросом), при неудаче — догоняющий пересчёт без блокировок и
+повтор, до REPUTATION_SWAP_RETRIES раз. Компактор журнала реакций на время
+подмены ждёт своей advisory-блокировки.
+
+Отправителям с дрейфом уходит событие "sender" (см. bus.py).
+
+    python update/reputation.py check              # посчитать дрейф, ничего не меняя
+    python update/reputation.py rebuild [--chunk 5000] [--pause 0.1]
+"""
+import os
+import time
+import argparse
+from datetime import timedelta
+from typing import Callable, NamedTuple, Optional
+
+import psycopg
+from psycopg import errors
+from psycopg.rows import dict_row
+
+from db import (
+    PG_DSN, _notify, REACTIONS_COMPACT_LOCK_KEY,
+    REPUTATION_SHADOW_CREATE_SQL, REPUTATION_SENDER_BOUNDS_SQL, REPUTATION_SHADOW_FILL_SQL,
+    REPUTATION_SHADOW_INDEX_SQL, REPUTATION_SHADOW_CATCHUP_SQL, REPUTATION_DRIFT_SQL,
+    REPUTATION_SWAP_SQL,
+)
+from metrics import Counter
+
+REPUTATION_DRIFT_TOTAL = Counter(
+    "otc_reputation_rebuild_drift_total", "Senders whose stored reputation differed from a full rebuild",
+)
+
+# ключ pg_advisory_lock: два пересчёта одновременно затёрли бы одну тень
+REBUILD_LOCK_KEY = 0x07C_4E9B
+# updated_at ставит now() транзакции — правка, начатая чуть раньше старта
+# пересчёта, может закоммититься уже после чтения своей пачки
+_CATCHUP_OVERLAP = timedelta(minutes=1)
+# сколько подмена готова ждать ACCESS EXCLUSIVE — столько же ждут читатели за ней
+SWAP_LOCK_TIMEOUT_MS = int(os.getenv("REPUTATION_SWAP_LOCK_TIMEOUT_MS", "500"))
+SWAP_RETRIES = int(os.getenv("REPUTATION_SWAP_RETRIES", "10"))
+SWAP_RETRY_PAUSE = 1.0
+
+
+class Drift(NamedTuple):
+    senders: int        # у скольких отправителей (likes, dislikes) разошлись
+    likes: int          # сумма |Δlikes|
+    dislikes: int       # сумма |Δdislikes|
+    sample: list[dict]  # крупнейшие расхождения
+
+
+def _drift(cur, sample: int) -> tuple[Drift, list[int]]:
+    cur.execute(REPUTATION_DRIFT_SQL)
+    rows = cur.fetchall()
+    rows.sort(key=lambda r: abs(r["likes"] - r["old_likes"]) + abs(r["dislikes"] - r["old_dislikes"]),
+              reverse=True)
+    drift = Drift(
+        senders=len(rows),
+        likes=sum(abs(r["likes"] - r["old_likes"]) for r in rows),
+        dislikes=sum(abs(r["dislikes"] - r["old_dislikes"]) for r in rows),
+        sample=rows[:sample],
+    )
+    return drift, [r["user_id"] for r in rows]
+
+
+def _catch_up(cur, since):
+    """Пересчитать в тени отправителей с правками после since; вернуть since для следующего прохода."""
+    cur.execute("SELECT now() AS started")
+    started = cur.fetchone()["started"]
+    cur.execute(REPUTATION_SHADOW_CATCHUP_SQL, {"since": since})
+    return started - _CATCHUP_OVERLAP
+
+
+def rebuild(
+    *,
+    chunk: int = 0,
+    pause: float = 0.0,
+    swap: bool = True,
+    sample: int = 10,
+    dsn: str = PG_DSN,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Drift:
+    """
+    chunk=0 — одним запросом. swap=False — только посчитать дрейф (тень удаляется).
+    progress(chunks_done, chunks_total) — после каждой пачки.
+    """
+    with psycopg.connect(dsn, row_factory=dict_row, autocommit=True) as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (REBUILD_LOCK_KEY,))
+        if not cur.fetchone()["ok"]:
+            raise RuntimeError("another reputation rebuild is running")
+        try:
+            cur.execute("SELECT now() AS started")
+            since = cur.fetchone()["started"] - _CATCHUP_OVERLAP
+            cur.execute(REPUTATION_SHADOW_CREATE_SQL)
+
+            bounds: list = [None]
+            if chunk > 0:
+                cur.execute(REPUTATION_SENDER_BOUNDS_SQL, {"chunk": chunk})
+                bounds = [r["sender_id"] for r in cur.fetchall()] + [None]
+            lo = None
+            for i, hi in enumerate(bounds, 1):
+                cur.execute(REPUTATION_SHADOW_FILL_SQL, {"lo": lo, "hi": hi})
+                lo = hi
+                if progress:
+                    progress(i, len(bounds))
+                if pause and hi is not None:
+                    time.sleep(pause)
+            cur.execute(REPUTATION_SHADOW_INDEX_SQL)
+
+            # основной догоняющий пересчёт и дрейф — без блокировок
+            since = _catch_up(cur, since)
+            drift, drifted = _drift(cur, sample)
+            if not swap:
+                return drift
+
+            for attempt in range(1, SWAP_RETRIES + 1):
+                try:
+                    with conn.transaction():
+                        cur.execute("SELECT set_config('lock_timeout', %s, true)", (f"{SWAP_LOCK_TIMEOUT_MS}ms",))
+                        # компактор журнала реакций пишет user_reputation приращениями — пусть подождёт
+                        cur.execute("SELECT pg_advisory_xact_lock(%s)", (REACTIONS_COMPACT_LOCK_KEY,))
+                        # RENAME всё равно возьмёт ACCESS EXCLUSIVE; берём сразу, без повышения
+                        # блокировки посреди транзакции. Отсюда до COMMIT стоят и читатели
+                        cur.execute("LOCK TABLE otc.user_reputation IN ACCESS EXCLUSIVE MODE")
+                        cur.execute(REPUTATION_SHADOW_CATCHUP_SQL, {"since": since})
+                        cur.execute(REPUTATION_SWAP_SQL)
+                        _notify(cur, "sender", drifted)
+                    break
+                except (errors.LockNotAvailable, errors.DeadlockDetected):
+                    if attempt == SWAP_RETRIES:
+                        raise
+                    print(f"[reputation] swap lock busy, retry {attempt}/{SWAP_RETRIES - 1}")
+                    time.sleep(SWAP_RETRY_PAUSE * attempt)
+                    # за время ожидания набежали правки — догоняем без блокировки
+                    since = _catch_up(cur, since)
+            REPUTATION_DRIFT_TOTAL.inc(drift.senders)
+            return drift
+        finally:
+            # после подмены тени уже нет; после check или ошибки — убираем
+            cur.execute("DROP TABLE IF EXISTS otc.user_reputation_shadow")
+            cur.execute("SELECT pg_advisory_unlock(%s)", (REBUILD_LOCK_KEY,))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild otc.user_reputation from otc.listing_reaction")
+    ap.add_argument("command", choices=("rebuild", "check"))
+    ap.add_argument("--chunk", type=int, default=0, help="Senders per INSERT (0 — one statement)")
+    ap.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between chunks")
+    ap.add_argument("--sample", type=int, default=10, help="How many of the largest drifts to print")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    drift = rebuild(
+        chunk=args.chunk, pause=args.pause, swap=args.command == "rebuild", sample=args.sample,
+        progress=(lambda i, n: print(f"  chunk {i}/{n}")) if args.chunk else None,
+    )
+    dt = time.perf_counter() - t0
+
+    print(f"drift: {drift.senders:,} senders, |Δlikes|={drift.likes:,}, |Δdislikes|={drift.dislikes:,}")
+    for r in drift.sample:
+        print(f"  {r['user_id']:>14}  {r['old_likes']}/{r['old_dislikes']} -> {r['likes']}/{r['dislikes']}")
+    verb = "rebuilt and swapped" if args.command == "rebuild" else "checked (no changes)"
+    print(f"{verb} in {dt:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
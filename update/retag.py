@@ -0,0 +1,95 @@
+# retag.py
+"""
+Перетегирование архива: пересчитывает is_wtb / topic_ids / tags / text_clean у строк,
+чей tags_rev не совпадает с текущей tagging.TAGS_REVISION (новые строки
+коллектор пишет сразу с текущей ревизией; старые — после правки словарей
+или до миграции 5 — догоняет этот проход).
+
+Идёт по id пачками, каждая пачка — один SELECT и одна транзакция UPDATE,
+между пачками пауза, чтобы не мешать ингесту. Прерванный проход
+безопасно перезапускать: уже обновлённые строки отфильтруются по ревизии.
+
+В коллекторе запускается в фоне на старте (RETAG_ON_START), вручную:
+    python update/retag.py run [--batch 2000] [--pause 0.2]
+    python update/retag.py status
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from db import select_stale_tags, update_tags, count_tags_revisions
+from tagging import TAGS_REVISION, derive_many
+from metrics import Counter
+
+RETAG_ROWS_TOTAL = Counter("otc_retag_rows_total", "Archive rows re-tagged with the current dictionaries")
+
+RETAG_BATCH = int(os.getenv("RETAG_BATCH", "2000"))
+RETAG_PAUSE = float(os.getenv("RETAG_PAUSE", "0.2"))
+
+
+def retag_batch(after_id: int, limit: int = RETAG_BATCH, rev: str = TAGS_REVISION) -> tuple[int, int]:
+    """Одна пачка. Возвращает (последний id, сколько строк обновлено); id=-1 — строк не осталось."""
+    rows = select_stale_tags(rev, after_id, limit)
+    if not rows:
+        return -1, 0
+    updates = [
+        {"id": r["id"], "is_wtb": d.is_wtb, "topic_ids": d.topic_ids, "tags": d.tags,
+         "text_clean": d.text_clean}
+        for r, d in zip(rows, derive_many(r["text"] for r in rows))
+    ]
+    n = update_tags(updates, rev)
+    RETAG_ROWS_TOTAL.inc(n)
+    return rows[-1]["id"], n
+
+
+async def retag_loop(batch: int = RETAG_BATCH, pause: float = RETAG_PAUSE) -> int:
+    """Фоновый проход по всему архиву; синхронные вызовы БД и regex — в потоке."""
+    after_id, total = 0, 0
+    t0 = time.perf_counter()
+    while True:
+        try:
+            after_id, n = await asyncio.to_thread(retag_batch, after_id, batch)
+        except Exception as e:
+            print(f"[retag] ошибка на id>{after_id}: {e}; повтор через 30с")
+            await asyncio.sleep(30)
+            continue
+        if after_id < 0:
+            break
+        total += n
+        await asyncio.sleep(pause)
+    if total:
+        print(f"[retag] {TAGS_REVISION}: обновлено {total} строк за {time.perf_counter() - t0:.1f}с")
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Re-tag otc.messages_archive with the current dictionaries")
+    ap.add_argument("command", nargs="?", default="run", choices=("run", "status"))
+    ap.add_argument("--batch", type=int, default=RETAG_BATCH)
+    ap.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = ap.parse_args()
+
+    print(f"current revision: {TAGS_REVISION}")
+    if args.command == "status":
+        for r in count_tags_revisions():
+            mark = "*" if r["tags_rev"] == TAGS_REVISION else " "
+            print(f"{mark} {r['tags_rev'] or '(none)':>20}  {r['n']:,}")
+        return
+
+    after_id, total = 0, 0
+    t0 = time.perf_counter()
+    while True:
+        after_id, n = retag_batch(after_id, args.batch)
+        if after_id < 0:
+            break
+        total += n
+        print(f"  id<={after_id}: +{n} (всего {total:,})")
+        if args.pause:
+            time.sleep(args.pause)
+    dt = time.perf_counter() - t0
+    print(f"re-tagged {total:,} rows in {dt:.1f}s ({total / dt if dt else 0:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# scrubber.py
+"""
+Вырезание контактов из текста объявления: @юзеры, ссылки, телефоны.
+
+Раньше это были три re.sub подряд (tools.t.clean_text, копия в bot.py,
+похожая чистка в deal_items_extractor.normalize_text) — три прохода по
+тексту и три новые строки. Здесь один скомпилированный regex с именованной
+группой на каждый вид контакта: один finditer, вывод собирается одним join,
+заодно отдаём позиции вырезанного.
+
+    scrub("pm @bob or +1 234 567 890")
+      -> Scrubbed(text="pm [hidden] or [hidden]",
+                  spans=(Redaction(3, 7, "handle"), Redaction(11, 25, "phone")))
+
+Альтернативы начинаются с разных символов (@ / h,t / +,цифра), поэтому
+результат совпадает с прежними последовательными заменами: совпадение,
+найденное раньше по тексту, поглощает вложенные (хэндл внутри ссылки и т.п.).
+Ссылки теперь ловятся без учёта регистра (HTTPS://…) — раньше их пропускали.
+
+Правка паттернов — поднять SCRUBBER_VERSION: по ней (через tagging.TAGS_REVISION)
+перечищается сохранённый text_clean в архиве.
+"""
+import re
+from typing import NamedTuple, Tuple
+
+SCRUBBER_VERSION = 1
+
+PLACEHOLDER = "[hidden]"
+
+HANDLE_RE = r"@\w{3,32}"
+URL_RE = r"(?i:https?://\S+|t\.me/\S+)"
+PHONE_RE = r"\+?\d[\d\-\s()]{7,}"
+
+# lookahead по первым символам всех альтернатив: без него sre пробует
+# всю альтернативу на каждой позиции и один проход медленнее трёх re.sub
+_SCRUBBER = re.compile(
+    rf"(?=[@hHtT+\d])(?:(?P<handle>{HANDLE_RE})|(?P<url>{URL_RE})|(?P<phone>{PHONE_RE}))"
+)
+
+
+class Redaction(NamedTuple):
+    start: int  # позиции в исходном тексте
+    end: int
+    kind: str   # handle | url | phone
+
+
+class Scrubbed(NamedTuple):
+    text: str
+    spans: Tuple[Redaction, ...]
+
+
+def scrub(text: str, placeholder: str = PLACEHOLDER, *, strip: bool = True) -> Scrubbed:
+    t = text or ""
+    parts: list[str] = []
+    spans: list[Redaction] = []
+    pos = 0
+    for m in _SCRUBBER.finditer(t):
+        start, end = m.span()
+        parts.append(t[pos:start])
+        parts.append(placeholder)
+        spans.append(Redaction(start, end, m.lastgroup))
+        pos = end
+    if not spans:
+        return Scrubbed(t.strip() if strip else t, ())
+    parts.append(t[pos:])
+    out = "".join(parts)
+    return Scrubbed(out.strip() if strip else out, tuple(spans))
+
+
+def clean_text(text: str) -> str:
+    """Убираем контакты: @юзеры, ссылки, телефоны."""
+    return scrub(text).text
@@ -0,0 +1,78 @@
+# sender_cache.py
+"""
+Кэш сведений об отправителях, общий для бота, публикатора и коллектора:
+
+  reputation(sender_id) -> (likes, dislikes)         сбрасывает событие "sender"
+  stats(sender_id)      -> (total_messages, reviews) сбрасывает событие "sender"
+  username(sender_id)   -> username | None           сбрасывает событие "username"
+  row_sender(row_id)    -> sender_id                 не меняется, только LRU
+
+Пока шина (bus.EventBus) подключена, значения живут долго (SENDER_CACHE_TTL) —
+свежесть держат события от писателей db.py. Без шины кэши выключены и
+каждый вызов идёт в БД, как раньше.
+
+Свои же записи процесс видит раньше, чем вернётся NOTIFY, поэтому после
+записи вызывающий сбрасывает ключ сам (SENDERS.forget / remember_username).
+"""
+import os
+from typing import Optional
+
+from db import get_user_reputation, get_user_stats, get_username_for_sender, get_message_by_id
+from bus import EventBus, InvalidatedCache
+
+SENDER_CACHE_TTL = float(os.getenv("SENDER_CACHE_TTL", "3600"))
+SENDER_CACHE_MAX = int(os.getenv("SENDER_CACHE_MAX", "50000"))
+
+
+def _row_sender(row_id: int) -> Optional[int]:
+    row = get_message_by_id(row_id)
+    return row["sender_id"] if row else None
+
+
+class SenderCache:
+    def __init__(self, ttl: float = SENDER_CACHE_TTL, max_size: int = SENDER_CACHE_MAX):
+        self._reputation = InvalidatedCache(ttl, max_size)
+        self._stats = InvalidatedCache(ttl, max_size)
+        self._usernames = InvalidatedCache(ttl, max_size)
+        # sender_id у строки не меняется — этот кэш не зависит от шины
+        self._row_senders = InvalidatedCache(ttl, max_size)
+        self._row_senders.enabled = True
+
+    def attach(self, bus: EventBus) -> None:
+        bus.subscribe("sender", self.forget)
+        bus.subscribe("username", self._usernames.invalidate)
+        bus.on_state(self._set_enabled)
+
+    def _set_enabled(self, enabled: bool) -> None:
+        for c in (self._reputation, self._stats, self._usernames):
+            c.set_enabled(enabled)
+
+    def forget(self, sender_ids) -> None:
+        self._reputation.invalidate(sender_ids)
+        self._stats.invalidate(sender_ids)
+
+    def reputation(self, sender_id: int) -> tuple[int, int]:
+        return self._reputation.get(sender_id, get_user_reputation)
+
+    def stats(self, sender_id: int) -> tuple[int, int]:
+        return self._stats.get(sender_id, get_user_stats)
+
+    def username(self, sender_id: int) -> Optional[str]:
+        name = self._usernames.get(sender_id, get_username_for_sender)
+        if name is None:
+            # отрицательный ответ не держим: username вот-вот может появиться из Telegram
+            self._usernames.invalidate((sender_id,))
+        return name
+
+    def remember_username(self, sender_id: int, username: Optional[str]) -> None:
+        if username:
+            self._usernames.put(sender_id, username.lstrip("@"))
+
+    def row_sender(self, row_id: int) -> Optional[int]:
+        sender_id = self._row_senders.get(row_id, _row_sender)
+        if sender_id is None:
+            self._row_senders.invalidate((row_id,))
+        return sender_id
+
+
+SENDERS = SenderCache()
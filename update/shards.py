@@ -0,0 +1,210 @@
+# shards.py
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Iterable, Optional
+
+from telethon import events
+
+from metrics import Counter, Gauge
+
+log = logging.getLogger("shards")
+
+SHARD_MESSAGES_TOTAL = Counter(
+    "otc_shard_messages_total", "NewMessage events handled per user session", ("shard",),
+)
+SHARD_CHATS = Gauge(
+    "otc_shard_chats", "Watched chats assigned to a user session", ("shard",),
+)
+SHARD_UP = Gauge(
+    "otc_shard_up", "1 if the user session is connected and owns chats", ("shard",),
+)
+SHARD_UNCOVERED = Gauge(
+    "otc_shard_uncovered_chats", "Watched chats with no connected member session",
+)
+
+
+def _score(shard: str, chat_id: int) -> int:
+    # стабильный между процессами хэш (hash() в Python солёный)
+    h = hashlib.blake2b(f"{shard}:{chat_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(h, "big")
+
+
+def owner_of(chat_id: int, shards: list[str]) -> Optional[str]:
+    """
+    Rendezvous hashing: чат достаётся шарду с максимальным score.
+    Когда шард выпадает, переезжают только его чаты; вернулся — забирает их же.
+    """
+    if not shards:
+        return None
+    return max(shards, key=lambda s: _score(s, chat_id))
+
+
+def assign(chats: Iterable[int], members: dict[str, set[int]]) -> tuple[dict[str, set[int]], set[int]]:
+    """
+    Чат достаётся одному из шардов, чей аккаунт в нём состоит (members[шард]).
+    Возвращает (план, чаты без единого участника).
+    """
+    plan: dict[str, set[int]] = {s: set() for s in members}
+    uncovered: set[int] = set()
+    for c in chats:
+        owner = owner_of(c, [s for s, m in members.items() if c in m])
+        if owner is None:
+            uncovered.add(c)
+        else:
+            plan[owner].add(c)
+    return plan, uncovered
+
+
+class Shard:
+    """
+    watch — WatchList папки WATCH_FOLDER этого аккаунта: его доля чатов.
+    Членство читается из папки самого аккаунта, чужие чаты ему не достаются.
+    """
+
+    def __init__(self, name: str, client, watch):
+        self.name = name
+        self.client = client
+        self.watch = watch
+        self.alive = True
+        self.chats: set[int] = set()
+        self.handler = None
+
+    @property
+    def members(self) -> set[int]:
+        return self.watch.chats
+
+
+class ShardSet:
+    """
+    Раскладывает отслеживаемые чаты по нескольким user-сессиям.
+
+    Фильтр chats= у NewMessage Telethon применяет на клиенте: апдейты чата
+    приходят каждому аккаунту, который в нём состоит. Поэтому нагрузку делит
+    членство, а не фильтр: у каждого аккаунта своя папка WATCH_FOLDER с его
+    долей чатов, отслеживается их объединение (watch_chats, меняется на месте).
+    Чат слушает ровно один шард из тех, чей аккаунт в нём состоит; фильтры
+    меняются синхронно (без await), так что диспетчер Telethon не видит момента,
+    когда чат принадлежит двоим. Упавшая сессия выпадает из раскладки, её чаты
+    уходят другим участникам, если они есть; чаты без живого участника не
+    читаются до переподключения (otc_shard_uncovered_chats).
+    """
+
+    def __init__(
+        self,
+        shards: list[Shard],
+        on_new: Callable[[object, object], Awaitable[None]],
+        *,
+        on_deleted: Optional[Callable[[object, "Shard"], None]] = None,
+        on_change: Optional[Callable[[set[int], set[int]], None]] = None,
+        reconnect_delay: float = 30.0,
+        reconnect_max_delay: float = 600.0,
+    ):
+        self.shards = shards
+        self.watch_chats: set[int] = set()
+        self.on_new = on_new
+        self.on_deleted = on_deleted
+        self.on_change = on_change
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+    async def start(self) -> None:
+        """Папки всех аккаунтов (из кэша или запросом) — до install."""
+        await asyncio.gather(*(s.watch.start() for s in self.shards))
+        self._merge()
+
+    def _merge(self) -> tuple[set[int], set[int]]:
+        fresh = set().union(*(s.members for s in self.shards))
+        added, removed = fresh - self.watch_chats, self.watch_chats - fresh
+        self.watch_chats -= removed
+        self.watch_chats |= added
+        return added, removed
+
+    def _on_folder_change(self, added: set[int], removed: set[int]) -> None:
+        # сменилась доля одного аккаунта — общий набор и раскладка
+        added, removed = self._merge()
+        self.rebalance()
+        if self.on_change and (added or removed):
+            self.on_change(added, removed)
+
+    def owner(self, chat_id: int) -> Optional[Shard]:
+        """Живой шард, который сейчас слушает чат."""
+        for s in self.shards:
+            if s.alive and chat_id in s.chats:
+                return s
+        return None
+
+    def _make_handler(self, shard: Shard):
+        counter = SHARD_MESSAGES_TOTAL.labels(shard.name)
+
+        async def _on_new(event):
+            counter.inc()
+            await self.on_new(event, shard.client)
+
+        return _on_new
+
+    def _make_deleted_handler(self, shard: Shard):
+        async def _on_deleted(event):
+            self.on_deleted(event, shard)
+
+        return _on_deleted
+
+    def install(self) -> None:
+        for shard in self.shards:
+            shard.handler = self._make_handler(shard)
+            if self.on_deleted:
+                # удаления нужны со всех сессий: у каждой свои сквозные id личек/групп
+                shard.client.add_event_handler(self._make_deleted_handler(shard), events.MessageDeleted())
+            shard.watch.on_change = self._on_folder_change
+            shard.watch.install()
+        self.rebalance()
+
+    def rebalance(self) -> dict[str, int]:
+        plan, uncovered = assign(self.watch_chats, {s.name: s.members for s in self.shards if s.alive})
+        moved = 0
+        for shard in self.shards:
+            chats = plan.get(shard.name, set())
+            moved += len(chats - shard.chats)
+            shard.chats = chats
+            shard.client.remove_event_handler(shard.handler, events.NewMessage)
+            if chats:
+                shard.client.add_event_handler(shard.handler, events.NewMessage(chats=list(chats)))
+            SHARD_CHATS.labels(shard.name).set(len(chats))
+            SHARD_UP.labels(shard.name).set(1 if shard.alive else 0)
+        SHARD_UNCOVERED.set(len(uncovered))
+        sizes = {s.name: len(s.chats) for s in self.shards}
+        print(f"[shards] раскладка: {sizes} (переехало {moved})")
+        if uncovered:
+            log.warning("%d watched chat(s) have no connected member session", len(uncovered))
+        return sizes
+
+    async def _supervise(self, shard: Shard) -> None:
+        while True:
+            await shard.client.disconnected
+            shard.alive = False
+            log.warning("shard %s disconnected, moving its %d chats", shard.name, len(shard.chats))
+            self.rebalance()
+
+            delay = self.reconnect_delay
+            while not shard.alive:
+                await asyncio.sleep(delay)
+                try:
+                    await shard.client.connect()
+                    if await shard.client.is_user_authorized():
+                        shard.alive = True
+                        break
+                    log.error("shard %s: session is no longer authorized", shard.name)
+                    await shard.client.disconnect()
+                except Exception as e:
+                    log.warning("shard %s reconnect failed: %s", shard.name, e)
+                delay = min(self.reconnect_max_delay, delay * 2)
+
+            log.warning("shard %s is back", shard.name)
+            self.rebalance()
+            # пока сессия лежала, папку могли править — сверяем
+            shard.watch.trigger()
+
+    async def run(self) -> None:
+        """Вместо client.run_until_disconnected(): живёт, пока живы супервизоры шардов."""
+        await asyncio.gather(*(self._supervise(s) for s in self.shards),
+                             *(s.watch.run() for s in self.shards))
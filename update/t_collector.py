@@ -3,22 +3,29 @@ import asyncio
 import random
 from db import (init_db,
                 exists_same_text_for_sender,
-                save_message,
-                get_user_stats,
-                get_user_reputation,
-                save_published_post)
+                save_message)
 
-from telethon import TelegramClient, events, Button
+from telethon import TelegramClient
 from telethon.errors import FloodWaitError
-from html import escape
 
-from tools.t import (get_chats_from_folder,
-                     resolve_username,
-                     is_buy_message,
-                     clean_text,
-                     compute_rating_percent,
-                     stars_from_percent,
-                     get_destinations)
+from tools.t import resolve_username
+from tagging import derive, TAGS_REVISION
+from retag import retag_loop
+from cold_archive import retention_loop, ARCHIVE_RETENTION_DAYS
+from demand import rollup_loop, DEMAND_ROLLUP_INTERVAL
+from texts import share_loop, TEXTS_SHARE_INTERVAL
+from message_state import backfill_loop, MESSAGE_STATE_BACKFILL_INTERVAL
+
+from deletions import DeletionTracker, make_card_cleaner
+from watchlist import WatchList
+from chats import ChatRegistry
+from bus import EventBus
+from sender_cache import SENDERS
+from shards import Shard, ShardSet
+from recorder import EventRecorder
+from publisher import Publisher, report_depth
+from metrics import (start_metrics_server, stage, tg_call, observe_lag,
+                     FLOODWAIT_TOTAL, FLOODWAIT_SECONDS, DUPLICATES_TOTAL, SKIPPED_POSTS_TOTAL)
 
 from telethon.sessions import SQLiteSession
 from dotenv import load_dotenv
@@ -27,22 +34,164 @@ load_dotenv()
 API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 USER_SESSION_PATH = "sessions/otc_user.session"
+# несколько user-сессий через запятую — у каждого аккаунта своя папка WATCH_FOLDER (см. shards.py)
+USER_SESSIONS = [p.strip() for p in os.getenv("USER_SESSIONS", USER_SESSION_PATH).split(",") if p.strip()]
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_SESSION_PATH = "sessions/otc_bot.session"
 TARGET_GROUP = os.getenv("TARGET_GROUP")
 
+# что делать с опубликованными карточками удалённых сообщений: "", "delete" или "mark"
+DELETED_CARDS_MODE = os.getenv("DELETED_CARDS_MODE", "")
 
-async def main():
-    init_db()
+METRICS_PORT = int(os.getenv("COLLECTOR_METRICS_PORT", "9101"))
+
+# путь к .jsonl.gz — писать входящие NewMessage для последующего replay
+RECORD_EVENTS = os.getenv("RECORD_EVENTS", "")
+
+# папка с отслеживаемыми чатами, кэш её состава и период сверки (сек)
+WATCH_FOLDER = os.getenv("WATCH_FOLDER", "OTC")
+WATCH_CACHE_PATH = os.getenv("WATCH_CACHE_PATH", "data/watch_chats.json")
+WATCH_REFRESH_INTERVAL = float(os.getenv("WATCH_REFRESH_INTERVAL", "600"))
+
+
+def _session_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _watch_cache_path(path: str) -> str:
+    # у каждой сессии своя папка — и свой кэш; одна сессия — прежний путь
+    if len(USER_SESSIONS) == 1:
+        return WATCH_CACHE_PATH
+    root, ext = os.path.splitext(WATCH_CACHE_PATH)
+    return f"{root}.{_session_name(path)}{ext}"
+
+# сколько воркеров публикации крутить внутри коллектора (0 — только отдельный publisher.py)
+PUBLISH_WORKERS = int(os.getenv("PUBLISH_WORKERS", "1"))
+
+# на старте догнать в фоне строки архива, размеченные старыми словарями (см. retag.py)
+RETAG_ON_START = os.getenv("RETAG_ON_START", "1") != "0"
+
+
+# ===============================================================
+# 🔥 ПАЙПЛАЙН НОВОГО СООБЩЕНИЯ: классификация/роутинг/теги → архив → очередь публикации
+# (вынесен из main(), чтобы replay-драйвер гонял его с фейковыми клиентами)
+# ===============================================================
+async def handle_new_message(event, user_client, publisher=None):
+    msg = event.message
+    chat_id = event.chat_id
+    sender_id = event.sender_id
+    text = msg.message or ""
+    observe_lag(msg.date)
+
+    with stage("on_new", "resolve_username"):
+        sender_username = SENDERS.username(sender_id)
+
+        if not sender_username:
+            try:
+                sender = await event.get_sender()
+                sender_username = getattr(sender, "username", None)
+            except Exception:
+                sender_username = None
+
+        if not sender_username:
+            sender_username = await resolve_username(user_client, sender_id)
+
+    # поиск reply
+    reply_to_msg_id = None
+    rt = getattr(msg, "reply_to", None)
+    if rt:
+        reply_to_msg_id = getattr(rt, "reply_to_msg_id", None) or getattr(rt, "reply_to_top_id", None)
+
+    # проверка дубликата
+    with stage("on_new", "dup_check"):
+        dup = exists_same_text_for_sender(sender_id, text)
+    if dup:
+        DUPLICATES_TOTAL.inc()
+
+    # классификация, роутинг и теги — один раз здесь, дальше их читают из архива
+    with stage("on_new", "classify"):
+        derived = derive(text)
+
+    # WTB публикуем, если это не повтор и не простыня; задание в otc.publish_outbox
+    # пишется в той же транзакции, что и строка архива (см. publisher.py)
+    skip = None
+    if derived.is_wtb and (dup or len(text) > 300):
+        skip = "duplicate" if dup else "too_long"
+    publish_topics = derived.topic_ids if derived.is_wtb and not skip else None
+
+    # сохраняем в бд
+    with stage("on_new", "save_message"):
+        row = save_message(
+            message_id=msg.id,
+            chat_id=chat_id,
+            sender_id=sender_id,
+            sender_username=sender_username,
+            ts_utc=msg.date,
+            text=text,
+            reply_to_msg_id=reply_to_msg_id,
+            derived=derived,
+            tags_rev=TAGS_REVISION,
+            publish_topics=publish_topics,
+        )
+    # своё же событие "sender"/"username" придёт позже — обновляем кэш сразу
+    SENDERS.forget((sender_id,))
+    SENDERS.remember_username(sender_id, sender_username)
+
+    print(
+        f"[archive] chat={chat_id} id={row['id']} inserted={row['inserted']} "
+        f"msg_id={msg.id} sender_id={sender_id} username={sender_username or '-'}"
+    )
 
-    # клиент-пользователь (читает OTC чаты + будет автопостинг)
-    user_client = TelegramClient(SQLiteSession(USER_SESSION_PATH), API_ID, API_HASH)
-    await user_client.start()
+    if skip:
+        SKIPPED_POSTS_TOTAL.labels(skip).inc()
+        print(f"[skip-post] duplicate for sender={sender_id} или слишком длинный текст")
+    elif row["enqueued"] and publisher:
+        publisher.notify()
 
-    # читаем список чатов в папке OTC
-    WATCH_CHATS = await get_chats_from_folder(user_client, "OTC")
-    print(f"[init] папка OTC найдена, чатов: {len(WATCH_CHATS)}")
+
+async def main():
+    init_db()
+    await start_metrics_server(METRICS_PORT)
+
+    # клиенты-пользователи: читают OTC чаты (каждый — чаты своей папки) и автопостят в них
+    user_clients = [TelegramClient(SQLiteSession(path), API_ID, API_HASH) for path in USER_SESSIONS]
+    for c in user_clients:
+        await c.start()
+
+    async def on_new(event, client):
+        if recorder:
+            recorder.record(event)
+        # сущность чата приходит вместе с апдейтом — без запросов к Telegram
+        chat_registry.observe(getattr(event, "chat", None))
+        await handle_new_message(event, client, publisher)
+
+    # без фильтра chats: у удалений из личек/обычных групп chat_id нет,
+    # такие id DeletionTracker разворачивает сам — на чаты той же сессии
+    def on_deleted(event, shard):
+        deletion_tracker.add(event.chat_id, event.deleted_ids, scope=shard.chats)
+
+    # состав папок поменялся — новые чаты в справочник, через аккаунт-участника
+    def on_watch_change(added, removed):
+        for s in shards.shards:
+            if added & s.members:
+                asyncio.create_task(chat_registry.sync_dialogs(s.client, added & s.members))
+
+    # папка OTC каждого аккаунта: из кэша сразу, дальше сверяется в фоне
+    shards = ShardSet(
+        [
+            Shard(_session_name(path), c,
+                  WatchList(c, WATCH_FOLDER, cache_path=_watch_cache_path(path),
+                            refresh_interval=WATCH_REFRESH_INTERVAL))
+            for path, c in zip(USER_SESSIONS, user_clients)
+        ],
+        on_new,
+        on_deleted=on_deleted,
+        on_change=on_watch_change,
+    )
+    await shards.start()
+    WATCH_CHATS = shards.watch_chats  # одно и то же множество, меняется на месте
+    print(f"[init] папки {WATCH_FOLDER}: чатов {len(WATCH_CHATS)}")
 
     # клиент-бот — публикует в твой OTC канал
     bot_client = TelegramClient(BOT_SESSION_PATH, API_ID, API_HASH)
@@ -65,19 +214,27 @@ async def main():
         while True:
             print("\n=== 🔄 AUTPOST: Новый круг публикаций начат ===")
 
-            for chat in WATCH_CHATS:
+            for chat in sorted(WATCH_CHATS):  # снимок: набор может обновиться посреди круга
                 chat_id = chat
+                # пишем от аккаунта, который состоит в чате и сейчас его слушает
+                owner = shards.owner(chat_id)
+                if owner is None:
+                    print(f"[autopost] Нет подключённого аккаунта в чате {chat_id}, пропускаю")
+                    continue
 
                 try:
                     print(f"[autopost] Публикую в чат: {chat_id}")
-                    await user_client.send_message(
-                        chat_id,
-                        POST_TEXT,
-                        parse_mode="HTML",
-                        link_preview=False
-                    )
+                    with tg_call("user.send_message"):
+                        await owner.client.send_message(
+                            chat_id,
+                            POST_TEXT,
+                            parse_mode="HTML",
+                            link_preview=False
+                        )
 
                 except FloodWaitError as e:
+                    FLOODWAIT_TOTAL.labels("autopost").inc()
+                    FLOODWAIT_SECONDS.labels("autopost").inc(e.seconds)
                     print(f"[autopost] ⚠️ FloodWait {e.seconds}s — жду...")
                     await asyncio.sleep(e.seconds)
                 except Exception as e:
@@ -91,127 +248,68 @@ async def main():
             print("=== ⏳ AUTPOST: Круг завершён. Ожидание 3 часа... ===\n")
             await asyncio.sleep(WAIT_BETWEEN_ROUNDS)
 
-    # запускаем автопостинг как параллельную задачу
-    asyncio.create_task(autopost_loop())
+    # ===============================================================
+    # 🗑 УДАЛЕНИЯ: копим id и помечаем deleted пачками
+    # ===============================================================
+    deletion_tracker = DeletionTracker(
+        WATCH_CHATS,
+        on_deleted=make_card_cleaner(bot_client, DELETED_CARDS_MODE),
+    )
+    asyncio.create_task(deletion_tracker.run())
 
     # ===============================================================
     # 🔥 ЛОВИМ НОВЫЕ WTB/WTS и постим в твой OTC канал
     # ===============================================================
-    @user_client.on(events.NewMessage(chats=WATCH_CHATS))
-    async def on_new(event):
-        msg = event.message
-        chat_id = event.chat_id
-        sender_id = event.sender_id
-        text = msg.message or ""
-
-        from db import get_username_for_sender
-        sender_username = get_username_for_sender(sender_id)
-
-        if not sender_username:
-            try:
-                sender = await event.get_sender()
-                sender_username = getattr(sender, "username", None)
-            except Exception:
-                sender_username = None
-
-        if not sender_username:
-            sender_username = await resolve_username(user_client, sender_id)
-
-        # поиск reply
-        reply_to_msg_id = None
-        rt = getattr(msg, "reply_to", None)
-        if rt:
-            reply_to_msg_id = getattr(rt, "reply_to_msg_id", None) or getattr(rt, "reply_to_top_id", None)
+    recorder = EventRecorder(RECORD_EVENTS) if RECORD_EVENTS else None
+
+    publishers = [Publisher(bot_client, TARGET_GROUP) for _ in range(PUBLISH_WORKERS)]
+    for p in publishers:
+        asyncio.create_task(p.run())
+    asyncio.create_task(report_depth())
+
+    retag_task = asyncio.create_task(retag_loop()) if RETAG_ON_START else None
+    # почасовой спрос для /trends бота — после retag, чтобы не считать старыми тегами (см. demand.py)
+    if DEMAND_ROLLUP_INTERVAL:
+        asyncio.create_task(rollup_loop(wait_for=retag_task))
+    # повторяющиеся тела сообщений — в otc.texts (см. texts.py)
+    if TEXTS_SHARE_INTERVAL:
+        asyncio.create_task(share_loop())
+    # старые колонки состояния архива — в otc.message_state (см. message_state.py)
+    if MESSAGE_STATE_BACKFILL_INTERVAL:
+        asyncio.create_task(backfill_loop())
+    # старые строки без карточек и реакций — в parquet-сегменты (см. cold_archive.py)
+    if ARCHIVE_RETENTION_DAYS:
+        asyncio.create_task(retention_loop())
+
+    # события инвалидации от бота (реакции) и своих же записей — для SENDERS
+    bus = EventBus()
+    SENDERS.attach(bus)
+    asyncio.create_task(bus.run())
+    # один «будильник» на ingest: хватает разбудить любого воркера
+    publisher = publishers[0] if publishers else None
 
-        # проверка дубликата
-        dup = exists_same_text_for_sender(sender_id, text)
-
-        # сохраняем в бд
-        row = save_message(
-            message_id=msg.id,
-            chat_id=chat_id,
-            sender_id=sender_id,
-            sender_username=sender_username,
-            ts_utc=msg.date,
-            text=text,
-            reply_to_msg_id=reply_to_msg_id,
-        )
-
-        print(
-            f"[archive] chat={chat_id} id={row['id']} inserted={row['inserted']} "
-            f"msg_id={msg.id} sender_id={sender_id} username={sender_username or '-'}"
-        )
+    # ===============================================================
+    # 🗂 СПРАВОЧНИК ЧАТОВ: username/title/forum из сущностей Telethon → otc.chats
+    # ===============================================================
+    chat_registry = ChatRegistry()
+    await chat_registry.load()
+    asyncio.create_task(chat_registry.run())
+    for s in shards.shards:
+        asyncio.create_task(chat_registry.sync_dialogs(s.client, s.members))
 
-        if is_buy_message(text):
-            if dup or len(text) > 300:
-                print(f"[skip-post] duplicate for sender={sender_id} или слишком длинный текст")
-                return
-
-            cleaned = clean_text(text)
-            cleaned_safe = escape(cleaned)
-            row_id = row["id"]
-
-            user_total_messages, user_reviews_count = get_user_stats(sender_id)
-
-            likes, dislikes = get_user_reputation(sender_id)
-            rating_pct = compute_rating_percent(likes, dislikes)
-            stars_str = stars_from_percent(rating_pct)
-            topics = get_destinations(text)
-
-            # формируем красивый пост
-            parts = []
-            parts.append("<b>💸 New WTB message</b>\n")
-            parts.append(f"<b>About user ({stars_str}):</b>")
-            parts.append(
-                "<blockquote>"
-                f"~ <i>User rating:</i> {rating_pct}%\n"
-                f"~ <i>Total messages:</i> {user_total_messages}\n"
-                f"~ <i>Number of reviews:</i> {user_reviews_count}"
-                "</blockquote>"
-            )
-            parts.append("<b>Text:</b>")
-            parts.append(f"<blockquote>{cleaned_safe}</blockquote>")
-
-            body = "\n".join(parts)
-
-            for topic_id in topics:
-                posted = await bot_client.send_message(
-                    entity=TARGET_GROUP,
-                    message=body,
-                    link_preview=False,
-                    parse_mode="HTML",
-                    reply_to=topic_id,
-                )
-
-                otc_msg_id = posted.id
-                start_payload = f"{row_id}_{otc_msg_id}"
+    shards.install()
 
-                try:
-                    save_published_post(row_id=row_id, chat_id=posted.chat_id, message_id=posted.id)
-                except Exception:
-                    pass
-
-                buttons = [
-                    [
-                        Button.inline(f"✅ {likes}", data=f"like_{row_id}"),
-                        Button.inline(f"❌ {dislikes}", data=f"dislike_{row_id}"),
-                    ],
-                    [
-                        Button.url("💬 Contact buyer", f"https://t.me/otc_darwin_bot?start={start_payload}"),
-                    ],
-                ]
-
-                await posted.edit(
-                    text=body,
-                    buttons=buttons,
-                    link_preview=False,
-                    parse_mode="HTML",
-                )
-
-                await asyncio.sleep(0.3)
+    # автопостинг — после раскладки: пишет от аккаунта-владельца чата
+    asyncio.create_task(autopost_loop())
 
     print("collector running… (Ctrl+C для выхода)")
-    await user_client.run_until_disconnected()
+    try:
+        await shards.run()
+    finally:
+        await deletion_tracker.flush()
+        await chat_registry.flush()
+        if recorder:
+            recorder.close()
 
 
 if __name__ == "__main__":
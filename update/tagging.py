@@ -0,0 +1,164 @@
+# tagging.py
+"""
+Производные поля строки архива, которые раньше каждый потребитель
+пересчитывал из сырого текста сам:
+
+  is_wtb     — вердикт classifier.classify;
+  topic_ids  — куда роутится карточка (tools.t.get_destinations), только для WTB;
+  tags       — хэштеги позиций из KNOWN_ITEMS (по тексту без контактов);
+  text_clean — текст без контактов (scrubber.scrub), его показывают карточки.
+
+Коллектор пишет их в otc.messages_archive при вставке вместе с tags_rev —
+ревизией словарей. Ревизия считается из самих словарей (маркеры
+классификатора, KNOWN_ITEMS, карта топиков, паттерны скраббера), так что
+любая их правка делает старые строки «устаревшими», и retag.py
+перетегирует их в фоне.
+Читатели (бот, аналитика) берут колонки, если tags_rev совпадает с
+текущей, иначе считают на лету.
+"""
+import json
+import hashlib
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from classifier import CLASSIFIER_VERSION, BUY_CUES, SELL_CUES, classify_many
+from scrubber import SCRUBBER_VERSION, HANDLE_RE, URL_RE, PHONE_RE, clean_text
+from tools.t import get_destinations, TOPIC_MAP, GENERAL_TOPIC_ID
+
+# единый словарь позиций (был продублирован в bot.py и analysis/test.py)
+KNOWN_ITEMS: Dict[str, List[str]] = {
+    "exchanges": [
+        "binance", "bybit", "okx", "huobi", "htx",
+        "gate io", "bitget", "mexc", "kucoin", "bingx",
+        "coinlist", "paxful", "cryptocom", "crypto com",
+        "bc game", "bcgame", "fragment", "weex", "arkham"
+    ],
+    "payments_banks": [
+        # классические банки
+        "bunq", "n26", "monzo", "santander", "bbva",
+        "ing", "finom", "vivid", "chase", "c24",
+        "trade republic", "billions", "bank of america",
+
+        # финтех / нео банки
+        "revolut", "revolut business", "revolut personal",
+        "wise", "wise business", "wise personal",
+        "paysera", "icard", "zen", "zen business",
+        "airwallex", "mercury", "bitsa", "wirex",
+        "genome", "sumup", "persona", "trustee", "trustee plus",
+
+        # платежки
+        "stripe", "stripe business", "paypal", "paypal business",
+        "cashapp", "alipay", "nexo", "ozon", "twitter"
+    ],
+    "kyc_verification": [
+        "kyc", "wts kyc", "kyc service", "kyc or ready",
+        "kyc bybit", "kyc service or", "kyc accepted",
+        "kyc / acc", "kyc / ready", "kyc or",
+        "kyc by", "wts kyc service", "wts kyc or",
+        "other kyc", "other kyc accepted", "kyc 8",
+        "blockpass", "persona", "sumsub", "onfido",
+        "holonym", "buildpad", "buidlpad", "solayer",
+        "kaito", "arkham", "legion", "civic",
+        "sandbox", "echo"
+    ],
+    "marketplaces_services": [
+        "fragment", "tiktok", "temu", "ozon", "airbnb",
+        "telegram", "twitter", "whatsapp", "esim",
+        "game", "bc game", "bcgame", "bet365"
+    ],
+    "crypto_wallets": [
+        "metamask", "trustwallet", "phantom", "coinbase wallet",
+        "ledger", "trezor", "tronlink"
+    ],
+    "countries": [
+        "usa", "indonesia", "spain", "egypt", "philippines",
+        "uganda", "georgia", "america", "germany", "armenia",
+        "africa", "russia", "costa rica", "italy", "zambia",
+        "vietnam", "rwanda", "angola", "uruguay", "paraguay",
+        "argentina", "bolivia", "peru", "brazil", "chile",
+        "colombia", "el salvador", "mexico",
+        # были только в аналитике
+        "india", "nigeria", "pakistan", "bangladesh", "nepal", "kenya"
+    ],
+    "misc": [
+        "iban", "llc", "emulator", "passport",
+        "vcc", "accs", "accounts", "ready account",
+        "ready acc", "old account", "merchant", "premium",
+        "crypto", "wallet", "stake", "escrow", "reviews",
+        "selfie", "verification"
+    ]
+}
+
+
+def _tag(word: str) -> str:
+    return "#" + word.replace(" ", "_")  # пробелы → "_"
+
+
+# слово словаря -> тег и обратно тег -> категории (одно слово бывает в нескольких)
+_WORDS: List[tuple] = sorted({(w, _tag(w)) for words in KNOWN_ITEMS.values() for w in words})
+TAG_CATEGORIES: Dict[str, List[str]] = {}
+for _cat, _words in KNOWN_ITEMS.items():
+    for _w in _words:
+        cats = TAG_CATEGORIES.setdefault(_tag(_w), [])
+        if _cat not in cats:
+            cats.append(_cat)
+
+
+def _revision() -> str:
+    payload = json.dumps(
+        [CLASSIFIER_VERSION, BUY_CUES, SELL_CUES, KNOWN_ITEMS,
+         sorted(TOPIC_MAP.items()), GENERAL_TOPIC_ID,
+         SCRUBBER_VERSION, HANDLE_RE, URL_RE, PHONE_RE],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return f"c{CLASSIFIER_VERSION}-{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:10]}"
+
+
+TAGS_REVISION = _revision()
+
+
+class Derived(NamedTuple):
+    is_wtb: bool
+    topic_ids: Optional[List[int]]  # None — не WTB, не роутим
+    tags: List[str]
+    text_clean: str
+
+
+def extract_tags(text: str) -> List[str]:
+    """Хэштеги из словаря по тексту: без дубликатов, отсортированы."""
+    lowered = (text or "").lower()
+    return sorted({tag for w, tag in _WORDS if w in lowered})
+
+
+def tags_by_category(tags: Iterable[str]) -> Dict[str, List[str]]:
+    """{category: [#tag, ...]} — раскладка плоского списка тегов по категориям."""
+    out: Dict[str, List[str]] = {}
+    for tag in tags:
+        for cat in TAG_CATEGORIES.get(tag, ()):
+            out.setdefault(cat, []).append(tag)
+    return out
+
+
+def derive_many(texts: Iterable[str]) -> List[Derived]:
+    texts = [t or "" for t in texts]
+    out = []
+    for text, verdict in zip(texts, classify_many(texts)):
+        topic_ids = get_destinations(text) if verdict.is_wtb else None
+        cleaned = clean_text(text)
+        out.append(Derived(verdict.is_wtb, topic_ids, extract_tags(cleaned), cleaned))
+    return out
+
+
+def derive(text: str) -> Derived:
+    return derive_many([text])[0]
+
+
+def is_current(row: dict) -> bool:
+    """Производные поля строки посчитаны текущими словарями."""
+    return row.get("tags_rev") == TAGS_REVISION
+
+
+def row_clean_text(row: dict) -> str:
+    """text_clean из архива; у строк старой ревизии — чистим на лету."""
+    if is_current(row) and row.get("text_clean") is not None:
+        return row["text_clean"]
+    return clean_text(row.get("text") or "")
@@ -0,0 +1,195 @@
+# test_throttle.py
+"""
+Автомат ReactionThrottle: admit / fold / settle / _flush.
+
+Время admit задаётся явно (now=); таймеры записи живут в event loop, поэтому
+асинхронные сценарии крутятся в asyncio.run. now берётся далеко в прошлом
+относительно time.monotonic(), так что взведённый таймер пишет итог на первом
+же шаге цикла — момент записи определяет await в тесте.
+
+    python -m pytest -q update/test_throttle.py
+"""
+import asyncio
+
+from throttle import ReactionThrottle, fold, PASS, COLLAPSED, SHED
+
+ROW, USER, LIKE, DISLIKE = 10, 20, 1, -1
+
+
+class Recorder:
+    """apply/refresh для троттлинга: запоминает вызовы, первые fail записей падают."""
+
+    def __init__(self, fail: int = 0):
+        self.fail = fail
+        self.writes: list[tuple] = []
+        self.refreshes: list[tuple] = []
+
+    async def apply(self, row_id, user_id, reaction, context):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("db down")
+        self.writes.append((row_id, user_id, reaction, context))
+
+    async def refresh(self, row_id, user_id, context):
+        self.refreshes.append((row_id, user_id, context))
+
+
+def make(rec: Recorder, **kw) -> ReactionThrottle:
+    kw.setdefault("retry_delay", 0)
+    return ReactionThrottle(rec.apply, refresh=rec.refresh, **kw)
+
+
+async def settle_loop():
+    # дать отработать таймерам записи (ensure_future + пара await внутри)
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_fold_matches_toggle_reaction():
+    assert fold(None, LIKE) == (LIKE, "added")
+    assert fold(LIKE, LIKE) == (None, "removed")
+    assert fold(LIKE, DISLIKE) == (DISLIKE, "switched")
+
+
+def test_first_click_passes_repeats_collapse_until_known():
+    async def run():
+        t = make(Recorder())
+        assert t.admit(ROW, USER, LIKE, "card", now=100.0).action == PASS
+        a = t.admit(ROW, USER, LIKE, "card", now=100.1)
+        # первый toggle ещё не вернулся — итог клика неизвестен
+        assert a == (COLLAPSED, None, None)
+    asyncio.run(run())
+
+
+def test_collapsed_series_writes_final_state_once():
+    async def run():
+        rec = Recorder()
+        t = make(rec)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        assert t.admit(ROW, USER, LIKE, "card", now=100.2).result == "removed"
+        assert t.admit(ROW, USER, DISLIKE, "card", now=100.4).result == "added"
+        await settle_loop()
+        assert rec.writes == [(ROW, USER, DISLIKE, "card")]
+        assert rec.refreshes == []
+    asyncio.run(run())
+
+
+def test_series_back_to_db_state_writes_nothing():
+    async def run():
+        rec = Recorder()
+        t = make(rec)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        t.admit(ROW, USER, LIKE, "card", now=100.2)
+        t.admit(ROW, USER, LIKE, "card", now=100.4)
+        await settle_loop()
+        assert rec.writes == []
+    asyncio.run(run())
+
+
+def test_taps_before_settle_fold_onto_db_state():
+    async def run():
+        rec = Recorder()
+        t = make(rec)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.admit(ROW, USER, DISLIKE, "card", now=100.1)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        await settle_loop()
+        assert rec.writes == [(ROW, USER, DISLIKE, "card")]
+    asyncio.run(run())
+
+
+def test_failed_first_toggle_with_taps_refreshes_card():
+    async def run():
+        rec = Recorder()
+        t = make(rec)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.admit(ROW, USER, LIKE, "card", now=100.1)  # ответили «Updating…»
+        t.settle(ROW, USER, LIKE, None, "card")
+        await settle_loop()
+        assert rec.writes == []
+        assert rec.refreshes == [(ROW, USER, "card")]
+        # серия снята — следующий клик снова идёт обычным путём
+        assert t.admit(ROW, USER, LIKE, "card", now=105.0).action == PASS
+    asyncio.run(run())
+
+
+def test_failed_first_toggle_without_taps_is_silent():
+    async def run():
+        rec = Recorder()
+        t = make(rec)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, None, "card")
+        await settle_loop()
+        assert rec.refreshes == []
+    asyncio.run(run())
+
+
+def test_failed_write_is_retried_with_final_state():
+    async def run():
+        rec = Recorder(fail=2)
+        t = make(rec, retries=3)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        t.admit(ROW, USER, DISLIKE, "card", now=100.2)
+        await settle_loop()
+        assert rec.writes == [(ROW, USER, DISLIKE, "card")]
+        assert rec.refreshes == []
+    asyncio.run(run())
+
+
+def test_click_during_retry_folds_into_same_write():
+    async def run():
+        rec = Recorder(fail=1)
+        t = make(rec, retry_delay=0.05)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        t.admit(ROW, USER, DISLIKE, "card", now=100.2)
+        await settle_loop()                      # первая запись упала, повтор ждёт
+        assert rec.writes == []
+        assert t.admit(ROW, USER, DISLIKE, "card", now=100.3).result == "removed"
+        await asyncio.sleep(0.1)
+        await settle_loop()
+        assert rec.writes == [(ROW, USER, None, "card")]
+    asyncio.run(run())
+
+
+def test_write_gives_up_after_retries_and_refreshes():
+    async def run():
+        rec = Recorder(fail=10)
+        t = make(rec, retries=2)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        t.admit(ROW, USER, DISLIKE, "card", now=100.2)
+        await settle_loop()
+        assert rec.fail == 10 - 3             # первая запись и два повтора
+        assert rec.refreshes == [(ROW, USER, "card")]
+        assert t.admit(ROW, USER, LIKE, "card", now=105.0).action == PASS
+    asyncio.run(run())
+
+
+def test_drain_writes_pending_without_retry():
+    async def run():
+        rec = Recorder(fail=1)
+        t = make(rec, collapse_window=60)
+        t.admit(ROW, USER, LIKE, "card", now=100.0)
+        t.settle(ROW, USER, LIKE, "added", "card")
+        t.admit(ROW, USER, DISLIKE, "card", now=100.2)
+        await t.drain()
+        assert rec.writes == []
+        assert rec.refreshes == [(ROW, USER, "card")]
+    asyncio.run(run())
+
+
+def test_shed_by_user_bucket_and_row_window():
+    async def run():
+        t = make(Recorder(), user_rate=1, user_burst=2, row_limit=3, row_window=10)
+        assert t.admit(ROW, 1, LIKE, now=100.0).action == PASS
+        assert t.admit(ROW, 1, LIKE, now=100.0).action == COLLAPSED
+        assert t.admit(ROW, 1, LIKE, now=100.0) == (SHED, None, "user")
+        assert t.admit(ROW, 2, LIKE, now=100.0).action == PASS
+        assert t.admit(ROW, 3, LIKE, now=100.0) == (SHED, None, "row")
+        # окно карточки ушло вперёд, ведро пользователя наполнилось
+        assert t.admit(ROW, 3, LIKE, now=111.0).action == PASS
+    asyncio.run(run())
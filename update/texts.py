@@ -0,0 +1,95 @@
+# texts.py
+"""
+Общие тела сообщений: otc.texts (миграция 10).
+
+Один и тот же пост продавец рассылает в десятки чатов — тело каждой копии
+хранится в otc.texts один раз под ключом otc.text_key(text_hash) (8 байт),
+в строках архива text = NULL. Тело единственного поста остаётся в строке:
+строка otc.texts с ключом в индексе стоит больше, чем короткий текст.
+
+Коллектор (save_message) ссылается на общее тело сразу, если оно уже есть.
+Новые повторы находит фоновый проход от водяного знака
+(otc.texts_state.last_id): пачка строк по id; тело строки, у которого в
+архиве есть вторая копия (индекс по ключу, миграция 15), — в otc.texts,
+совпавшие строки пачки и более ранние копии — text = NULL
+(db.SHARE_TEXTS_SQL). Так репост, пришедший через минуты или дни после
+первой копии, становится общим, как только проход до него доходит. Каждая
+пачка — своя короткая транзакция, так что после миграции 10 существующий
+архив переводится тем же проходом, без долгой блокировки таблицы. Место в
+таблице после первого прохода освобождает VACUUM FULL (или pg_repack),
+обычный VACUUM — только для новых строк.
+
+Коллектор крутит share_loop (TEXTS_SHARE_INTERVAL), вручную:
+    python update/texts.py run [--batch 10000]
+    python update/texts.py status
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from db import share_texts_batch, get_texts_status
+from metrics import Counter
+
+TEXTS_ROWS_TOTAL = Counter("otc_texts_rows_total", "Archive rows passed by the shared-texts watermark")
+TEXTS_CLEARED_TOTAL = Counter("otc_texts_cleared_total", "Archive rows whose body moved to otc.texts")
+
+TEXTS_SHARE_INTERVAL = float(os.getenv("TEXTS_SHARE_INTERVAL", "300"))  # 0 — не вести
+TEXTS_SHARE_BATCH = int(os.getenv("TEXTS_SHARE_BATCH", "10000"))
+TEXTS_SHARE_PAUSE = float(os.getenv("TEXTS_SHARE_PAUSE", "0.2"))
+
+
+def catch_up(batch: int = TEXTS_SHARE_BATCH, pause: float = 0.0, progress=None) -> int:
+    """Догнать водяной знак до конца архива; возвращает строк архива (0 — занято другим процессом)."""
+    total = 0
+    while True:
+        res = share_texts_batch(batch)
+        if not res or not res["rows"]:
+            break
+        total += res["rows"]
+        TEXTS_ROWS_TOTAL.inc(res["rows"])
+        TEXTS_CLEARED_TOTAL.inc(res["cleared"])
+        if progress:
+            progress(res)
+        if res["rows"] < batch:
+            break
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+async def share_loop(interval: float = TEXTS_SHARE_INTERVAL, batch: int = TEXTS_SHARE_BATCH,
+                     pause: float = TEXTS_SHARE_PAUSE) -> None:
+    """Фоновый проход в коллекторе; пауза между пачками — чтобы не мешать ингесту."""
+    while True:
+        try:
+            await asyncio.to_thread(catch_up, batch, pause)
+        except Exception as e:
+            print(f"[texts] ошибка прохода: {e}")
+        await asyncio.sleep(interval)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Move repeated message bodies from otc.messages_archive to otc.texts")
+    ap.add_argument("command", nargs="?", default="run", choices=("run", "status"))
+    ap.add_argument("--batch", type=int, default=TEXTS_SHARE_BATCH)
+    ap.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = ap.parse_args()
+
+    if args.command == "status":
+        st = get_texts_status()
+        behind = (st["max_id"] or 0) - st["last_id"]
+        print(f"watermark id={st['last_id']:,} ({max(behind, 0):,} ids behind)  "
+              f"otc.texts: {st['texts']:,} bodies, {st['texts_bytes'] / 1e6:.1f} MB  "
+              f"archive: {st['archive_bytes'] / 1e6:.1f} MB")
+        return
+
+    t0 = time.perf_counter()
+    rows = catch_up(args.batch, args.pause,
+                    progress=lambda r: print(f"  id<={r['last_id']}: +{r['texts']} bodies, "
+                                             f"{r['cleared']:,} of {r['rows']:,} rows cleared"))
+    print(f"passed {rows:,} archive rows in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# throttle.py
+"""
+Троттлинг кликов like/dislike в памяти бота — до похода в БД.
+
+  TokenBucket   — на пользователя: rate кликов в секунду, всплеск до burst;
+  SlidingWindow — на карточку (row_id): не больше limit кликов за window секунд;
+  ReactionThrottle — сворачивает быструю серию кликов одного пользователя по
+                  одной карточке в итоговое состояние.
+
+Первый клик серии идёт обычным путём (toggle_reaction), и после него
+известно, какая реакция лежит в БД. Повторы в пределах collapse_window
+отвечаются сразу по этому состоянию (added/removed/switched считаются так же,
+как в toggle_reaction), а в БД уходит одна запись итогового состояния после
+паузы — или не уходит ничего, если серия вернулась к исходному.
+
+Клики, на которые уже ответили, не теряются молча: неудачная запись итога
+повторяется с нарастающей паузой (retries), а если серию всё же пришлось
+бросить — первый toggle упал при накопленных кликах или кончились попытки —
+вызывается refresh(row_id, user_id, context), чтобы карточка показала то,
+что на самом деле лежит в БД.
+
+Состояние локально для процесса: при нескольких воркерах бота каждый
+троттлит свои апдейты.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple, Optional
+
+from metrics import Counter, Gauge
+
+log = logging.getLogger("throttle")
+
+REACTION_THROTTLE_TOTAL = Counter(
+    "otc_bot_reaction_throttle_total",
+    "Reaction clicks by throttle outcome (pass/collapsed/shed_user/shed_row) and collapsed writes "
+    "(flushed/noop/retry/failed/dropped)",
+    ("result",),
+)
+REACTION_THROTTLE_TRACKED = Gauge("otc_bot_reaction_throttle_tracked", "Click series held by the reaction throttle")
+
+PASS, COLLAPSED, SHED = "pass", "collapsed", "shed"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[Hashable, list[float]] = {}  # key -> [tokens, last]
+
+    def take(self, key: Hashable, now: float) -> bool:
+        b = self._buckets.get(key)
+        if b is None:
+            self._buckets[key] = [self.burst - 1, now]
+            return True
+        tokens = min(self.burst, b[0] + (now - b[1]) * self.rate)
+        b[1] = now
+        if tokens < 1:
+            b[0] = tokens
+            return False
+        b[0] = tokens - 1
+        return True
+
+    def sweep(self, now: float) -> None:
+        """Полные вёдра ничем не отличаются от отсутствующих — выкидываем."""
+        full = [k for k, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for k in full:
+            del self._buckets[k]
+
+
+class SlidingWindow:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits: dict[Hashable, deque] = {}
+
+    def hit(self, key: Hashable, now: float) -> bool:
+        q = self._hits.setdefault(key, deque())
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        if len(q) >= self.limit:
+            return False
+        q.append(now)
+        return True
+
+    def sweep(self, now: float) -> None:
+        idle = [k for k, q in self._hits.items() if not q or q[-1] <= now - self.window]
+        for k in idle:
+            del self._hits[k]
+
+
+def fold(state: Optional[int], reaction: int) -> tuple[Optional[int], str]:
+    """Один клик поверх текущей реакции — ровно как toggle_reaction."""
+    if state is None:
+        return reaction, "added"
+    if state == reaction:
+        return None, "removed"
+    return reaction, "switched"
+
+
+class Admission(NamedTuple):
+    action: str            # PASS — идти в БД; COLLAPSED — ответить сразу; SHED — отбросить
+    result: Optional[str]  # added/removed/switched для COLLAPSED, если состояние уже известно
+    reason: Optional[str] = None  # для SHED: user | row
+
+
+class _Series:
+    __slots__ = ("known", "db_state", "state", "taps", "last", "context", "timer", "failures")
+
+    def __init__(self, now: float):
+        self.known = False            # пока первый toggle не вернулся, состояние в БД неизвестно
+        self.db_state: Optional[int] = None
+        self.state: Optional[int] = None
+        self.taps: list[int] = []     # клики, пришедшие до того, как состояние стало известно
+        self.last = now
+        self.context: Any = None
+        self.timer: Optional[asyncio.Task] = None
+        self.failures = 0             # неудачные записи итога подряд
+
+
+class ReactionThrottle:
+    def __init__(
+        self,
+        apply: Callable[[int, int, Optional[int], Any], Awaitable[None]],
+        *,
+        user_rate: float = 1.0,
+        user_burst: float = 5,
+        row_limit: int = 60,
+        row_window: float = 10.0,
+        collapse_window: float = 1.5,
+        refresh: Optional[Callable[[int, int, Any], Awaitable[None]]] = None,
+        retries: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        """
+        apply(row_id, user_id, reaction_or_None, context) пишет итог свёрнутой серии;
+        refresh(row_id, user_id, context) — перерисовать карточку по БД, когда
+        отвеченные клики записать не удалось.
+        """
+        self.apply = apply
+        self.refresh = refresh
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.collapse_window = collapse_window
+        self.users = TokenBucket(user_rate, user_burst)
+        self.rows = SlidingWindow(row_limit, row_window)
+        self._series: dict[tuple[int, int], _Series] = {}
+        self._swept = time.monotonic()
+
+    def admit(self, row_id: int, user_id: int, reaction: int, context: Any = None,
+              now: Optional[float] = None) -> Admission:
+        now = now if now is not None else time.monotonic()
+        if now - self._swept > self.collapse_window * 20:
+            self.sweep(now)
+
+        if not self.users.take(user_id, now):
+            REACTION_THROTTLE_TOTAL.labels("shed_user").inc()
+            return Admission(SHED, None, "user")
+        if not self.rows.hit(row_id, now):
+            REACTION_THROTTLE_TOTAL.labels("shed_row").inc()
+            return Admission(SHED, None, "row")
+
+        key = (row_id, user_id)
+        s = self._series.get(key)
+        if s is not None and (not s.known or s.timer is not None or now - s.last <= self.collapse_window):
+            s.last = now
+            s.context = context
+            result = None
+            if s.known:
+                s.state, result = fold(s.state, reaction)
+                self._arm(key, s)
+            else:
+                s.taps.append(reaction)
+            REACTION_THROTTLE_TOTAL.labels("collapsed").inc()
+            return Admission(COLLAPSED, result)
+
+        self._series[key] = _Series(now)
+        REACTION_THROTTLE_TRACKED.set(len(self._series))
+        REACTION_THROTTLE_TOTAL.labels("pass").inc()
+        return Admission(PASS, None)
+
+    def settle(self, row_id: int, user_id: int, reaction: int, result: Optional[str], context: Any = None) -> None:
+        """Итог toggle_reaction для клика, пропущенного admit; result=None — запись не удалась."""
+        key = (row_id, user_id)
+        s = self._series.get(key)
+        if s is None:
+            return
+        if result is None:
+            self._series.pop(key, None)
+            if s.taps:
+                # состояние в БД неизвестно — свернуть ответы «Updating…» не во что;
+                # карточка хотя бы покажет то, что лежит в БД
+                REACTION_THROTTLE_TOTAL.labels("dropped").inc(len(s.taps))
+                asyncio.ensure_future(self._refresh(key, s.context or context))
+            return
+        s.db_state = s.state = None if result == "removed" else reaction
+        s.known = True
+        for r in s.taps:
+            s.state, _ = fold(s.state, r)
+        s.taps.clear()
+        if s.context is None:
+            s.context = context
+        if s.state != s.db_state:
+            self._arm(key, s)
+
+    def _arm(self, key: tuple[int, int], s: _Series) -> None:
+        if s.timer is None:
+            s.timer = asyncio.ensure_future(self._flush_later(key, s))
+
+    async def _flush_later(self, key: tuple[int, int], s: _Series) -> None:
+        # ждём тишины: каждый новый клик серии отодвигает запись
+        while True:
+            wait = s.last + self.collapse_window - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self._flush(key, s)
+
+    async def _retry_later(self, key: tuple[int, int], s: _Series, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._flush_later(key, s)
+
+    async def _flush(self, key: tuple[int, int], s: _Series, retry: bool = True) -> None:
+        """Записать итог серии; при ошибке — повтор через retry_delay * 2^n, после retries — refresh."""
+        try:
+            if s.state == s.db_state:
+                # серия вернулась к тому, что уже лежит в БД
+                REACTION_THROTTLE_TOTAL.labels("noop").inc()
+            while s.state != s.db_state:
+                target = s.state
+                try:
+                    await self.apply(key[0], key[1], target, s.context)
+                except Exception:
+                    log.exception("collapsed reaction write failed row_id=%s user_id=%s", *key)
+                    s.failures += 1
+                    break
+                s.db_state = target
+                s.failures = 0
+                REACTION_THROTTLE_TOTAL.labels("flushed").inc()
+        finally:
+            s.timer = None
+        if s.state == s.db_state:
+            return
+        if retry and s.failures <= self.retries:
+            # серия остаётся в памяти: новые клики сворачиваются в тот же итог
+            REACTION_THROTTLE_TOTAL.labels("retry").inc()
+            s.timer = asyncio.ensure_future(
+                self._retry_later(key, s, self.retry_delay * 2 ** (s.failures - 1)))
+            return
+        REACTION_THROTTLE_TOTAL.labels("failed").inc()
+        if self._series.get(key) is s:
+            del self._series[key]
+            REACTION_THROTTLE_TRACKED.set(len(self._series))
+        await self._refresh(key, s.context)
+
+    async def _refresh(self, key: tuple[int, int], context: Any) -> None:
+        if self.refresh is None or context is None:
+            return
+        try:
+            await self.refresh(key[0], key[1], context)
+        except Exception:
+            log.exception("card refresh after dropped clicks failed row_id=%s user_id=%s", *key)
+
+    def sweep(self, now: float) -> None:
+        self._swept = now
+        self.users.sweep(now)
+        self.rows.sweep(now)
+        idle = [k for k, s in self._series.items()
+                if s.known and s.timer is None and now - s.last > self.collapse_window]
+        for k in idle:
+            del self._series[k]
+        REACTION_THROTTLE_TRACKED.set(len(self._series))
+
+    async def drain(self) -> None:
+        """При остановке: записать отложенные серии, не дожидаясь паузы."""
+        pending = [(k, s) for k, s in self._series.items() if s.timer is not None]
+        for _, s in pending:
+            s.timer.cancel()
+        for key, s in pending:
+            s.timer = None
+            # при остановке без повторов: не удалось — перерисовать карточку
+            await self._flush(key, s, retry=False)
@@ -1,6 +1,9 @@
 from telethon.tl.functions.messages import GetDialogFiltersRequest
 from telethon.tl.types import DialogFilter
+import asyncio
 import logging
+from classifier import classify
+from scrubber import clean_text  # noqa: F401 — реэкспорт для старых импортов
 import re
 import json
 from pathlib import Path
@@ -9,15 +12,20 @@ logger = logging.getLogger("buy_detector")
 
 
 
-async def get_chats_from_folder(client, folder_name: str) -> set[int]:
+async def get_chats_from_folder(client, folder_name: str, *, concurrency: int = 16,
+                                raise_on_error: bool = False) -> set[int]:
     """
     Возвращает chat_id всех чатов, явно включённых в папку (фильтр) с указанным именем.
     Учитывает, что title может быть TextWithEntities.
+    peer_id резолвятся параллельно (не больше concurrency запросов сразу).
+    raise_on_error — пробросить ошибку запроса фильтров, а не вернуть пустое множество.
     """
     try:
         res = await client(GetDialogFiltersRequest())
         filters = getattr(res, "filters", []) or []
     except Exception as e:
+        if raise_on_error:
+            raise
         logger.error(f"Ошибка при получении фильтров: {e}")
         return set()
 
@@ -34,13 +42,20 @@ async def get_chats_from_folder(client, folder_name: str) -> set[int]:
         if title_str != target:
             continue
 
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _resolve(peer):
+            async with sem:
+                return await client.get_peer_id(peer)
+
+        peers = list(getattr(f, "include_peers", []) or [])
+        results = await asyncio.gather(*(_resolve(p) for p in peers), return_exceptions=True)
         chat_ids: set[int] = set()
-        for peer in getattr(f, "include_peers", []) or []:
-            try:
-                pid = await client.get_peer_id(peer)
-                chat_ids.add(pid)
-            except Exception as e:
-                logger.debug(f"Не смог получить peer_id для {peer}: {e}")
+        for peer, pid in zip(peers, results):
+            if isinstance(pid, Exception):
+                logger.debug(f"Не смог получить peer_id для {peer}: {pid}")
+                continue
+            chat_ids.add(pid)
         return chat_ids
 
     logger.warning(f"Папка '{folder_name}' не найдена или пуста.")
@@ -99,27 +114,10 @@ async def resolve_username(user_client, user_id: int) -> str | None:
     logger.warning(f"Could not resolve username for {user_id}")
     return None
 
-BUY_PATTERNS = (
-    r"\bwtb\b", r"\bbuy\b", r"#wtb\b",
-    r"\bneed\b", r"\blooking\s*for\b",
-)
-_buy_re = re.compile("|".join(BUY_PATTERNS), re.I)
 def is_buy_message(text: str) -> bool:
-    """Простая эвристика распознавания WTB/покупки."""
-    if not text:
-        return False
-    # игнорируем типичные WTS-маркеры
-    if re.search(r"\bwts\b|#wts\b|\bsell(ing)?\b", text, re.I):
-        return False
-    return bool(_buy_re.search(text))
-
-def clean_text(text: str) -> str:
-    """Убираем контакты: @юзеры, ссылки, телефоны."""
-    t = text or ""
-    t = re.sub(r"@\w{3,32}", "[hidden]", t)               # @username
-    t = re.sub(r"https?://\S+|t\.me/\S+", "[hidden]", t)  # URL + t.me
-    t = re.sub(r"\+?\d[\d\-\s()]{7,}", "[hidden]", t)     # телефоны
-    return t.strip()
+    """WTB/покупка — см. classifier.classify (единый словарь для всех)."""
+    return classify(text).is_wtb
+
 
 
 def compute_rating_percent(likes: int, dislikes: int) -> int:
@@ -155,6 +153,9 @@ import os
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 TOPICS_PATH = os.path.join(CURRENT_DIR, "topics.json")
+if not os.path.exists(TOPICS_PATH):
+    # в репозитории topics.json лежит уровнем выше, рядом с t_collector.py
+    TOPICS_PATH = os.path.join(os.path.dirname(CURRENT_DIR), "topics.json")
 
 TOPIC_MAP, GENERAL_TOPIC_ID = load_topics_map(TOPICS_PATH, general_topic_id=1)
 
@@ -0,0 +1,130 @@
+# watchlist.py
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from telethon import events
+from telethon.tl.types import UpdateDialogFilter, UpdateDialogFilters, UpdateDialogFilterOrder
+
+from tools.t import get_chats_from_folder
+
+log = logging.getLogger("watchlist")
+
+DIALOG_FILTER_UPDATES = (UpdateDialogFilter, UpdateDialogFilters, UpdateDialogFilterOrder)
+
+
+class WatchList:
+    """
+    Набор отслеживаемых чатов из папки Telegram, который живёт весь процесс.
+
+    На старте берём набор из кэша на диске (без запросов к Telegram), затем
+    сверяем с папкой: периодически и по UpdateDialogFilter — когда папку
+    правят в клиенте. Множество self.chats меняется на месте, поэтому все,
+    кто держит на него ссылку (DeletionTracker, autopost), видят свежий набор.
+    """
+
+    def __init__(
+        self,
+        client,
+        folder_name: str,
+        *,
+        cache_path: Optional[str] = None,
+        refresh_interval: float = 600.0,
+        debounce: float = 2.0,
+        on_change: Optional[Callable[[set[int], set[int]], None]] = None,
+    ):
+        self.client = client
+        self.folder_name = folder_name
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self.debounce = debounce
+        self.on_change = on_change
+
+        self.chats: set[int] = set()
+        self._trigger = asyncio.Event()
+
+    # ---------- кэш ----------
+    def load_cache(self) -> bool:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            log.warning("watch cache unreadable %s: %s", self.cache_path, e)
+            return False
+        if data.get("folder") != self.folder_name or not data.get("chat_ids"):
+            return False
+        self.chats.update(int(c) for c in data["chat_ids"])
+        return True
+
+    def _save_cache(self) -> None:
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"folder": self.folder_name, "chat_ids": sorted(self.chats),
+                           "updated_at": int(time.time())}, f)
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            log.warning("watch cache not saved %s: %s", self.cache_path, e)
+
+    # ---------- сверка с папкой ----------
+    async def refresh(self) -> bool:
+        """Перечитывает папку. True — набор изменился."""
+        try:
+            fresh = await get_chats_from_folder(self.client, self.folder_name, raise_on_error=True)
+        except Exception as e:
+            log.warning("folder refresh failed, keeping %d chats: %s", len(self.chats), e)
+            return False
+        if not fresh:
+            # папку не нашли/пустая — скорее ошибка, чем намерение; старый набор не трогаем
+            log.warning("folder '%s' is empty or missing, keeping %d chats", self.folder_name, len(self.chats))
+            return False
+
+        added, removed = fresh - self.chats, self.chats - fresh
+        if not added and not removed:
+            return False
+        self.chats -= removed
+        self.chats |= added
+        self._save_cache()
+        print(f"[watch] папка {self.folder_name}: +{len(added)} −{len(removed)}, всего {len(self.chats)}")
+        if self.on_change:
+            self.on_change(added, removed)
+        return True
+
+    async def start(self) -> None:
+        """Кэш, если есть — сразу; иначе ждём первую сверку."""
+        if self.load_cache():
+            print(f"[watch] из кэша: {len(self.chats)} чатов, сверяю с папкой в фоне")
+            self.trigger()
+        else:
+            await self.refresh()
+
+    def trigger(self) -> None:
+        self._trigger.set()
+
+    def install(self) -> None:
+        """Подписка на правки папок в клиенте."""
+        @self.client.on(events.Raw(DIALOG_FILTER_UPDATES))
+        async def _on_filter_update(update):
+            self.trigger()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._trigger.wait(), timeout=self.refresh_interval)
+                # правки папки приходят пачкой — ждём, пока уляжется
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._trigger.clear()
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("watch refresh error")